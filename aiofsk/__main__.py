@@ -1,5 +1,12 @@
+import sys
+import json
+import typing
 import asyncio
+import argparse
 from aiofsk.transport import AFSKTransport
+from aiofsk.file import iter_decode_wav_files
+from aiofsk.channel import ChannelConfig
+from aiofsk.bench import run_benchmarks, DEFAULT_SNRS, DEFAULT_GOODPUT_CHANNEL
 
 
 async def text_console(modem):
@@ -15,7 +22,7 @@ async def text_console(modem):
         modem.stop()
 
 
-async def main():
+async def console():
     # modem = AFSKTransport(baud=300, loopback=False, modulator='nrzi')
     modem = AFSKTransport(baud=300, loopback=False, modulator='standard')
 
@@ -27,5 +34,71 @@ async def main():
             terminal_task.cancel()
 
 
+def decode(args: argparse.Namespace):
+    for _, data in iter_decode_wav_files(
+            args.wav_paths, max_workers=args.workers, segment_frames=args.segment_frames, baud=args.baud,
+            modulator=args.modulator, demodulator=args.demodulator, codec=args.fec,
+            interleave_depth=args.interleave_depth):
+        sys.stdout.buffer.write(data)
+        sys.stdout.buffer.flush()
+
+
+def bench(args: argparse.Namespace):
+    channel = ChannelConfig(
+        snr=args.channel_snr, clock_offset=args.clock_offset, jitter=args.jitter, drop_rate=args.drop_rate,
+        band=tuple(args.band) if args.band else None, seed=args.seed
+    )
+    options = {}
+    if args.baud:
+        options['bauds'] = args.baud
+    if args.modulator:
+        options['modulators'] = args.modulator
+    report = run_benchmarks(
+        snrs=args.snr or DEFAULT_SNRS, channel=channel, demodulator=args.demodulator, seed=args.seed, **options
+    )
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+
+
+def main(argv: typing.Optional[typing.List[str]] = None):
+    parser = argparse.ArgumentParser(prog='aiofsk')
+    commands = parser.add_subparsers(dest='command')
+    commands.add_parser('console', help='text console over the sound card (default)')
+    decode_parser = commands.add_parser('decode', help='decode wav recordings in parallel to stdout')
+    decode_parser.add_argument('wav_paths', nargs='+')
+    decode_parser.add_argument('--baud', type=int, default=300)
+    decode_parser.add_argument('--modulator', default='standard')
+    decode_parser.add_argument('--demodulator', default=None, help="defaults to the modulator's")
+    decode_parser.add_argument('--fec', default='hamming')
+    decode_parser.add_argument('--interleave-depth', type=int, default=1)
+    decode_parser.add_argument('--workers', type=int, default=None, help='defaults to the number of cpus')
+    decode_parser.add_argument('--segment-frames', type=int, default=None,
+                               help='split recordings into segments of about this many symbol frames')
+    bench_parser = commands.add_parser('bench', help='benchmark over a simulated channel, report as json')
+    bench_parser.add_argument('--output', '-o', default=None, help='defaults to stdout')
+    bench_parser.add_argument('--baud', type=int, action='append', help='repeat for several, defaults to all')
+    bench_parser.add_argument('--modulator', action='append', help='repeat for several, defaults to all')
+    bench_parser.add_argument('--demodulator', default=None, help="defaults to the modulator's")
+    bench_parser.add_argument('--snr', type=float, action='append', help='dB points of the bit error rate curves')
+    bench_parser.add_argument('--channel-snr', type=float, default=DEFAULT_GOODPUT_CHANNEL.snr,
+                              help='dB of noise on the goodput channel')
+    bench_parser.add_argument('--clock-offset', type=float, default=DEFAULT_GOODPUT_CHANNEL.clock_offset, help='ppm')
+    bench_parser.add_argument('--jitter', type=float, default=DEFAULT_GOODPUT_CHANNEL.jitter, help='seconds rms')
+    bench_parser.add_argument('--drop-rate', type=float, default=DEFAULT_GOODPUT_CHANNEL.drop_rate)
+    bench_parser.add_argument('--band', type=float, nargs=2, default=DEFAULT_GOODPUT_CHANNEL.band,
+                              metavar=('LOW', 'HIGH'), help='Hz pass band')
+    bench_parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    if args.command == 'decode':
+        decode(args)
+    elif args.command == 'bench':
+        bench(args)
+    else:
+        asyncio.run(console())
+
+
 if __name__ == '__main__':
-    asyncio.run(main())
+    main()
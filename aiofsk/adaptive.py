@@ -0,0 +1,270 @@
+import math
+import struct
+import typing
+import asyncio
+import logging
+import numpy as np
+
+from aiofsk.modulation import ToneTable
+
+if typing.TYPE_CHECKING:
+    from aiofsk.transport import AFSKTransport
+
+log = logging.getLogger(__name__)
+
+TRAIN, REPORT, SWITCH, SWITCH_ACK = range(4)
+MESSAGE = struct.Struct('<B')
+REPORT_BODY = struct.Struct('<hH')  # snr in hundredths of a dB, corrected bits per 65535 demodulated bits
+UNKNOWN_SNR = -2 ** 15  # reported until something has been heard at the current rate
+SWITCH_BODY = struct.Struct('<H')  # baud, followed by the name of the codec
+TRAINING_SEQUENCE = np.random.default_rng(0x7e).bytes(32)
+
+MAX_SNR = 60.0  # dB, reported for a link without measurable noise
+DEFAULT_REQUIRED_SNR = 15.0  # dB of symbol snr to run at a rate
+DEFAULT_MARGIN = 3.0  # dB on top of the required snr to step up to a faster rate
+DEFAULT_MAX_CORRECTION_RATE = 0.01  # share of the bits the codec corrects before stepping down
+DEFAULT_REPORT_INTERVAL = 2.0  # seconds
+FALLBACK_INTERVALS = 3  # report intervals without hearing the other end before falling back to the first rate
+
+
+class Rate(typing.NamedTuple):
+    baud: int
+    fec: str
+
+
+def _tone_fit(tone_table: ToneTable) -> typing.Tuple[np.ndarray, np.ndarray]:
+    """
+    :return: the cosine and sine of each tone as (tones, 2, frame_size), and the inverse of their gram matrices
+    """
+    basis = tone_table.quadrature.astype(np.float64).transpose(1, 0, 2)
+    return basis, np.linalg.pinv(basis @ basis.transpose(0, 2, 1))
+
+
+def _estimate_snr(frames: np.ndarray, basis: np.ndarray, inverse_gram: np.ndarray) -> typing.Tuple[float, float]:
+    frame_size = basis.shape[2]
+    frames = np.asarray(frames, dtype=np.float64).reshape(-1, frame_size)
+    correlations = np.einsum('fn,tin->fti', frames, basis)
+    fitted = np.einsum('fti,tij,ftj->ft', correlations, inverse_gram, correlations).max(axis=1)
+    noise = np.maximum((frames * frames).sum(axis=1) - fitted, 0.0) / max(frame_size - 2, 1)
+    # two of the noise's degrees of freedom are in the fit
+    return float((fitted - 2 * noise).sum()), float(noise.sum())
+
+
+def estimate_snr(frames: np.ndarray, tone_table: ToneTable) -> typing.Tuple[float, float]:
+    """
+    Symbol energy and noise power of a block of frames. Each frame is fitted with the tone, at any phase, that
+    explains the most of it, what the fit leaves over is noise. Fitting each tone on its own keeps the estimate
+    good when the tones are not orthogonal over a frame, such as at the fastest bauds.
+
+    The ratio is the snr per symbol, the snr per sample times the frame size, so for the same channel it is 3 dB
+    lower at twice the baud rate.
+
+    :return: (signal, noise), the symbol energy and the noise power per sample summed over the frames
+    """
+    return _estimate_snr(frames, *_tone_fit(tone_table))
+
+
+class LinkQuality:
+    """
+    Smoothed snr per symbol and share of the bits the codec corrected, of what this end hears at one rate
+
+    measure is the expensive part and only reads the frames, so it can run on the executor demodulating them, add
+    keeps the averages and runs on the event loop.
+    """
+
+    def __init__(self, tone_table: ToneTable, baud: int, smoothing: float = 0.25):
+        self._basis, self._inverse_gram = _tone_fit(tone_table)
+        self.baud = baud
+        self._smoothing = smoothing
+        self._signal = 0.0
+        self._noise = 0.0
+        self.correction_rate = 0.0
+        self.bits = 0
+
+    def _average(self, average: float, value: float) -> float:
+        return value if not self.bits else average + self._smoothing * (value - average)
+
+    def measure(self, frames: np.ndarray) -> typing.Tuple[float, float]:
+        """
+        :return: (signal, noise) of the frames, see estimate_snr
+        """
+        return _estimate_snr(frames, self._basis, self._inverse_gram)
+
+    def observe(self, frames: np.ndarray, bits: int, corrected: int):
+        if bits:
+            self.add(self.measure(frames), bits, corrected)
+
+    def add(self, measured: typing.Tuple[float, float], bits: int, corrected: int):
+        if not bits:
+            return
+        signal, noise = measured
+        self._signal = self._average(self._signal, signal)
+        self._noise = self._average(self._noise, noise)
+        self.correction_rate = self._average(self.correction_rate, corrected / bits)
+        self.bits += bits
+
+    @property
+    def snr(self) -> typing.Optional[float]:
+        """
+        dB, or None until something has been heard
+        """
+        if not self.bits:
+            return None
+        if self._noise <= 0 or self._signal / self._noise > 10 ** (MAX_SNR / 10):
+            return MAX_SNR
+        return 10 * math.log10(max(self._signal / self._noise, 1e-6))
+
+
+class RateController:
+    """
+    Keeps both ends of a reliable link at the fastest rate it supports
+
+    Rates are negotiated with control frames of the arq. Each end sends a training sequence when it connects and a
+    report of how well it hears the other end every report interval. The end with the lower station id decides:
+    from the worse of the two ends' snr, scaled to each rate, it picks the fastest rate with the required snr, and
+    it steps down when the codec corrects too much. It proposes the switch, the other end acknowledges and switches
+    as soon as the acknowledgement is on the air, then the decider switches. If either end stops hearing the
+    other, such as when the acknowledgement was lost, it falls back to the first rate where they meet again.
+
+    :param rates: from slowest to fastest, the first is the rate the transport starts and falls back at
+    """
+
+    def __init__(self, transport: 'AFSKTransport', rates: typing.Sequence[Rate],
+                 required_snr: float = DEFAULT_REQUIRED_SNR, margin: float = DEFAULT_MARGIN,
+                 max_correction_rate: float = DEFAULT_MAX_CORRECTION_RATE,
+                 report_interval: float = DEFAULT_REPORT_INTERVAL):
+        self._transport = transport
+        self.rates = [Rate(*rate) for rate in rates]
+        self.required_snr = required_snr
+        self.margin = margin
+        self.max_correction_rate = max_correction_rate
+        self.report_interval = report_interval
+        self.peer: typing.Optional[int] = None
+        self.peer_snr: typing.Optional[float] = None
+        self.peer_correction_rate = 0.0
+        self.switches = 0
+        self._heard = 0.0
+        self._acknowledged: typing.Optional[asyncio.Future] = None
+        self._switching = False
+        self._negotiation: typing.Optional[asyncio.Task] = None
+
+    @property
+    def _arq(self):
+        return self._transport.arq
+
+    @property
+    def deciding(self) -> bool:
+        return self.peer is not None and self._arq.station <= self.peer
+
+    def _send(self, message: int, body: bytes = b'') -> asyncio.Future:
+        return self._arq.send_control(MESSAGE.pack(message) + body)
+
+    def _report(self) -> asyncio.Future:
+        quality = self._transport.link_quality
+        snr = UNKNOWN_SNR if quality.snr is None else int(round(quality.snr * 100))
+        return self._send(REPORT, REPORT_BODY.pack(snr, min(int(round(quality.correction_rate * 65535)), 65535)))
+
+    def choose(self, snr: float, correction_rate: float) -> Rate:
+        """
+        :param snr: dB of symbol snr measured at the current rate
+        :param correction_rate: share of the bits the codec corrected at the current rate
+        """
+        current_rate = self._transport.rate
+        current = self.rates.index(current_rate) if current_rate in self.rates else 0
+        best = 0
+        for i, rate in enumerate(self.rates):
+            predicted = snr + 10 * math.log10(current_rate.baud / rate.baud)
+            if predicted >= self.required_snr + (self.margin if i > current else 0.0):
+                best = i
+        if correction_rate > self.max_correction_rate:
+            best = min(best, max(current - 1, 0))
+        return self.rates[best]
+
+    def _decide(self):
+        quality = self._transport.link_quality
+        if quality.snr is None or self.peer_snr is None or self._switching:
+            return
+        rate = self.choose(min(quality.snr, self.peer_snr), max(quality.correction_rate, self.peer_correction_rate))
+        if rate != self._transport.rate:
+            self._switching = True
+            self._negotiation = asyncio.ensure_future(self._propose(rate))
+
+    async def _propose(self, rate: Rate):
+        try:
+            self._acknowledged = asyncio.get_event_loop().create_future()
+            sent = self._send(SWITCH, SWITCH_BODY.pack(rate.baud) + rate.fec.encode())
+            if self.peer == self._arq.station:
+                # in loopback we are the other end
+                await sent
+                await self._switch(rate)
+                return
+            try:
+                acknowledged = await asyncio.wait_for(self._acknowledged, self.report_interval * FALLBACK_INTERVALS)
+            except asyncio.TimeoutError:
+                # if the other end switched anyway both ends fall back
+                log.warning("switch to %i baud was not acknowledged", rate.baud)
+                return
+            if acknowledged == rate:
+                await self._switch(rate)
+        finally:
+            self._acknowledged = None
+            self._switching = False
+
+    async def _accept(self, rate: Rate):
+        self._switching = True
+        try:
+            await self._send(SWITCH_ACK, SWITCH_BODY.pack(rate.baud) + rate.fec.encode())
+            await self._switch(rate)
+        finally:
+            self._switching = False
+
+    async def _switch(self, rate: Rate):
+        if rate == self._transport.rate:
+            return
+        log.info("switching to %i baud with %s", rate.baud, rate.fec)
+        await self._transport.set_rate(rate.baud, rate.fec)
+        self.switches += 1
+        self.peer_snr = None
+
+    def control_received(self, station: int, payload: bytes):
+        if len(payload) < MESSAGE.size:
+            return
+        self.peer = station
+        self._heard = asyncio.get_event_loop().time()
+        message, body = MESSAGE.unpack_from(payload)[0], payload[MESSAGE.size:]
+        if message == TRAIN:
+            self._report()
+        elif message == REPORT and len(body) >= REPORT_BODY.size:
+            snr, corrections = REPORT_BODY.unpack_from(body)
+            self.peer_snr = None if snr == UNKNOWN_SNR else snr / 100
+            self.peer_correction_rate = corrections / 65535
+            if self.deciding:
+                self._decide()
+        elif message in (SWITCH, SWITCH_ACK) and len(body) >= SWITCH_BODY.size:
+            rate = Rate(SWITCH_BODY.unpack_from(body)[0], body[SWITCH_BODY.size:].decode())
+            if rate not in self.rates:
+                log.warning("ignoring a switch to unsupported rate %s", rate)
+            elif message == SWITCH and not self._switching and rate != self._transport.rate:
+                self._negotiation = asyncio.ensure_future(self._accept(rate))
+            elif message == SWITCH_ACK and self._acknowledged and not self._acknowledged.done():
+                self._acknowledged.set_result(rate)
+
+    async def run(self):
+        """
+        Train, report and fall back until cancelled
+        """
+        loop = asyncio.get_event_loop()
+        self._heard = loop.time()
+        self._send(TRAIN, TRAINING_SEQUENCE)
+        try:
+            while True:
+                await asyncio.sleep(self.report_interval)
+                silent = loop.time() - self._heard
+                if silent > self.report_interval * FALLBACK_INTERVALS and self._transport.rate != self.rates[0]:
+                    log.warning("nothing heard for %.1fs, falling back to %i baud", silent, self.rates[0].baud)
+                    self._heard = loop.time()
+                    await self._switch(self.rates[0])
+                self._report()
+        finally:
+            if self._negotiation and not self._negotiation.done():
+                self._negotiation.cancel()
@@ -0,0 +1,266 @@
+import typing
+import struct
+import asyncio
+import logging
+
+log = logging.getLogger(__name__)
+
+DATA, ACK, CONTROL = 0, 1, 2
+HEADER = struct.Struct('<BBB')  # kind, station, sequence number (DATA), next expected sequence number (ACK) or 0
+SEQUENCE_SPACE = 256
+
+
+class RTTEstimator:
+    """
+    Jacobson/Karels smoothed round trip time and retransmission timeout
+    """
+
+    def __init__(self, initial_rto: float = 1.0, min_rto: float = 0.05, max_rto: float = 30.0):
+        self.srtt: typing.Optional[float] = None
+        self.rttvar = 0.0
+        self.rto = initial_rto
+        self._min_rto = min_rto
+        self._max_rto = max_rto
+
+    def _clamp(self, rto: float) -> float:
+        return min(max(rto, self._min_rto), self._max_rto)
+
+    def update(self, sample: float):
+        if self.srtt is None:
+            self.srtt, self.rttvar = sample, sample / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - sample)
+            self.srtt = 0.875 * self.srtt + 0.125 * sample
+        self.rto = self._clamp(self.srtt + 4 * self.rttvar)
+
+    def backoff(self):
+        self.rto = self._clamp(self.rto * 2)
+
+
+class _Outstanding:
+    __slots__ = ('payload', 'sent_at', 'sent_order', 'retransmitted', 'due')
+
+    def __init__(self, payload: bytes):
+        self.payload = payload
+        self.sent_at = 0.0
+        self.sent_order = 0
+        self.retransmitted = False
+        self.due = True  # waiting to be (re)transmitted
+
+
+class SelectiveRepeatARQ:
+    """
+    Selective repeat ARQ over an unreliable link that delivers whole frames, such as the hdlc framing
+
+    Data is sent in sequence numbered frames, up to window frames ahead of the oldest unacknowledged one, and every
+    frame the link can fit goes out in one burst to keep half duplex turnarounds down. The receiver answers each
+    burst with the next sequence number it expects and a bitmap of the frames it holds past that. Frames that a
+    later acknowledged frame overtook are resent at once, anything else is resent after the retransmission timeout.
+
+    :param transmit: coroutine sending a burst of frames, returning once they are on the air
+    :param station: id put in every frame, frames carrying our own id are echoes and ignored when ignore_own is set
+    :param on_control: called with the station and payload of control frames, which carry messages for the layer
+                       above the arq such as rate negotiation
+    """
+
+    def __init__(self, transmit: typing.Callable[[typing.List[bytes]], typing.Awaitable[None]], station: int,
+                 window: int = 32, segment_size: int = 253, ignore_own: bool = True,
+                 rtt: typing.Optional[RTTEstimator] = None,
+                 on_control: typing.Optional[typing.Callable[[int, bytes], None]] = None):
+        assert 0 < window <= SEQUENCE_SPACE // 2, "the window can be at most half the sequence space"
+        self._transmit = transmit
+        self.station = station
+        self.window = window
+        self.segment_size = segment_size
+        self._ignore_own = ignore_own
+        self._on_control = on_control
+        self._control: typing.List[typing.Tuple[bytes, asyncio.Future]] = []
+        self.rtt = rtt or RTTEstimator()
+        # timed by the loop's clock, so a virtual clock loop runs the timeouts in virtual time
+        self._loop = asyncio.get_event_loop()
+        self.received: asyncio.Queue = asyncio.Queue()
+        self.transmissions = 0  # data frames sent, retransmissions included
+        self.retransmissions = 0
+        # sender
+        self._segments: typing.List[bytes] = []
+        self._outstanding: typing.Dict[int, _Outstanding] = {}
+        self._base = 0  # oldest unacknowledged sequence number, not wrapped
+        self._next_sequence = 0
+        self._sent_order = 0
+        self._wakeup = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        # receiver
+        self._expected = 0
+        self._out_of_order: typing.Dict[int, bytes] = {}
+        self._ack_pending = False
+
+    def write(self, data: bytes):
+        for i in range(0, len(data), self.segment_size):
+            self._segments.append(data[i:i + self.segment_size])
+        if data:
+            self._idle.clear()
+            self._wakeup.set()
+
+    @property
+    def buffered_size(self) -> int:
+        """
+        Bytes written that have not been acknowledged yet
+        """
+        unacknowledged = sum(len(outstanding.payload) for outstanding in self._outstanding.values())
+        return sum(map(len, self._segments)) + unacknowledged
+
+    def send_control(self, payload: bytes) -> asyncio.Future:
+        """
+        Send a control frame with the next burst, control frames are not acknowledged or resent
+
+        :return: future done once the frame is on the air
+        """
+        sent = self._loop.create_future()
+        self._control.append((HEADER.pack(CONTROL, self.station, 0) + payload, sent))
+        self._wakeup.set()
+        return sent
+
+    async def wait_acknowledged(self):
+        """
+        Wait until everything written has been acknowledged
+        """
+        await self._idle.wait()
+
+    def _unwrap(self, sequence: int, reference: int) -> int:
+        """
+        :return: the sequence number nearest to and at least window before reference
+        """
+        return reference + (sequence - reference + self.window) % SEQUENCE_SPACE - self.window
+
+    def _make_ack(self) -> bytes:
+        bitmap = bytearray((self.window + 7) // 8)
+        for sequence in self._out_of_order:
+            offset = sequence - self._expected - 1
+            bitmap[offset // 8] |= 1 << (offset % 8)
+        return HEADER.pack(ACK, self.station, self._expected % SEQUENCE_SPACE) + bytes(bitmap)
+
+    def _receive_data(self, sequence: int, payload: bytes):
+        sequence = self._unwrap(sequence, self._expected)
+        self._ack_pending = True
+        if not self._expected <= sequence < self._expected + self.window:
+            return  # a duplicate of something delivered already, the ack will tell the sender
+        self._out_of_order[sequence] = payload
+        while self._expected in self._out_of_order:
+            self.received.put_nowait(self._out_of_order.pop(self._expected))
+            self._expected += 1
+
+    def _receive_ack(self, expected: int, bitmap: bytes):
+        now = self._loop.time()
+        acknowledged = set(range(self._base, self._unwrap(expected, self._base)))
+        for offset in range(min(len(bitmap) * 8, self.window)):
+            if bitmap[offset // 8] >> (offset % 8) & 1:
+                acknowledged.add(self._unwrap(expected, self._base) + 1 + offset)
+        latest_order, rtt_sample = 0, None
+        for sequence in sorted(acknowledged):
+            outstanding = self._outstanding.pop(sequence, None)
+            if outstanding is None or outstanding.due:
+                continue
+            latest_order = max(latest_order, outstanding.sent_order)
+            if not outstanding.retransmitted:  # Karn's algorithm
+                rtt_sample = now - outstanding.sent_at
+        if rtt_sample is not None:
+            self.rtt.update(rtt_sample)
+        for outstanding in self._outstanding.values():
+            if not outstanding.due and outstanding.sent_order < latest_order:
+                # overtaken by a frame that made it, the link keeps order so this one was lost
+                outstanding.due = outstanding.retransmitted = True
+        while self._base < self._next_sequence and self._base not in self._outstanding:
+            self._base += 1
+        if not self._outstanding and not self._segments:
+            self._idle.set()
+        self._wakeup.set()
+
+    def receive(self, frame: bytes):
+        if len(frame) < HEADER.size:
+            return
+        kind, station, sequence = HEADER.unpack_from(frame)
+        if self._ignore_own and station == self.station:
+            return
+        if kind == DATA:
+            self._receive_data(sequence, frame[HEADER.size:])
+        elif kind == ACK:
+            self._receive_ack(sequence, frame[HEADER.size:])
+        elif kind == CONTROL and self._on_control:
+            self._on_control(station, frame[HEADER.size:])
+
+    def _timeout(self) -> typing.Optional[float]:
+        """
+        :return: seconds until the next retransmission timeout, or None if nothing is in flight
+        """
+        sent = [outstanding.sent_at for outstanding in self._outstanding.values() if not outstanding.due]
+        if not sent:
+            return None
+        return max(min(sent) + self.rtt.rto - self._loop.time(), 0.0)
+
+    def _expire(self):
+        now = self._loop.time()
+        expired = False
+        for outstanding in self._outstanding.values():
+            if not outstanding.due and now - outstanding.sent_at >= self.rtt.rto:
+                outstanding.due = outstanding.retransmitted = expired = True
+        if expired:
+            self.rtt.backoff()
+            log.debug("retransmission timeout, backing off to %.3fs", self.rtt.rto)
+
+    def _make_burst(self) -> typing.List[typing.Tuple[int, bytes]]:
+        while self._segments and self._next_sequence - self._base < self.window:
+            self._outstanding[self._next_sequence] = _Outstanding(self._segments.pop(0))
+            self._next_sequence += 1
+        return [
+            (sequence, HEADER.pack(DATA, self.station, sequence % SEQUENCE_SPACE) + outstanding.payload)
+            for sequence, outstanding in sorted(self._outstanding.items()) if outstanding.due
+        ]
+
+    async def _send(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self._timeout())
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            self._expire()
+            burst = self._make_burst()
+            control, self._control = self._control, []
+            frames = [frame for frame, _ in control] + [frame for _, frame in burst]
+            if self._ack_pending:
+                self._ack_pending = False
+                frames.insert(0, self._make_ack())
+            if not frames:
+                continue
+            await self._transmit(frames)
+            for _, sent in control:
+                if not sent.done():
+                    sent.set_result(None)
+            now = self._loop.time()
+            for sequence, _ in burst:
+                outstanding = self._outstanding.get(sequence)
+                if outstanding is None:
+                    continue
+                self._sent_order += 1
+                self.transmissions += 1
+                self.retransmissions += outstanding.retransmitted
+                outstanding.sent_at, outstanding.sent_order, outstanding.due = now, self._sent_order, False
+
+    async def _receive(self, frames_in: asyncio.Queue):
+        while True:
+            self.receive(await frames_in.get())
+            while not frames_in.empty():
+                self.receive(frames_in.get_nowait())
+            if self._ack_pending:
+                self._wakeup.set()
+
+    async def run(self, frames_in: asyncio.Queue):
+        """
+        Send what is written and acknowledge the frames from frames_in until cancelled
+        """
+        send_task = asyncio.create_task(self._send())
+        try:
+            await self._receive(frames_in)
+        finally:
+            send_task.cancel()
@@ -27,3 +27,8 @@ TONES = {
     '0': 1200,
     '1': 2400
 }
+
+# symbols sent ahead of each transmission for receivers that synchronize on a preamble, alternating symbols for
+# timing followed by a 13 symbol barker code, after a gap of silent frames that lets the receiver drop its lock
+PREAMBLE = (0, 1) * 4 + (1, 1, 1, 1, 1, 0, 0, 1, 1, 0, 1, 0, 1)
+PREAMBLE_GAP = 2
@@ -0,0 +1,160 @@
+import time
+import typing
+import numpy as np
+
+from aiofsk import __version__
+from aiofsk.baud import DEFAULT_BAUD_OPTIONS, PREAMBLE
+from aiofsk.channel import Channel, ChannelConfig
+from aiofsk.modulation import MODULATORS, Modulator
+from aiofsk.synchronizer import PreambleSynchronizer
+from aiofsk.util import DoubleEvent
+
+DEFAULT_AMPLITUDE = 0.5
+DEFAULT_SNRS = (-12.0, -9.0, -6.0, -3.0, 0.0, 3.0)  # dB, over the whole band so the slow bauds need little
+# a decent but imperfect link for the goodput, the band of a typical voice radio
+DEFAULT_GOODPUT_CHANNEL = ChannelConfig(snr=20.0, clock_offset=100.0, jitter=2e-6, band=(300.0, 3400.0))
+
+
+def _make_modulator(baud: int, modulator: str, amplitude: float, demodulator: typing.Optional[str],
+                    preamble: typing.Sequence[int] = (), framing: typing.Optional[str] = None) -> Modulator:
+    return MODULATORS[modulator](
+        DEFAULT_BAUD_OPTIONS.make_baud_nt(baud), amplitude, demodulator, preamble=preamble, framing=framing
+    )
+
+
+def _bit_errors(sent: np.ndarray, received: np.ndarray) -> int:
+    """
+    Bits that differ, bits that never arrived count as errors
+    """
+    size = min(len(sent), len(received))
+    return int(np.count_nonzero(sent[:size] != received[:size])) + len(sent) - size
+
+
+def _bits(data: bytes) -> np.ndarray:
+    return np.unpackbits(np.frombuffer(data, dtype=np.uint8))
+
+
+def measure_speed(modulator: Modulator, data: bytes) -> typing.Dict[str, float]:
+    """
+    Samples per second that one packet of data is modulated and demodulated at, on a perfect channel
+    """
+    with modulator.get_packet_modulation_context() as modulate_packet:
+        start = time.perf_counter()
+        waveform = modulate_packet(data)
+        encode_time = time.perf_counter() - start
+    with modulator.get_packet_demodulation_context() as demodulate_packets:
+        start = time.perf_counter()
+        demodulate_packets(waveform)
+        decode_time = time.perf_counter() - start
+    return {
+        'encode_samples_per_second': len(waveform) / max(encode_time, 1e-9),
+        'decode_samples_per_second': len(waveform) / max(decode_time, 1e-9)
+    }
+
+
+def measure_ber(modulator: Modulator, data: bytes, config: ChannelConfig) -> typing.Dict[str, float]:
+    """
+    Bit error rate of the bits on the air and of the data after the codec, through a channel that keeps the frame
+    timing (noise and band limiting only)
+
+    The modulator must not have a preamble or framing.
+    """
+    with modulator.get_packet_modulation_context() as modulate_packet:
+        waveform = modulate_packet(data)
+    received = Channel(config, modulator.sample_rate).process(waveform)
+    with modulator.get_frame_demodulation_context() as demodulate_frames:
+        channel_bits = demodulate_frames(received[:len(received) - len(received) % modulator.frame_size])
+    decoded, _ = modulator.codec.decode_stream(channel_bits)
+    sent_bits = modulator.codec.encode(data)
+    return {
+        'snr': config.snr,
+        'channel_ber': _bit_errors(sent_bits, channel_bits) / len(sent_bits),
+        'decoded_ber': _bit_errors(_bits(data), _bits(decoded.data)) / (8 * len(data))
+    }
+
+
+def measure_goodput(modulator: Modulator, packets: typing.List[bytes],
+                    config: ChannelConfig) -> typing.Dict[str, float]:
+    """
+    Data bits per second of air time that make it through the channel intact, from hdlc framed packets found by the
+    preamble synchronizer. The modulator must have a preamble and framing.
+    """
+    with modulator.get_packet_modulation_context() as modulate_packet:
+        waveform = np.concatenate(
+            [modulate_packet(packet).reshape(-1) for packet in packets] + [np.zeros(4 * modulator.frame_size)]
+        )
+    channel = Channel(config, modulator.sample_rate)
+    synchronizer = PreambleSynchronizer.from_modulator(modulator, DoubleEvent())
+    synchronized = synchronizer.synchronized_audio_in
+    received = set()
+    with modulator.get_deframing_context() as deframe:
+        for offset in range(0, len(waveform), config.blocksize):
+            synchronizer.feed(channel.process(waveform[offset:offset + config.blocksize]))
+            frames = [synchronized.get_nowait() for _ in range(synchronized.qsize())]
+            if frames:
+                received.update(deframe(np.concatenate(frames)).frames)
+    delivered = received.intersection(packets)
+    return {
+        'goodput': 8 * sum(map(len, delivered)) * modulator.sample_rate / len(waveform),
+        'frames_sent': len(packets),
+        'frames_delivered': len(delivered),
+        'dropped_blocks': channel.dropped_blocks
+    }
+
+
+def benchmark(baud: int, modulator: str, snrs: typing.Sequence[float] = DEFAULT_SNRS,
+              channel: ChannelConfig = DEFAULT_GOODPUT_CHANNEL, amplitude: float = DEFAULT_AMPLITUDE,
+              demodulator: typing.Optional[str] = None, speed_size: int = 256, ber_size: int = 64,
+              packets: int = 8, packet_size: int = 64, seed: int = 0) -> typing.Dict[str, typing.Any]:
+    """
+    Speed, bit error rate at each snr and goodput over the channel for one modulator at one baud rate
+
+    Everything runs as fast as it can, nothing waits on the event loop. Before python 3.10 the queues of the
+    modulator and synchronizer still need a current event loop to be created.
+
+    :param demodulator: defaults to the modulator's
+    """
+    rng = np.random.default_rng(seed)
+    signal_power = amplitude ** 2 / 2
+    plain = _make_modulator(baud, modulator, amplitude, demodulator)
+    result: typing.Dict[str, typing.Any] = {'modulator': modulator, 'baud': baud}
+    result.update(measure_speed(plain, rng.bytes(speed_size)))
+    ber_data = rng.bytes(ber_size)
+    result['ber'] = [
+        measure_ber(plain, ber_data, ChannelConfig(snr=snr, signal_power=signal_power, seed=seed)) for snr in snrs
+    ]
+    result.update(measure_goodput(
+        _make_modulator(baud, modulator, amplitude, demodulator, PREAMBLE, 'hdlc'),
+        [rng.bytes(packet_size) for _ in range(packets)], channel._replace(signal_power=signal_power)
+    ))
+    return result
+
+
+def run_benchmarks(bauds: typing.Sequence[int] = DEFAULT_BAUD_OPTIONS.bauds,
+                   modulators: typing.Sequence[str] = tuple(MODULATORS), **options) -> typing.Dict[str, typing.Any]:
+    """
+    Benchmark every modulator at every baud rate, as a json serializable report
+
+    :param options: passed to benchmark
+    """
+    results = []
+    for modulator in modulators:
+        for baud in bauds:
+            if DEFAULT_BAUD_OPTIONS.sample_rate % baud:
+                error = "not a whole number of samples a symbol"
+                results.append({'modulator': modulator, 'baud': baud, 'error': error})
+                continue
+            try:
+                results.append(benchmark(baud, modulator, **options))
+            except ValueError as err:
+                # such as too many mfsk tones for the baud rate
+                results.append({'modulator': modulator, 'baud': baud, 'error': str(err)})
+    channel = options.get('channel', DEFAULT_GOODPUT_CHANNEL)
+    return {
+        'version': __version__,
+        'sample_rate': DEFAULT_BAUD_OPTIONS.sample_rate,
+        'amplitude': options.get('amplitude', DEFAULT_AMPLITUDE),
+        'demodulator': options.get('demodulator'),
+        'channel': channel._asdict(),
+        'results': results
+    }
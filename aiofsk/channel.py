@@ -0,0 +1,120 @@
+import math
+import typing
+import numpy as np
+import scipy.signal
+
+from aiofsk.baud import DEFAULT_BAUD_OPTIONS
+
+JITTER_CORRELATION_TIME = 0.001  # seconds, how quickly the timing jitter wanders
+BAND_FILTER_ORDER = 4
+
+
+class ChannelConfig(typing.NamedTuple):
+    snr: typing.Optional[float] = None  # dB of signal over white noise across the whole band, None for no noise
+    signal_power: float = 0.5  # power the snr is relative to, a full scale tone by default
+    clock_offset: float = 0.0  # ppm the receiving sound card's clock runs fast of the sending one
+    jitter: float = 0.0  # seconds rms of sample timing jitter
+    drop_rate: float = 0.0  # chance of each block of audio being lost, like an overrun
+    band: typing.Optional[typing.Tuple[float, float]] = None  # Hz pass band of the radio
+    blocksize: int = 1024  # samples in a block that can be dropped, the hub's default blocksize
+    seed: int = 0
+
+
+class Channel:
+    """
+    Simulated radio channel, band limiting, clock offset and timing jitter, dropped blocks and then white noise, in
+    that order
+
+    Audio can be passed through in blocks of any size and comes out the same as if it were passed in one go, the
+    impairments only depend on the config, its seed included. Runs as fast as numpy does rather than in real time.
+    """
+
+    def __init__(self, config: ChannelConfig = ChannelConfig(),
+                 sample_rate: int = DEFAULT_BAUD_OPTIONS.sample_rate):
+        self.config = config
+        self.sample_rate = sample_rate
+        noise_seed, jitter_seed, drop_seed = np.random.SeedSequence(config.seed).spawn(3)
+        self._noise_rng = np.random.default_rng(noise_seed)
+        self._jitter_rng = np.random.default_rng(jitter_seed)
+        self._drop_rng = np.random.default_rng(drop_seed)
+        self._sos: typing.Optional[np.ndarray] = None
+        self._filter_state: typing.Optional[np.ndarray] = None
+        if config.band is not None:
+            self._sos = scipy.signal.butter(
+                BAND_FILTER_ORDER, config.band, btype='bandpass', fs=sample_rate, output='sos'
+            )
+            self._filter_state = np.zeros((len(self._sos), 2))
+        # input samples per output sample, and the jitter as a first order low pass of white noise
+        self._step = 1 / (1 + config.clock_offset * 1e-6)
+        self._jitter_std = config.jitter * sample_rate
+        self._jitter_pole = math.exp(-1 / (JITTER_CORRELATION_TIME * sample_rate))
+        self._jitter_state = np.zeros(1)
+        self._margin = int(math.ceil(5 * self._jitter_std)) + 1
+        self._history = np.zeros(self._margin)
+        self._position = float(self._margin)  # of the next output sample in the history
+        self._produced = 0
+        self._dropping = False
+        self.dropped_blocks = 0
+
+    def _band_limit(self, samples: np.ndarray) -> np.ndarray:
+        if self._sos is None:
+            return samples
+        filtered, self._filter_state = scipy.signal.sosfilt(self._sos, samples, zi=self._filter_state)
+        return filtered
+
+    def _jitter(self, count: int) -> np.ndarray:
+        white = self._jitter_rng.standard_normal(count) * self._jitter_std * math.sqrt(1 - self._jitter_pole ** 2)
+        jitter, self._jitter_state = scipy.signal.lfilter([1.0], [1.0, -self._jitter_pole], white,
+                                                          zi=self._jitter_state)
+        return np.clip(jitter, -self._margin + 1, self._margin - 1)
+
+    def _resample(self, samples: np.ndarray) -> np.ndarray:
+        """
+        Sample the audio at the receiver's clock rate, with jitter, by linear interpolation
+        """
+        if self._step == 1 and not self._jitter_std:
+            return samples
+        buffer = np.concatenate((self._history, samples))
+        last = len(buffer) - 1 - self._margin
+        if last < self._position:
+            self._history = buffer
+            return np.zeros(0)
+        count = int((last - self._position) // self._step) + 1
+        positions = self._position + np.arange(count) * self._step
+        if self._jitter_std:
+            positions += self._jitter(count)
+        index = positions.astype(np.int64)
+        fraction = positions - index
+        resampled = buffer[index] * (1 - fraction) + buffer[index + 1] * fraction
+        position = self._position + count * self._step
+        keep = max(int(position) - self._margin, 0)
+        self._history, self._position = buffer[keep:], position - keep
+        return resampled
+
+    def _drop(self, samples: np.ndarray) -> np.ndarray:
+        if not self.config.drop_rate or not len(samples):
+            return samples
+        start = self._produced % self.config.blocksize
+        blocks = (start + np.arange(len(samples))) // self.config.blocksize
+        fresh = int(blocks[-1]) + (start == 0)
+        dropping = self._drop_rng.random(fresh) < self.config.drop_rate
+        self.dropped_blocks += int(dropping.sum())
+        if start:
+            dropping = np.concatenate(([self._dropping], dropping))
+        self._dropping = bool(dropping[-1])
+        self._produced += len(samples)
+        return samples[~dropping[blocks]]
+
+    def _add_noise(self, samples: np.ndarray) -> np.ndarray:
+        if self.config.snr is None:
+            return samples
+        std = math.sqrt(self.config.signal_power / 10 ** (self.config.snr / 10))
+        return samples + self._noise_rng.normal(0.0, std, len(samples))
+
+    def process(self, samples: np.ndarray) -> np.ndarray:
+        """
+        :param samples: the next block of sent audio
+        :return: float32 audio heard by the receiver for the block, which may be a different length
+        """
+        samples = np.asarray(samples, dtype=np.float64).reshape(-1)
+        return self._add_noise(self._drop(self._resample(self._band_limit(samples)))).astype(np.float32)
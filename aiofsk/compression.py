@@ -0,0 +1,147 @@
+import zlib
+import lzma
+import typing
+import collections
+
+STORED, COMPRESSED = 0, 1  # flag byte ahead of every frame's payload
+MAX_DICTIONARY_SIZE = 2 ** 15  # bytes, the deflate window
+
+# shared by both ends unless they agree on another, the text a console sends. Deflate finds the end of the
+# dictionary cheapest to refer to, so the most common strings go last.
+DEFAULT_DICTIONARY = (
+    b'0123456789 ABCDEFGHIJKLMNOPQRSTUVWXYZ abcdefghijklmnopqrstuvwxyz\r\n'
+    b'{"id": , "time": , "status": "ok", "value": , "name": "", "type": "", "data": [], "error": null, true, false}\n'
+    b'please thank you could you can you will you would you should we when the where is what is how is '
+    b'I will I am it is that is there is this is do not did not does not have been has been was not '
+    b'again about after before because from with over under into through them then than they there their '
+    b'the signal the battery the message the file the band is on the in the of the to the and the for the '
+    b'. , ? ! : ; - \' " '
+)
+
+
+class Compressor:
+    """
+    Compresses the payload of one frame at a time, every frame stands on its own so a lost frame does not
+    take the next ones with it. A payload that does not get smaller is sent as it is, either way it is prefixed
+    with a flag byte saying which.
+    """
+
+    def __init__(self, dictionary: bytes = b''):
+        if len(dictionary) > MAX_DICTIONARY_SIZE:
+            raise ValueError(f"dictionary of {len(dictionary)} bytes exceeds the maximum of {MAX_DICTIONARY_SIZE}")
+        self.dictionary = dictionary
+
+    def _compress(self, data: bytes) -> bytes:
+        raise NotImplementedError()
+
+    def _decompress(self, data: bytes, max_size: int) -> typing.Optional[bytes]:
+        raise NotImplementedError()
+
+    def compress(self, data: bytes) -> bytes:
+        compressed = self._compress(data) if data else data
+        if len(compressed) < len(data):
+            return bytes((COMPRESSED,)) + compressed
+        return bytes((STORED,)) + data
+
+    def decompress(self, data: bytes, max_size: int) -> typing.Optional[bytes]:
+        """
+        :return: the payload, or None if the flag or compressed data is bad or would decompress past max_size
+        """
+        if not data or data[0] not in (STORED, COMPRESSED):
+            return None
+        if data[0] == STORED:
+            return data[1:]
+        return self._decompress(data[1:], max_size)
+
+
+class ZlibCompressor(Compressor):
+    """
+    Raw deflate, without the zlib header and checksum since the frame has a crc of its own, primed with a preset
+    dictionary
+    """
+
+    def __init__(self, dictionary: bytes = DEFAULT_DICTIONARY, level: int = 9):
+        super().__init__(dictionary)
+        self.level = level
+
+    def _compress(self, data: bytes) -> bytes:
+        if self.dictionary:
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15, zdict=self.dictionary)
+        else:
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15)
+        return compressor.compress(data) + compressor.flush()
+
+    def _decompress(self, data: bytes, max_size: int) -> typing.Optional[bytes]:
+        decompressor = zlib.decompressobj(-15, zdict=self.dictionary) if self.dictionary else zlib.decompressobj(-15)
+        try:
+            decompressed = decompressor.decompress(data, max_size)
+        except zlib.error:
+            return None
+        if not decompressor.eof or decompressor.unconsumed_tail or decompressor.unused_data:
+            return None
+        return decompressed
+
+
+class LZMACompressor(Compressor):
+    """
+    Raw lzma2, compresses longer frames better than deflate. The lzma module has no preset dictionaries, so it only
+    pays off on frames of a few hundred bytes or more.
+    """
+
+    def __init__(self, dictionary: bytes = b'', preset: int = 9):
+        if dictionary:
+            raise ValueError("lzma does not support a preset dictionary, use zlib")
+        super().__init__()
+        self._filters = [{'id': lzma.FILTER_LZMA2, 'preset': preset}]
+
+    def _compress(self, data: bytes) -> bytes:
+        return lzma.compress(data, lzma.FORMAT_RAW, filters=self._filters)
+
+    def _decompress(self, data: bytes, max_size: int) -> typing.Optional[bytes]:
+        decompressor = lzma.LZMADecompressor(lzma.FORMAT_RAW, filters=self._filters)
+        try:
+            decompressed = decompressor.decompress(data, max_size)
+        except lzma.LZMAError:
+            return None
+        if not decompressor.eof or decompressor.unused_data:
+            return None
+        return decompressed
+
+
+def train_dictionary(samples: typing.Iterable[bytes], size: int = 1024, length: int = 8) -> bytes:
+    """
+    Build a preset dictionary for zlib from samples of the traffic, such as telemetry records. The substrings of
+    length bytes found in the most samples are chained back into the longer strings they overlap in, and the
+    strings are put in the dictionary with the most common last.
+
+    :param size: bytes in the dictionary, at most MAX_DICTIONARY_SIZE
+    """
+    size = min(size, MAX_DICTIONARY_SIZE)
+    counts: typing.Counter[bytes] = collections.Counter()
+    for sample in samples:
+        # a substring repeated within a sample compresses without the dictionary, count it once
+        counts.update({sample[i:i + length] for i in range(len(sample) - length + 1)})
+    pieces: typing.List[bytes] = []
+    used = 0
+    for substring, count in counts.most_common():
+        if count < 2 or used >= size:
+            break
+        if any(substring in piece for piece in pieces):
+            continue
+        for i, piece in enumerate(pieces):
+            if piece.endswith(substring[:-1]):
+                pieces[i], used = piece + substring[-1:], used + 1
+                break
+            if piece.startswith(substring[1:]):
+                pieces[i], used = substring[:1] + piece, used + 1
+                break
+        else:
+            pieces.append(substring)
+            used += length
+    return b''.join(reversed(pieces))[-size:]
+
+
+COMPRESSORS: typing.Dict[str, typing.Callable[..., Compressor]] = {
+    'zlib': ZlibCompressor,
+    'lzma': LZMACompressor
+}
@@ -1,4 +1,7 @@
 import typing
+import functools
+import itertools
+import numpy as np
 
 
 def hamming_distance(a: int, b: int) -> int:
@@ -30,35 +33,493 @@ def hamming_code(data: int, size: int = 4):
            (parity[0] * (1 << 7))
 
 
+def hamming_correct(table: typing.Tuple[int, ...], encoded: int) -> int:
+    """
+    :param table: codewords indexed by the value they encode
+    :param encoded: received codeword
+    :return: error corrected value (int), if the data is not correctable returns -1
+    """
+    off_by_one = None
+    for key, code in enumerate(table):
+        score = hamming_distance(encoded, code)
+        if score == 0:
+            return key
+        if score == 1:
+            if off_by_one:
+                return -1
+            off_by_one = key
+    if off_by_one is not None:
+        return off_by_one
+    return -1
+
+
 class HammingSet(typing.NamedTuple):
     table: typing.Tuple[int, ...]
+    decode_table: typing.Tuple[int, ...]  # error corrected value (or -1) for every possible received codeword
+    encode_array: np.ndarray
+    decode_array: np.ndarray
 
     @staticmethod
     def make_hamming_set(bits: int):
-        return HammingSet(
-            tuple(hamming_code(i, bits) for i in range((2 ** bits)))
-        )
+        table = tuple(hamming_code(i, bits) for i in range((2 ** bits)))
+        decode_table = tuple(hamming_correct(table, encoded) for encoded in range(2 ** (bits * 2)))
+        encode_array = np.array(table, dtype=np.uint8)
+        decode_array = np.array(decode_table, dtype=np.int16)
+        encode_array.setflags(write=False)
+        decode_array.setflags(write=False)
+        return HammingSet(table, decode_table, encode_array, decode_array)
 
     def decode(self, encoded: int) -> int:
         """
         :param encoded: byte to decode
         :return: error corrected nibble (int), if the data is not correctable returns -1
         """
-        off_by_one = None
-        for key, code in enumerate(self.table):
-            score = hamming_distance(encoded, code)
-            if score == 0:
-                return key
-            if score == 1:
-                if off_by_one:
-                    return -1
-                off_by_one = key
-        if off_by_one is not None:
-            return off_by_one
-        return -1
+        return self.decode_table[encoded]
 
     def encode(self, nibble: int) -> int:
         return self.table[nibble]
 
+    def decode_many(self, encoded: typing.Union[bytes, np.ndarray]) -> np.ndarray:
+        """
+        :param encoded: bytes to decode
+        :return: int16 array of error corrected nibbles, -1 where the data is not correctable
+        """
+        if isinstance(encoded, (bytes, bytearray)):
+            encoded = np.frombuffer(encoded, dtype=np.uint8)
+        return self.decode_array[encoded]
+
+    def encode_many(self, nibbles: typing.Union[bytes, np.ndarray]) -> np.ndarray:
+        """
+        :param nibbles: nibbles to encode
+        :return: uint8 array of codewords
+        """
+        if isinstance(nibbles, (bytes, bytearray)):
+            nibbles = np.frombuffer(nibbles, dtype=np.uint8)
+        return self.encode_array[nibbles]
+
 
 HAMMING_8_4_CODE = HammingSet.make_hamming_set(4)
+
+
+class DecodeResult(typing.NamedTuple):
+    data: bytes
+    corrected: int  # errors the code corrected
+    uncorrectable: int  # codewords that could not be corrected and were dropped
+
+
+class Codec:
+    """
+    Forward error correction for a stream of blocks. Every block starts with header_bits bits, from which
+    block_bits tells the decoder how long the whole block is.
+    """
+    header_bits = 16
+    fixed_block_bits = 0  # set when every block has the same length
+    padding: typing.Optional[np.ndarray] = None  # fixed size block that is not data, to fill out interleaver groups
+
+    def encode(self, data: bytes) -> np.ndarray:
+        """
+        :return: uint8 array of encoded bits
+        """
+        raise NotImplementedError()
+
+    def block_bits(self, header: np.ndarray) -> int:
+        """
+        :param header: the first header_bits bits of a block
+        :return: length of the block in bits, or 0 if the header is not correctable
+        """
+        raise NotImplementedError()
+
+    def decode_block(self, bits: np.ndarray) -> DecodeResult:
+        raise NotImplementedError()
+
+    def decode_stream(self, bits: np.ndarray) -> typing.Tuple[DecodeResult, int]:
+        """
+        Decode the whole blocks at the front of a stream of bits
+
+        :return: the decoded data and the number of bits consumed
+        """
+        data, corrected, uncorrectable, consumed = [], 0, 0, 0
+        while len(bits) - consumed >= self.header_bits:
+            size = self.block_bits(bits[consumed:consumed + self.header_bits])
+            if not size:
+                # without a length there is nothing to resynchronize on, skip past the header
+                uncorrectable += 1
+                consumed += self.header_bits
+                continue
+            if len(bits) - consumed < size:
+                break
+            result = self.decode_block(bits[consumed:consumed + size])
+            data.append(result.data)
+            corrected += result.corrected
+            uncorrectable += result.uncorrectable
+            consumed += size
+        return DecodeResult(b''.join(data), corrected, uncorrectable), consumed
+
+
+class HammingCodec(Codec):
+    """
+    Hamming(8,4), each byte is sent as two codewords, low nibble first
+    """
+
+    fixed_block_bits = 16
+
+    def __init__(self, code: HammingSet = HAMMING_8_4_CODE):
+        self._code = code
+        # two words two bits from every codeword, so a data block is at least four bits from the padding
+        uncorrectable = code.decode_table.index(-1)
+        self.padding = np.unpackbits(np.array((uncorrectable, uncorrectable), dtype=np.uint8))
+        self.padding.setflags(write=False)
+
+    def encode(self, data: bytes) -> np.ndarray:
+        chars = np.frombuffer(data, dtype=np.uint8)
+        nibbles = np.empty(len(chars) * 2, dtype=np.uint8)
+        nibbles[0::2] = chars & 0b00001111
+        nibbles[1::2] = (chars & 0b11110000) >> 4
+        return np.unpackbits(self._code.encode_many(nibbles))
+
+    def block_bits(self, header: np.ndarray) -> int:
+        return self.header_bits
+
+    def decode_block(self, bits: np.ndarray) -> DecodeResult:
+        return self.decode_stream(bits)[0]
+
+    def decode_stream(self, bits: np.ndarray) -> typing.Tuple[DecodeResult, int]:
+        consumed = len(bits) - len(bits) % self.header_bits
+        codes = np.packbits(bits[:consumed])
+        nibbles = self._code.decode_many(codes)
+        valid = nibbles != -1
+        corrected = int((self._code.encode_array[nibbles[valid]] != codes[valid]).sum())
+        nibbles = nibbles.reshape(-1, 2)
+        whole = nibbles[(nibbles != -1).all(axis=1)]
+        data = ((whole[:, 1] << 4) + whole[:, 0]).astype(np.uint8).tobytes()
+        return DecodeResult(data, corrected, int((~valid).sum())), consumed
+
+
+class LengthPrefixedCodec(Codec):
+    """
+    Codec for blocks of up to max_block_size bytes, each block starts with its length as a Hamming(8,4) byte
+    """
+    max_block_size = 255
+
+    def _body_bits(self, size: int) -> int:
+        raise NotImplementedError()
+
+    def _encode_body(self, data: bytes) -> np.ndarray:
+        raise NotImplementedError()
+
+    def _decode_body(self, bits: np.ndarray, size: int) -> DecodeResult:
+        raise NotImplementedError()
+
+    def encode(self, data: bytes) -> np.ndarray:
+        blocks = []
+        for i in range(0, len(data), self.max_block_size):
+            block = data[i:i + self.max_block_size]
+            blocks.append(HAMMING_CODEC.encode(bytes((len(block),))))
+            blocks.append(self._encode_body(block))
+        return np.concatenate(blocks) if blocks else np.zeros(0, dtype=np.uint8)
+
+    def _block_size(self, header: np.ndarray) -> int:
+        size = HAMMING_CODEC.decode_block(header).data
+        if not size or not 0 < size[0] <= self.max_block_size:
+            return 0
+        return size[0]
+
+    def block_bits(self, header: np.ndarray) -> int:
+        size = self._block_size(header)
+        return self.header_bits + self._body_bits(size) if size else 0
+
+    def decode_block(self, bits: np.ndarray) -> DecodeResult:
+        return self._decode_body(bits[self.header_bits:], self._block_size(bits[:self.header_bits]))
+
+
+GF_EXP = [0] * 512
+GF_LOG = [0] * 256
+
+
+def _init_galois_field(primitive: int = 0x11d):
+    x = 1
+    for i in range(255):
+        GF_EXP[i] = x
+        GF_LOG[x] = i
+        x <<= 1
+        if x & 0x100:
+            x ^= primitive
+    for i in range(255, 512):
+        GF_EXP[i] = GF_EXP[i - 255]
+
+
+_init_galois_field()
+GF_EXP_ARRAY = np.array(GF_EXP, dtype=np.int64)
+GF_LOG_ARRAY = np.array(GF_LOG, dtype=np.int64)
+
+
+def gf_mul(a: int, b: int) -> int:
+    if not a or not b:
+        return 0
+    return GF_EXP[GF_LOG[a] + GF_LOG[b]]
+
+
+def gf_div(a: int, b: int) -> int:
+    if not a:
+        return 0
+    return GF_EXP[(GF_LOG[a] + 255 - GF_LOG[b]) % 255]
+
+
+def gf_poly_eval(poly: typing.List[int], x: int) -> int:
+    """
+    Evaluate a polynomial with the coefficients ordered from the lowest power
+    """
+    result = 0
+    for coefficient in reversed(poly):
+        result = gf_mul(result, x) ^ coefficient
+    return result
+
+
+def gf_poly_eval_many(poly: np.ndarray, log_x: np.ndarray) -> np.ndarray:
+    """
+    Evaluate a polynomial with the coefficients ordered from the highest power at every x = alpha ** log_x
+    """
+    powers = np.arange(len(poly) - 1, -1, -1)
+    nonzero = poly != 0
+    logs = (GF_LOG_ARRAY[poly[nonzero]] + np.outer(log_x, powers[nonzero])) % 255
+    return np.bitwise_xor.reduce(GF_EXP_ARRAY[logs], axis=1) if nonzero.any() else np.zeros(len(log_x), np.int64)
+
+
+class ReedSolomonCodec(LengthPrefixedCodec):
+    """
+    Shortened Reed-Solomon code over GF(2^8), each block of data carries parity_size parity bytes and corrects up
+    to parity_size // 2 byte errors, so bursts of bit errors inside a byte only cost one correction
+    """
+
+    def __init__(self, parity_size: int = 16):
+        self._parity_size = parity_size
+        self.max_block_size = 255 - parity_size
+        generator = [1]
+        for i in range(parity_size):
+            # multiply by (x - alpha ** i), coefficients from the highest power
+            root = GF_EXP[i]
+            generator = [a ^ gf_mul(b, root) for a, b in zip(generator + [0], [0] + generator)]
+        self._generator = generator
+
+    def _body_bits(self, size: int) -> int:
+        return (size + self._parity_size) * 8
+
+    def _encode_body(self, data: bytes) -> np.ndarray:
+        remainder = [0] * self._parity_size
+        for char in data:
+            factor = char ^ remainder[0]
+            remainder = remainder[1:] + [0]
+            if factor:
+                for i in range(self._parity_size):
+                    remainder[i] ^= gf_mul(self._generator[i + 1], factor)
+        return np.unpackbits(np.frombuffer(bytes(data) + bytes(remainder), dtype=np.uint8))
+
+    def _decode_body(self, bits: np.ndarray, size: int) -> DecodeResult:
+        received = np.packbits(bits).astype(np.int64)
+        syndromes = gf_poly_eval_many(received, np.arange(self._parity_size))
+        if not syndromes.any():
+            return DecodeResult(received[:size].astype(np.uint8).tobytes(), 0, 0)
+        locator = self._error_locator(syndromes.tolist())
+        errors = len(locator) - 1
+        if not 0 < errors <= self._parity_size // 2:
+            return DecodeResult(b'', 0, 1)
+        # chien search over the positions of the (shortened) codeword, position p holds the coefficient of x ** p
+        positions = np.arange(len(received))
+        roots = positions[gf_poly_eval_many(np.array(locator[::-1]), (255 - positions) % 255) == 0]
+        if len(roots) != errors:
+            return DecodeResult(b'', 0, 1)
+        # forney, with the generator roots starting at alpha ** 0 the magnitude is X * omega(1/X) / locator'(1/X)
+        omega = [0] * self._parity_size
+        for i, syndrome in enumerate(syndromes.tolist()):
+            for j, coefficient in enumerate(locator[:self._parity_size - i]):
+                omega[i + j] ^= gf_mul(syndrome, coefficient)
+        derivative = [coefficient if power % 2 else 0 for power, coefficient in enumerate(locator)][1:]
+        corrected = received.copy()
+        for position in roots.tolist():
+            x = GF_EXP[position]
+            x_inverse = GF_EXP[(255 - position) % 255]
+            magnitude = gf_div(gf_mul(x, gf_poly_eval(omega, x_inverse)), gf_poly_eval(derivative, x_inverse))
+            corrected[len(received) - 1 - position] ^= magnitude
+        if gf_poly_eval_many(corrected, np.arange(self._parity_size)).any():
+            return DecodeResult(b'', 0, 1)
+        return DecodeResult(corrected[:size].astype(np.uint8).tobytes(), errors, 0)
+
+    def _error_locator(self, syndromes: typing.List[int]) -> typing.List[int]:
+        """
+        Berlekamp-Massey, returns the error locator with the coefficients ordered from the lowest power
+        """
+        locator, previous = [1], [1]
+        for i, syndrome in enumerate(syndromes):
+            discrepancy = syndrome
+            for j in range(1, len(locator)):
+                discrepancy ^= gf_mul(locator[j], syndromes[i - j])
+            previous = [0] + previous
+            if discrepancy:
+                if len(previous) > len(locator):
+                    scaled = [gf_mul(coefficient, discrepancy) for coefficient in previous]
+                    previous = [gf_div(coefficient, discrepancy) for coefficient in locator]
+                    locator = scaled
+                locator = [
+                    a ^ gf_mul(b, discrepancy) for a, b in itertools.zip_longest(locator, previous, fillvalue=0)
+                ]
+        while len(locator) > 1 and not locator[-1]:
+            locator.pop()
+        return locator
+
+
+class ConvolutionalCodec(LengthPrefixedCodec):
+    """
+    Rate 1/2 convolutional code (constraint length 7 with the 171/133 octal generators by default), decoded with a
+    hard decision Viterbi decoder that is vectorized across the trellis states
+    """
+
+    def __init__(self, generators: typing.Tuple[int, int] = (0o171, 0o133), constraint_length: int = 7):
+        self._generators = generators
+        self._memory = constraint_length - 1
+        self._taps = [
+            np.array([(generator >> (self._memory - k)) & 1 for k in range(constraint_length)], dtype=np.int64)
+            for generator in generators
+        ]
+        states = np.arange(1 << self._memory)
+        # every state has two predecessors, which differ in the bit that just left the register
+        self._predecessors = np.stack(((states << 1) & (len(states) - 1), ((states << 1) & (len(states) - 1)) | 1))
+        registers = ((states >> (self._memory - 1)) << self._memory) | self._predecessors
+        outputs = [np.array([bin(r & generator).count('1') % 2 for r in register.tolist()]) for register in registers
+                   for generator in generators]
+        # the two output bits of each branch as a number in 0..3, shape (2, states)
+        self._branch_outputs = np.stack((outputs[0] * 2 + outputs[1], outputs[2] * 2 + outputs[3]))
+        self._inputs = (states >> (self._memory - 1)).astype(np.uint8)
+
+    def _body_bits(self, size: int) -> int:
+        return (size * 8 + self._memory) * 2
+
+    def _convolve(self, bits: np.ndarray) -> np.ndarray:
+        bits = np.concatenate((bits.astype(np.int64), np.zeros(self._memory, dtype=np.int64)))
+        encoded = np.empty((len(bits), 2), dtype=np.uint8)
+        for i, taps in enumerate(self._taps):
+            encoded[:, i] = np.convolve(bits, taps)[:len(bits)] % 2
+        return encoded.reshape(-1)
+
+    def _encode_body(self, data: bytes) -> np.ndarray:
+        return self._convolve(np.unpackbits(np.frombuffer(data, dtype=np.uint8)))
+
+    def _decode_body(self, bits: np.ndarray, size: int) -> DecodeResult:
+        received = bits.reshape(-1, 2).astype(np.int64)
+        # hamming distance from the received pair to each of the four possible branch outputs
+        possible = np.array([[0, 0], [0, 1], [1, 0], [1, 1]])
+        branch_metrics = (received[:, None, :] != possible[None, :, :]).sum(axis=2)
+        state_count = 1 << self._memory
+        path_metrics = np.full(state_count, np.iinfo(np.int64).max // 2)
+        path_metrics[0] = 0
+        decisions = np.empty((len(received), state_count), dtype=np.uint8)
+        for step, metrics in enumerate(branch_metrics):
+            candidates = path_metrics[self._predecessors] + metrics[self._branch_outputs]
+            decisions[step] = choice = candidates[1] < candidates[0]
+            path_metrics = np.where(choice, candidates[1], candidates[0])
+        # the tail bits terminate the trellis in state 0
+        state, decoded = 0, np.empty(len(received), dtype=np.uint8)
+        for step in range(len(received) - 1, -1, -1):
+            decoded[step] = self._inputs[state]
+            state = self._predecessors[decisions[step, state], state]
+        decoded = decoded[:size * 8]
+        corrected = int((self._convolve(decoded) != bits).sum())
+        return DecodeResult(np.packbits(decoded).tobytes(), corrected, 0)
+
+
+@functools.lru_cache(maxsize=256)
+def _interleaved_order(depth: int, size: int) -> np.ndarray:
+    width = -(-size // depth)
+    order = np.arange(depth * width).reshape(depth, width).T.reshape(-1)
+    order = order[order < size]
+    order.setflags(write=False)
+    return order
+
+
+class BlockInterleaver(typing.NamedTuple):
+    """
+    Writes a segment of bits into depth rows and reads it out by column, so consecutive bits on the air come from
+    different rows. With a row per codeword a burst of up to depth bits costs each codeword at most one bit.
+    """
+    depth: int = 1
+
+    def interleave(self, bits: np.ndarray) -> np.ndarray:
+        return bits[..., _interleaved_order(self.depth, bits.shape[-1])]
+
+    def deinterleave(self, bits: np.ndarray) -> np.ndarray:
+        deinterleaved = np.empty_like(bits)
+        deinterleaved[..., _interleaved_order(self.depth, bits.shape[-1])] = bits
+        return deinterleaved
+
+
+class InterleavedCodec(Codec):
+    """
+    Interleaves the header and the body of each block of another codec separately, the header has to be read
+    before the decoder knows how long the body is
+
+    Codecs with fixed size blocks are interleaved across groups of depth blocks instead, a block per row, so a
+    burst of up to depth bits costs each block at most one bit. The last group of a packet is filled out with the
+    codec's padding blocks, which the decoder drops.
+    """
+
+    def __init__(self, codec: Codec, interleaver: BlockInterleaver):
+        self._codec = codec
+        self._interleaver = interleaver
+        self.fixed_block_bits = codec.fixed_block_bits * interleaver.depth
+        self.header_bits = self.fixed_block_bits or codec.header_bits
+        if self.fixed_block_bits and interleaver.depth > 1 and codec.padding is None:
+            raise ValueError("interleaving fixed size blocks needs a codec with padding")
+
+    def _fixed_blocks(self, bits: np.ndarray, transform: typing.Callable[[np.ndarray], np.ndarray]) -> np.ndarray:
+        whole = len(bits) - len(bits) % self.fixed_block_bits
+        return transform(bits[:whole].reshape(-1, self.fixed_block_bits)).reshape(-1)
+
+    def _pad(self, bits: np.ndarray) -> np.ndarray:
+        blocks = bits.reshape(-1, self._codec.fixed_block_bits)
+        padding = np.tile(self._codec.padding, (-len(blocks) % self._interleaver.depth, 1))
+        return np.concatenate((blocks, padding.astype(blocks.dtype))).reshape(-1)
+
+    def _strip(self, bits: np.ndarray) -> np.ndarray:
+        blocks = bits.reshape(-1, self._codec.fixed_block_bits)
+        # padding with a bit error is still padding, data is further away than that
+        is_padding = (blocks != self._codec.padding).sum(axis=1) <= 1
+        return blocks[~is_padding].reshape(-1)
+
+    def encode(self, data: bytes) -> np.ndarray:
+        encoded = self._codec.encode(data)
+        if self.fixed_block_bits:
+            return self._fixed_blocks(self._pad(encoded), self._interleaver.interleave)
+        segments, offset = [], 0
+        while offset < len(encoded):
+            size = self._codec.block_bits(encoded[offset:offset + self.header_bits])
+            segments.append(self._interleaver.interleave(encoded[offset:offset + self.header_bits]))
+            segments.append(self._interleaver.interleave(encoded[offset + self.header_bits:offset + size]))
+            offset += size
+        return np.concatenate(segments) if segments else encoded
+
+    def block_bits(self, header: np.ndarray) -> int:
+        if self.fixed_block_bits:
+            return self.fixed_block_bits
+        return self._codec.block_bits(self._interleaver.deinterleave(header))
+
+    def decode_block(self, bits: np.ndarray) -> DecodeResult:
+        if self.fixed_block_bits:
+            return self.decode_stream(bits)[0]
+        return self._codec.decode_block(np.concatenate((
+            self._interleaver.deinterleave(bits[:self.header_bits]),
+            self._interleaver.deinterleave(bits[self.header_bits:])
+        )))
+
+    def decode_stream(self, bits: np.ndarray) -> typing.Tuple[DecodeResult, int]:
+        if self.fixed_block_bits:
+            deinterleaved = self._fixed_blocks(bits, self._interleaver.deinterleave)
+            return self._codec.decode_stream(self._strip(deinterleaved))[0], len(deinterleaved)
+        return super().decode_stream(bits)
+
+
+HAMMING_CODEC = HammingCodec()
+
+CODECS: typing.Dict[str, typing.Callable[[], Codec]] = {
+    'hamming': HammingCodec,
+    'reed-solomon': ReedSolomonCodec,
+    'convolutional': ConvolutionalCodec
+}
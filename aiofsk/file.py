@@ -1,52 +1,182 @@
+import typing
+import os
+import wave
+import asyncio
+import collections
+import concurrent.futures
 import numpy as np
 import scipy.io.wavfile
-from aiofsk.modulation import MODULATORS
+from aiofsk.modulation import MODULATORS, Modulator
 from aiofsk.baud import DEFAULT_BAUD_OPTIONS
 
+ENCODE_CHUNK_SIZE = 1024  # bytes of data modulated at a time
+DECODE_CHUNK_FRAMES = 4096  # symbol frames demodulated at a time
 
-async def write_wav(wav_path: str, data: bytes, baud: int = 300, modulator: str = 'standard', amplitude=1.0):
-    modulator = MODULATORS[modulator](
-        DEFAULT_BAUD_OPTIONS.make_baud_nt(baud), amplitude
+
+def _make_modulator(baud: int, modulator: str, amplitude: float = 1.0, demodulator: typing.Optional[str] = None,
+                    codec: str = 'hamming', interleave_depth: int = 1) -> Modulator:
+    return MODULATORS[modulator](
+        DEFAULT_BAUD_OPTIONS.make_baud_nt(baud), amplitude, demodulator, codec=codec,
+        interleave_depth=interleave_depth
     )
 
-    # frame_count = modulator.frame_size * 8  # prepend 8 bits of silence
-    frame_count = (modulator.frame_size * 8 * len(data))
-    wav_data = np.zeros((frame_count, 1))
-    i = 0
-    # for _ in range(modulator.frame_size * 8):
-    #     wav_data[i] = [0.0]
-    #     i += 1
-
-    for character in data:
-        for bit in modulator.iter_symbols(character):
-            modulated = modulator.modulate_bit(bit)
-            for sample in modulated:
-                wav_data[i] = sample
-                i += 1
-    scipy.io.wavfile.write(wav_path, modulator.sample_rate, wav_data)
-
-
-async def read_wav(wav_path: str, baud: int = 300, modulator: str = 'standard'):
-    modulator = MODULATORS[modulator](
-        DEFAULT_BAUD_OPTIONS.make_baud_nt(baud)
+
+def _normalize(samples: np.ndarray) -> np.ndarray:
+    """
+    Convert a chunk of PCM samples to float32 in [-1.0, 1.0]
+    """
+    if samples.ndim > 1:
+        samples = samples[:, 0]
+    if samples.dtype == np.uint8:
+        return (samples.astype(np.float32) - 128) / 128
+    if np.issubdtype(samples.dtype, np.integer):
+        return samples.astype(np.float32) / -np.iinfo(samples.dtype).min
+    return samples.astype(np.float32)
+
+
+def iter_encode_wav(data: typing.Union[bytes, typing.Iterable[bytes]], baud: int = 300,
+                    modulator: str = 'standard', amplitude=1.0, codec: str = 'hamming',
+                    interleave_depth: int = 1) -> typing.Iterator[np.ndarray]:
+    """
+    Modulate data ENCODE_CHUNK_SIZE bytes at a time
+
+    :param data: bytes, or an iterable of chunks of bytes
+    :return: iterator of float32 waveforms with shape (samples, 1)
+    """
+    modulator = _make_modulator(baud, modulator, amplitude, codec=codec, interleave_depth=interleave_depth)
+    if isinstance(data, (bytes, bytearray)):
+        chunks = (data[i:i + ENCODE_CHUNK_SIZE] for i in range(0, len(data), ENCODE_CHUNK_SIZE))
+    else:
+        chunks = data
+    with modulator.get_packet_modulation_context() as modulate_packet:
+        for chunk in chunks:
+            yield modulate_packet(chunk)
+
+
+def iter_decode_wav(wav_path: str, baud: int = 300, modulator: str = 'standard',
+                    demodulator: typing.Optional[str] = None, codec: str = 'hamming', interleave_depth: int = 1,
+                    chunk_frames: int = DECODE_CHUNK_FRAMES, start_frame: int = 0,
+                    end_frame: typing.Optional[int] = None) -> typing.Iterator[bytes]:
+    """
+    Demodulate a memory mapped wav file chunk_frames symbol frames at a time
+
+    :param start_frame: symbol frame to start decoding from, must be at the start of a codec block
+    :param end_frame: symbol frame to stop decoding at, defaults to the end of the file
+    :return: iterator of the decoded data, as soon as each codec block is complete
+    """
+    modulator = _make_modulator(
+        baud, modulator, demodulator=demodulator, codec=codec, interleave_depth=interleave_depth
     )
+    rate, data = scipy.io.wavfile.read(wav_path, mmap=True)
+    if rate != modulator.sample_rate:
+        raise ValueError(f"{wav_path} has a sample rate of {rate}, expected {modulator.sample_rate}")
+    chunk_size = chunk_frames * modulator.frame_size
+    end = len(data) - len(data) % modulator.frame_size
+    if end_frame is not None:
+        end = min(end, end_frame * modulator.frame_size)
+    # when starting mid stream demodulate the frame before too, it primes the (nrzi) bit decoder
+    prime = 1 if start_frame else 0
+    try:
+        with modulator.get_packet_demodulation_context(skip_bits=prime) as demodulate_packets:
+            for offset in range((start_frame - prime) * modulator.frame_size, end, chunk_size):
+                decoded = demodulate_packets(_normalize(data[offset:min(offset + chunk_size, end)])).data
+                if decoded:
+                    yield decoded
+    finally:
+        del data
+
+
+class _DecodeJob(typing.NamedTuple):
+    wav_path: str
+    start_frame: int
+    end_frame: typing.Optional[int]
+
+
+def _decode_segment(job: _DecodeJob, options: typing.Dict[str, typing.Any]) -> bytes:
+    return b''.join(iter_decode_wav(job.wav_path, start_frame=job.start_frame, end_frame=job.end_frame, **options))
+
+
+def _iter_decode_jobs(wav_paths: typing.Iterable[str], segment_frames: typing.Optional[int],
+                      options: typing.Dict[str, typing.Any]) -> typing.Iterator[_DecodeJob]:
+    modulator = _make_modulator(
+        options.get('baud', 300), options.get('modulator', 'standard'), codec=options.get('codec', 'hamming'),
+        interleave_depth=options.get('interleave_depth', 1)
+    )
+    codec = modulator.codec
+    for wav_path in wav_paths:
+        # only streams of fixed size codec blocks, one bit per symbol, can be split without decoding everything
+        # before the split
+        if not segment_frames or not codec.fixed_block_bits or modulator.bits_per_symbol != 1:
+            yield _DecodeJob(wav_path, 0, None)
+            continue
+        step = max(segment_frames - segment_frames % codec.fixed_block_bits, codec.fixed_block_bits)
+        _, data = scipy.io.wavfile.read(wav_path, mmap=True)
+        frame_count = len(data) // modulator.frame_size
+        del data
+        for start_frame in range(0, max(frame_count, 1), step):
+            yield _DecodeJob(wav_path, start_frame, start_frame + step)
+
+
+def iter_decode_wav_files(wav_paths: typing.Iterable[str], max_workers: typing.Optional[int] = None,
+                          segment_frames: typing.Optional[int] = None,
+                          **options) -> typing.Iterator[typing.Tuple[str, bytes]]:
+    """
+    Decode wav recordings in a process pool
+
+    :param wav_paths: recordings to decode
+    :param max_workers: size of the process pool, defaults to the number of cpus
+    :param segment_frames: split files into segments of about this many symbol frames (rounded to whole codec
+                           blocks) so a long recording is spread across the pool as well
+    :param options: baud, modulator, demodulator, codec and interleave_depth as for iter_decode_wav
+    :return: iterator of (wav path, decoded data) in the order of the files and segments, the data of consecutive
+             segments of a file concatenates
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    with concurrent.futures.ProcessPoolExecutor(max_workers) as executor:
+        # keep every worker busy with the next job queued, without submitting every file up front
+        window = 2 * max_workers
+        pending: typing.Deque[typing.Tuple[str, concurrent.futures.Future]] = collections.deque()
+        for job in _iter_decode_jobs(wav_paths, segment_frames, options):
+            pending.append((job.wav_path, executor.submit(_decode_segment, job, options)))
+            if len(pending) >= window:
+                wav_path, future = pending.popleft()
+                yield wav_path, future.result()
+        while pending:
+            wav_path, future = pending.popleft()
+            yield wav_path, future.result()
+
+
+async def decode_wav_files(wav_paths: typing.Iterable[str], max_workers: typing.Optional[int] = None,
+                           segment_frames: typing.Optional[int] = None,
+                           **options) -> typing.AsyncIterator[typing.Tuple[str, bytes]]:
+    """
+    Like iter_decode_wav_files, without blocking the event loop
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    with concurrent.futures.ProcessPoolExecutor(max_workers) as executor:
+        loop = asyncio.get_event_loop()
+        window = 2 * max_workers
+        pending: typing.Deque[typing.Tuple[str, asyncio.Future]] = collections.deque()
+        for job in _iter_decode_jobs(wav_paths, segment_frames, options):
+            pending.append((job.wav_path, loop.run_in_executor(executor, _decode_segment, job, options)))
+            if len(pending) >= window:
+                wav_path, future = pending.popleft()
+                yield wav_path, await future
+        while pending:
+            wav_path, future = pending.popleft()
+            yield wav_path, await future
+
+
+async def write_wav(wav_path: str, data: bytes, baud: int = 300, modulator: str = 'standard', amplitude=1.0,
+                    codec: str = 'hamming', interleave_depth: int = 1):
+    with wave.open(wav_path, 'wb') as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(DEFAULT_BAUD_OPTIONS.sample_rate)
+        for waveform in iter_encode_wav(data, baud, modulator, amplitude, codec, interleave_depth):
+            wav_file.writeframes(np.clip(np.round(waveform * 32767), -32768, 32767).astype('<i2').tobytes())
+
 
-    rate, data = scipy.io.wavfile.read(wav_path)
-
-    frame_count = len(data) // modulator.frame_size
-    offset = 0
-    msg = b''
-    with modulator.get_demodulation_context() as demodulate:
-        current_byte = 0
-        for frame_cnt in range(frame_count):
-            frame = np.zeros((modulator.frame_size, 1))
-            for i in range(modulator.frame_size):
-                frame[i] = data[offset]
-                offset += 1
-            current_byte += demodulate(frame)
-            if frame_cnt > 0 and ((frame_cnt + 1) % 8 == 0):
-                msg += current_byte.to_bytes(1, byteorder='little')
-                current_byte = 0
-            else:
-                current_byte <<= 1
-    return msg
+async def read_wav(wav_path: str, baud: int = 300, modulator: str = 'standard',
+                   demodulator: typing.Optional[str] = None, codec: str = 'hamming', interleave_depth: int = 1):
+    return b''.join(iter_decode_wav(wav_path, baud, modulator, demodulator, codec, interleave_depth))
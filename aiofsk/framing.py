@@ -0,0 +1,157 @@
+import typing
+import numpy as np
+from aiofsk.ecc import Codec
+from aiofsk.compression import Compressor
+
+FLAG = np.array((0, 1, 1, 1, 1, 1, 1, 0), dtype=np.uint8)  # 0x7e
+MAX_FRAME_SIZE = 1024  # bytes of data in one frame
+
+
+def _make_crc16_table() -> typing.Tuple[int, ...]:
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0x8408 if crc & 1 else crc >> 1
+        table.append(crc)
+    return tuple(table)
+
+
+CRC16_TABLE = _make_crc16_table()
+
+
+def crc16(data: bytes) -> int:
+    """
+    CRC-16/X.25, the frame check sequence used by HDLC and AX.25
+    """
+    crc = 0xffff
+    for byte in data:
+        crc = (crc >> 8) ^ CRC16_TABLE[(crc ^ byte) & 0xff]
+    return crc ^ 0xffff
+
+
+def _ones_run(bits: np.ndarray) -> np.ndarray:
+    """
+    :return: the number of consecutive 1 bits ending at each position
+    """
+    index = np.arange(len(bits))
+    last_zero = np.maximum.accumulate(np.where(bits == 0, index, -1))
+    return index - last_zero
+
+
+def stuff_bits(bits: np.ndarray) -> np.ndarray:
+    """
+    Insert a 0 after every five consecutive 1 bits so the data can never look like a flag
+    """
+    run = _ones_run(bits)
+    return np.insert(bits, np.flatnonzero((run > 0) & (run % 5 == 0)) + 1, 0)
+
+
+def destuff_bits(bits: np.ndarray) -> typing.Optional[np.ndarray]:
+    """
+    Remove the 0 bits inserted by stuff_bits
+
+    :return: the original bits, or None if there are more than five consecutive 1 bits (an abort)
+    """
+    run = _ones_run(bits)
+    if len(run) and run.max() > 5:
+        return None
+    stuffed = np.flatnonzero(run[:-1] == 5) + 1
+    return np.delete(bits, stuffed)
+
+
+def find_flags(bits: np.ndarray) -> np.ndarray:
+    """
+    :return: the index of the first bit of every flag in the bits
+    """
+    if len(bits) < len(FLAG):
+        return np.zeros(0, dtype=np.int64)
+    run = _ones_run(bits)
+    ends = np.flatnonzero(bits[len(FLAG) - 1:] == 0) + len(FLAG) - 1
+    ends = ends[run[ends - 1] == 6]
+    return ends[bits[ends - 7] == 0] - 7
+
+
+class DeframeResult(typing.NamedTuple):
+    frames: typing.List[bytes]
+    corrected: int  # errors the codec corrected in the good frames
+    dropped: int  # frames that failed the codec or crc and were thrown away
+
+
+class HDLCFramer:
+    """
+    HDLC style framing on top of a codec. The data and its CRC-16 are encoded by the codec, then bit stuffed and
+    delimited by flags. A damaged frame is dropped and the receiver picks up again at the next flag.
+
+    With a compressor each frame's data is compressed on its own ahead of the codec, max_frame_size is the size
+    before compression.
+    """
+    compressor: typing.Optional[Compressor] = None
+
+    def __init__(self, codec: Codec, opening_flags: int = 2, max_frame_size: int = MAX_FRAME_SIZE):
+        self.codec = codec
+        self._opening = np.tile(FLAG, opening_flags)
+        self.max_frame_size = max_frame_size
+        # anything shorter than an empty frame between two flags is idle noise rather than a damaged frame
+        self._min_frame_bits = len(codec.encode(bytes(2)))
+        # worst case is a stuffed 0 after every five bits, and a compression flag byte
+        self._max_frame_bits = len(codec.encode(bytes(max_frame_size + 3))) * 6 // 5 + len(FLAG)
+
+    def frame(self, data: bytes) -> np.ndarray:
+        """
+        :return: uint8 array of the bits of the frame, flags included
+        """
+        if len(data) > self.max_frame_size:
+            raise ValueError(f"frame of {len(data)} bytes exceeds the maximum of {self.max_frame_size}")
+        if self.compressor:
+            data = self.compressor.compress(data)
+        encoded = self.codec.encode(data + crc16(data).to_bytes(2, 'little'))
+        return np.concatenate((self._opening, stuff_bits(encoded), FLAG))
+
+    def _unframe(self, bits: np.ndarray) -> typing.Optional[typing.Tuple[bytes, int]]:
+        destuffed = destuff_bits(bits)
+        if destuffed is None:
+            return None
+        result, consumed = self.codec.decode_stream(destuffed)
+        if consumed != len(destuffed) or result.uncorrectable or len(result.data) < 2:
+            return None
+        data, check = result.data[:-2], result.data[-2:]
+        if crc16(data) != int.from_bytes(check, 'little'):
+            return None
+        if self.compressor:
+            data = self.compressor.decompress(data, self.max_frame_size)
+            if data is None:
+                return None
+        return data, result.corrected
+
+    def deframe_stream(self, bits: np.ndarray) -> typing.Tuple[DeframeResult, int]:
+        """
+        Extract the frames between the flags in a stream of bits
+
+        :return: the good frames and the number of bits consumed, everything from the last flag on is kept for the
+                 next call
+        """
+        frames, corrected, dropped = [], 0, 0
+        flags = find_flags(bits)
+        for start, end in zip(flags[:-1] + len(FLAG), flags[1:]):
+            if end - start < self._min_frame_bits:
+                continue  # back to back flags, or a few stray bits between frames
+            unframed = self._unframe(bits[start:end])
+            if unframed is None:
+                dropped += 1
+                continue
+            frames.append(unframed[0])
+            corrected += unframed[1]
+        if len(flags):
+            consumed = int(flags[-1])
+            if len(bits) - consumed > self._max_frame_bits:
+                # the closing flag was lost, give up on the frame and wait for the next flag
+                consumed, dropped = len(bits) - len(FLAG) + 1, dropped + 1
+        else:
+            consumed = max(len(bits) - len(FLAG) + 1, 0)
+        return DeframeResult(frames, corrected, dropped), consumed
+
+
+FRAMERS: typing.Dict[str, typing.Callable[[Codec], HDLCFramer]] = {
+    'hdlc': HDLCFramer
+}
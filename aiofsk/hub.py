@@ -0,0 +1,145 @@
+import typing
+import asyncio
+import contextlib
+import concurrent.futures
+import numpy as np
+import sounddevice as sd
+
+from aiofsk.baud import DEFAULT_BAUD_OPTIONS
+from aiofsk.util import RingBuffer, SampleQueue
+
+DEFAULT_BLOCKSIZE = 1024  # samples per sound device callback
+
+
+class AudioPort(typing.NamedTuple):
+    channel: int
+    audio_in: SampleQueue
+    audio_out: RingBuffer
+
+
+class AudioHub:
+    """
+    One sound device stream shared by any number of modems
+
+    Each modem attaches a port to a channel. Every port on a channel hears all of the channel's input, and the
+    output of the ports on a channel is mixed, so ports with different tone pairs can share a channel as frequency
+    divided sub-bands. The stream is opened while at least one user is inside open().
+
+    Demodulation for the ports is meant to run on the hub's thread pool so the modems decode in parallel.
+    """
+
+    def __init__(self, channels: int = 1, sample_rate: int = DEFAULT_BAUD_OPTIONS.sample_rate,
+                 blocksize: int = DEFAULT_BLOCKSIZE, latency: typing.Optional[typing.Union[float, str]] = None,
+                 loopback: bool = False, device='default', max_workers: typing.Optional[int] = None):
+        self.channels = channels
+        self.sample_rate = sample_rate
+        self.blocksize = blocksize
+        self.latency = latency
+        self.loopback = loopback
+        self.device = device
+        self._max_workers = max_workers
+        self._executor: typing.Optional[concurrent.futures.ThreadPoolExecutor] = None
+        # replaced rather than mutated so the audio thread always sees a consistent tuple
+        self._ports: typing.Tuple[AudioPort, ...] = ()
+        self._scratch = np.zeros(0, dtype=np.float32)
+        self._dry: typing.Set[AudioPort] = set()  # ports whose ring ran dry partway through the last block
+        self._users = 0
+        self._stream: typing.Optional[contextlib.AbstractAsyncContextManager] = None
+        # reported by the sound device, output the callback was too late to fill and input it was too late to take
+        self.output_underflows = 0
+        self.input_overflows = 0
+        # blocks a port's ring ran dry partway through, padded with silence, and had samples again by the next, a
+        # hole in the middle of a transmission because the modulator fell behind
+        self.output_underruns = 0
+
+    @property
+    def executor(self) -> concurrent.futures.Executor:
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(self._max_workers, thread_name_prefix='aiofsk')
+        return self._executor
+
+    @property
+    def ports(self) -> typing.Tuple[AudioPort, ...]:
+        return self._ports
+
+    def attach(self, channel: int, audio_in: SampleQueue, audio_out: RingBuffer) -> AudioPort:
+        if not 0 <= channel < self.channels:
+            raise ValueError(f"channel {channel} is out of range for {self.channels} channels")
+        port = AudioPort(channel, audio_in, audio_out)
+        self._ports += (port,)
+        return port
+
+    def detach(self, port: AudioPort):
+        self._ports = tuple(p for p in self._ports if p is not port)
+
+    def _play(self, outdata: np.ndarray):
+        outdata.fill(0)
+        if len(self._scratch) < len(outdata):
+            self._scratch = np.zeros(len(outdata), dtype=np.float32)
+        dry = set()
+        for port in self._ports:
+            played = len(port.audio_out.read(len(outdata), self._scratch))
+            outdata[:played, port.channel] += self._scratch[:played]
+            if played and port in self._dry:
+                self.output_underruns += 1
+            if 0 < played < len(outdata):
+                dry.add(port)
+        self._dry = dry
+
+    def _record(self, indata: np.ndarray):
+        for port in self._ports:
+            port.audio_in.put_threadsafe(indata[:, port.channel])
+
+    def _callback(self, indata, outdata, frame_count, time_info, status):
+        if status:
+            self.output_underflows += status.output_underflow
+            self.input_overflows += status.input_overflow
+        self._play(outdata)
+        self._record(indata)
+
+    @contextlib.asynccontextmanager
+    async def _pipe_audio(self):
+        with sd.Stream(device=self.device, channels=self.channels, callback=self._callback, dtype='float32',
+                       samplerate=self.sample_rate, blocksize=self.blocksize, latency=self.latency):
+            yield
+
+    @contextlib.asynccontextmanager
+    async def _loopback_audio(self):  # a mock sounddevice.Stream
+        # attempt to replicate the real timing of the callback calls, on an event loop with a virtual clock, such as
+        # the tests' VirtualClockEventLoop, the blocks are pumped as fast as the modems keep up with them instead
+        delay = self.blocksize / self.sample_rate
+
+        async def connect():
+            outdata = np.zeros((self.blocksize, self.channels), dtype=np.float32)
+
+            while True:
+                await asyncio.sleep(delay)
+                self._play(outdata)
+                self._record(outdata)
+
+        connect_task = asyncio.create_task(connect())
+        try:
+            yield
+        finally:
+            if not connect_task.done():
+                connect_task.cancel()
+
+    @contextlib.asynccontextmanager
+    async def open(self):
+        """
+        Keep the stream open for the duration of the context, shared with every other user of the hub
+        """
+        if not self._users:
+            self._stream = self._loopback_audio() if self.loopback else self._pipe_audio()
+            await self._stream.__aenter__()
+        self._users += 1
+        try:
+            yield self
+        finally:
+            self._users -= 1
+            if not self._users:
+                stream, self._stream = self._stream, None
+                await stream.__aexit__(None, None, None)
+                if self._executor is not None:
+                    self._executor.shutdown(wait=False)
+                    self._executor = None
@@ -0,0 +1,122 @@
+import time
+import bisect
+import typing
+import contextlib
+
+LATENCY_BOUNDS = (1e-5, 1e-4, 1e-3, 1e-2, 1e-1, 1.0)  # seconds
+DEPTH_BOUNDS = tuple(4 ** i for i in range(11))  # items or samples waiting in a queue
+
+
+class Histogram:
+    """
+    Counts of observations falling at or below each bound, the last bucket is everything above the last bound
+    """
+    __slots__ = ('bounds', 'buckets', 'count', 'total', 'min', 'max')
+
+    def __init__(self, bounds: typing.Sequence[float]):
+        self.bounds = tuple(bounds)
+        self.buckets = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = float('inf')
+        self.max = float('-inf')
+
+    def observe(self, value: float):
+        self.buckets[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def snapshot(self) -> typing.Dict[str, typing.Any]:
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else None,
+            'min': self.min if self.count else None,
+            'max': self.max if self.count else None,
+            'bounds': list(self.bounds),
+            'buckets': list(self.buckets)
+        }
+
+
+class _Timer:
+    __slots__ = ('_metrics', '_name', '_start')
+
+    def __init__(self, metrics: 'Metrics', name: str):
+        self._metrics = metrics
+        self._name = name
+        self._start = 0.0
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self._metrics.observe(self._name, time.perf_counter() - self._start)
+
+
+class Metrics:
+    """
+    Counters, histograms and gauges of a modem
+
+    Counters and histograms are updated as things happen, gauges are functions read when a snapshot is taken, such
+    as the length of a queue or a counter kept by something else. Only to be used from the event loop thread.
+    """
+    enabled = True
+
+    def __init__(self):
+        self.counters: typing.Dict[str, int] = {}
+        self.histograms: typing.Dict[str, Histogram] = {}
+        self._gauges: typing.Dict[str, typing.Callable[[], float]] = {}
+
+    def increment(self, name: str, value: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name: str, value: float, bounds: typing.Sequence[float] = LATENCY_BOUNDS):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram(bounds)
+        histogram.observe(value)
+
+    def timer(self, name: str) -> typing.ContextManager:
+        """
+        Observe the seconds spent in the context in the histogram called name
+        """
+        return _Timer(self, name)
+
+    def add_gauge(self, name: str, read: typing.Callable[[], float]):
+        self._gauges[name] = read
+
+    def snapshot(self) -> typing.Dict[str, typing.Any]:
+        """
+        :return: json serializable copy of every metric
+        """
+        return {
+            'counters': dict(self.counters),
+            'gauges': {name: read() for name, read in self._gauges.items()},
+            'histograms': {name: histogram.snapshot() for name, histogram in self.histograms.items()}
+        }
+
+
+class NullMetrics(Metrics):
+    """
+    Metrics that are not kept, every update is a no-op
+    """
+    enabled = False
+    _timer = contextlib.nullcontext()
+
+    def increment(self, name: str, value: int = 1):
+        pass
+
+    def observe(self, name: str, value: float, bounds: typing.Sequence[float] = LATENCY_BOUNDS):
+        pass
+
+    def timer(self, name: str) -> typing.ContextManager:
+        return self._timer
+
+    def add_gauge(self, name: str, read: typing.Callable[[], float]):
+        pass
+
+
+NULL_METRICS = NullMetrics()
@@ -1,10 +1,154 @@
 import typing
+import logging
+import functools
 import contextlib
 import asyncio
-import queue
+import concurrent.futures
 import numpy as np
-from aiofsk.ecc import HAMMING_8_4_CODE
-from aiofsk.baud import BaudRate, TONES
+from aiofsk.ecc import CODECS, DecodeResult, BlockInterleaver, InterleavedCodec
+from aiofsk.baud import BaudRate, TONES, PREAMBLE_GAP
+from aiofsk.framing import FRAMERS, DeframeResult
+from aiofsk.util import RingBuffer
+from aiofsk.metrics import Metrics, NULL_METRICS, DEPTH_BOUNDS
+
+if typing.TYPE_CHECKING:
+    from aiofsk.adaptive import LinkQuality
+
+log = logging.getLogger(__name__)
+
+TONE_TABLE_CACHE_SIZE = 64
+
+
+class ToneTable(typing.NamedTuple):
+    symbols: typing.Tuple[str, ...]
+    frames: np.ndarray  # read only (len(symbols), frame_size) symbol waveforms, also the demodulation templates
+    masks: typing.Tuple[typing.Tuple[float, ...], ...]  # the templates as python floats for the scalar scorer
+    quadrature: np.ndarray  # read only (2, len(symbols), frame_size) unit cosine and sine of each tone
+    cycles: typing.Tuple[float, ...]  # cycles of each tone per frame, also its bin in the frame's spectrum
+
+
+@functools.lru_cache(maxsize=TONE_TABLE_CACHE_SIZE)
+def _make_tone_table(baud: BaudRate, tones: typing.Tuple[typing.Tuple[str, int], ...], amplitude: float,
+                     dtype: str) -> ToneTable:
+    base_frame = np.arange(baud.frame_size) / baud.sample_rate
+    frequencies = np.array([tone for _, tone in tones]).reshape(-1, 1)
+    phase = 2 * np.pi * frequencies * base_frame
+    frames = (amplitude * np.cos(phase)).astype(dtype)
+    frames.setflags(write=False)
+    quadrature = np.stack((np.cos(phase), np.sin(phase))).astype(dtype)
+    quadrature.setflags(write=False)
+    return ToneTable(
+        tuple(symbol for symbol, _ in tones), frames, tuple(tuple(row.tolist()) for row in frames), quadrature,
+        tuple((frequencies[:, 0] * baud.frame_size / baud.sample_rate).tolist())
+    )
+
+
+def get_tone_table(baud: BaudRate, tones: typing.Dict[str, int], amplitude: float = 1.0,
+                   dtype: str = 'float32') -> ToneTable:
+    """
+    Get the symbol waveforms for a baud rate and set of tones, tables are shared by every modulator
+    through a bounded LRU cache
+    """
+    return _make_tone_table(baud, tuple(sorted(tones.items())), float(amplitude), str(np.dtype(dtype)))
+
+
+class TemplateDemodulator:
+    """
+    Scores frames by the sum of absolute differences from each symbol template, one sample at a time
+    """
+
+    def __init__(self, tone_table: ToneTable):
+        self._tone_table = tone_table
+
+    def detect(self, frames: np.ndarray) -> np.ndarray:
+        """
+        :param frames: (N, frame_size) block of frames
+        :return: (N,) index of the closest symbol for each frame, ties go to the lowest index
+        """
+        detected = np.zeros(len(frames), dtype=np.uint8)
+        for i, frame in enumerate(frames.tolist()):
+            best = None
+            for symbol, mask in enumerate(self._tone_table.masks):
+                diff = sum(abs(a - b) for (a, b) in zip(mask, frame))
+                if best is None or diff < best:
+                    best = diff
+                    detected[i] = symbol
+        return detected
+
+
+class VectorizedDemodulator(TemplateDemodulator):
+    """
+    Scores a whole block of frames against the symbol templates with array operations
+    """
+
+    def detect(self, frames: np.ndarray) -> np.ndarray:
+        frames = np.asarray(frames, dtype=np.float64)
+        scores = np.empty((len(frames), len(self._tone_table.frames)))
+        for symbol, template in enumerate(self._tone_table.frames.astype(np.float64)):
+            scores[:, symbol] = np.abs(frames - template).sum(axis=1)
+        return scores.argmin(axis=1).astype(np.uint8)
+
+
+class GoertzelDemodulator(TemplateDemodulator):
+    """
+    Non-coherent detector, picks the tone with the most energy in each frame
+
+    The energy is the squared magnitude of the in-phase and quadrature correlations with each tone, the same value
+    a Goertzel filter produces at the end of the frame, so the detection does not depend on the phase of the
+    received frame.
+    """
+
+    def detect(self, frames: np.ndarray) -> np.ndarray:
+        frames = np.asarray(frames, dtype=self._tone_table.quadrature.dtype)
+        in_phase = frames @ self._tone_table.quadrature[0].T
+        quadrature = frames @ self._tone_table.quadrature[1].T
+        return (in_phase * in_phase + quadrature * quadrature).argmax(axis=1).astype(np.uint8)
+
+
+class FFTDemodulator(TemplateDemodulator):
+    """
+    Filterbank from one real FFT per frame, picks the tone with the most energy like the Goertzel detector but in
+    O(frame_size log frame_size) per frame however many tones there are. Only for tones completing a whole number
+    of cycles per frame, in other words multiples of the baud rate.
+    """
+
+    def __init__(self, tone_table: ToneTable):
+        super().__init__(tone_table)
+        bins = np.array(tone_table.cycles)
+        if not np.allclose(bins, np.round(bins)):
+            raise ValueError("fft demodulation needs tones at multiples of the baud rate")
+        self._bins = np.round(bins).astype(np.int64)
+
+    def detect(self, frames: np.ndarray) -> np.ndarray:
+        spectrum = np.fft.rfft(np.asarray(frames, dtype=np.float32), axis=1)[:, self._bins]
+        return (spectrum.real * spectrum.real + spectrum.imag * spectrum.imag).argmax(axis=1).astype(np.uint8)
+
+
+class DiscriminatorDemodulator(TemplateDemodulator):
+    """
+    Delay and multiply FM discriminator. The correlation of each frame with itself delay samples later is about
+    cos(2 pi f delay / sample_rate) for a tone f whatever its phase, the detected symbol is the tone closest to it.
+    The delay is the one that spreads the tones furthest apart. Costs the same however many tones there are, but
+    needs more signal to noise than the goertzel detector.
+    """
+
+    def __init__(self, tone_table: ToneTable):
+        super().__init__(tone_table)
+        frame_size = tone_table.frames.shape[1]
+        delays = np.arange(1, max(frame_size // 2, 1) + 1).reshape(-1, 1)
+        responses = np.cos(2 * np.pi * np.array(tone_table.cycles) * delays / frame_size)
+        spread = np.abs(responses[:, :, np.newaxis] - responses[:, np.newaxis, :])
+        spread += np.eye(len(tone_table.cycles)) * 2  # a tone is not close to itself
+        best = int(spread.min(axis=(1, 2)).argmax())
+        self._delay = int(delays[best, 0])
+        self._responses = responses[best]
+
+    def detect(self, frames: np.ndarray) -> np.ndarray:
+        frames = np.asarray(frames, dtype=np.float64)
+        late, early = frames[:, self._delay:], frames[:, :-self._delay]
+        power = np.sqrt((late * late).sum(axis=1) * (early * early).sum(axis=1)) + 1e-12
+        correlation = (late * early).sum(axis=1) / power
+        return np.abs(correlation.reshape(-1, 1) - self._responses).argmin(axis=1).astype(np.uint8)
 
 
 def frequency_counter(wave, sample_rate):
@@ -23,11 +167,32 @@ def frequency_counter(wave, sample_rate):
 class Modulator:
     tones = TONES
     reverse_tones = {frequency: symbol for symbol, frequency in tones.items()}
-
-    def __init__(self, baud: BaudRate, amplitude=1.0):
+    bits_per_symbol = 1
+    default_demodulator = 'vectorized'
+    metrics: Metrics = NULL_METRICS
+    link_quality: typing.Optional['LinkQuality'] = None  # told about everything demodulated, for adaptive rates
+
+    def __init__(self, baud: BaudRate, amplitude=1.0, demodulator: typing.Optional[str] = None,
+                 preamble: typing.Sequence[int] = (), codec: str = 'hamming', interleave_depth: int = 1,
+                 framing: typing.Optional[str] = None, tones: typing.Optional[typing.Dict[str, int]] = None):
+        if tones is not None:
+            # a different tone pair, such as a sub-band sharing a channel with other modems
+            self.tones = tones
+            self.reverse_tones = {frequency: symbol for symbol, frequency in tones.items()}
         self._baud = baud
         self._amplitude = amplitude
-        self._base_frame = np.arange(self._baud.frame_size)
+        self._tone_table = get_tone_table(baud, self.tones, amplitude)
+        self._symbol_index = {symbol: i for i, symbol in enumerate(self._tone_table.symbols)}
+        self._demodulator = DEMODULATORS[demodulator or self.default_demodulator](self._tone_table)
+        self.codec = CODECS[codec]()
+        if interleave_depth > 1:
+            self.codec = InterleavedCodec(self.codec, BlockInterleaver(interleave_depth))
+        self.framer = FRAMERS[framing](self.codec) if framing else None
+        self._preamble = np.array(preamble, dtype=np.uint8)
+        gap = PREAMBLE_GAP * self.frame_size if len(self._preamble) else 0
+        self._preamble_frames = np.concatenate(
+            (np.zeros(gap, dtype=self._tone_table.frames.dtype), self.preamble_waveform)
+        )
         self.demodulated = asyncio.Queue()
 
     @property
@@ -38,6 +203,25 @@ class Modulator:
     def sample_rate(self):
         return self._baud.sample_rate
 
+    @property
+    def tone_table(self) -> ToneTable:
+        return self._tone_table
+
+    @property
+    def preamble_waveform(self) -> np.ndarray:
+        """
+        The raw (not encoded) preamble symbols sent ahead of each packet
+        """
+        return self._tone_table.frames[self._preamble].reshape(-1)
+
+    def packet_duration(self, data: bytes) -> float:
+        """
+        :return: seconds it takes to send the packet
+        """
+        with self.get_bits_encoder() as encode_bits:
+            symbols = encode_bits(self.framer.frame(data) if self.framer else self.codec.encode(data))
+        return (len(self._preamble_frames) + len(symbols) * self.frame_size) / self.sample_rate
+
     @contextlib.contextmanager
     def get_encoder(self):
         def encode(bit: str) -> str:
@@ -45,6 +229,13 @@ class Modulator:
 
         yield encode
 
+    @contextlib.contextmanager
+    def get_bits_encoder(self):
+        def encode_bits(bits: np.ndarray) -> np.ndarray:
+            return bits
+
+        yield encode_bits
+
     @contextlib.contextmanager
     def get_decoder(self):
         def decode(bit: bool) -> int:
@@ -54,22 +245,19 @@ class Modulator:
 
         yield decode
 
-    def modulate_bit(self, symbol: str) -> np.array:
-        tone = self.tones[symbol]
-        return self._amplitude * np.cos(
-            2 * np.pi * tone * (self._base_frame / self.sample_rate).reshape(-1, 1)
-        )
+    @contextlib.contextmanager
+    def get_bits_decoder(self):
+        def decode_bits(symbols: np.ndarray) -> np.ndarray:
+            return symbols
 
-    @staticmethod
-    def iter_symbols(char):
-        first = HAMMING_8_4_CODE.encode(char & 0b00001111)
-        second = HAMMING_8_4_CODE.encode((char & 0b11110000) >> 4)
+        yield decode_bits
 
-        for bit in range(7, -1, -1):
-            yield str((first >> bit) % 2)
+    def modulate_bit(self, symbol: str) -> np.array:
+        return self._tone_table.frames[self._symbol_index[symbol]].reshape(-1, 1)
 
-        for bit in range(7, -1, -1):
-            yield str((second >> bit) % 2)
+    def iter_symbols(self, char):
+        for bit in self.codec.encode(bytes((char,))).tolist():
+            yield str(bit)
 
     @contextlib.contextmanager
     def get_modulation_context(self):
@@ -80,64 +268,221 @@ class Modulator:
                     yield frame
             yield modulate_byte
 
+    @contextlib.contextmanager
+    def get_packet_modulation_context(self) -> typing.ContextManager[typing.Callable[[bytes], np.ndarray]]:
+        with self.get_bits_encoder() as encode_bits:
+            def modulate_packet(data: bytes) -> np.ndarray:
+                """
+                :param data: packet to modulate
+                :return: contiguous float32 waveform with shape (frame_size * symbols, 1)
+                """
+                symbols = encode_bits(self.framer.frame(data) if self.framer else self.codec.encode(data))
+                if not len(self._preamble):
+                    return self._tone_table.frames[symbols].reshape(-1, 1)
+                return np.concatenate(
+                    (self._preamble_frames, self._tone_table.frames[symbols].reshape(-1))
+                ).reshape(-1, 1)
+            yield modulate_packet
+
     @contextlib.contextmanager
     def get_demodulation_context(self) -> typing.ContextManager[typing.Callable[[np.ndarray], str]]:
         with self.get_decoder() as decode:
-            zero_mask = tuple([i[0] for i in self.modulate_bit('0')])
-            one_mask = tuple([i[0] for i in self.modulate_bit('1')])
+            one = self._symbol_index['1']
 
             def demodulate_bit(frame):
-                zero_diff = sum(abs(a - b[0]) for (a, b) in zip(zero_mask, frame))
-                one_diff = sum(abs(a - b[0]) for (a, b) in zip(one_mask, frame))
-                bit = decode(one_diff < zero_diff)
+                bit = decode(self._demodulator.detect(frame.reshape(1, -1))[0] == one)
                 # print(frequency_counter(frame, self.sample_rate), bit)
                 return bit
 
             yield demodulate_bit
 
-    async def modulate(self, data_in: asyncio.Queue, audio_out: queue.Queue):
+    @contextlib.contextmanager
+    def get_frame_demodulation_context(self) -> typing.ContextManager[typing.Callable[[np.ndarray], np.ndarray]]:
+        with self.get_bits_decoder() as decode_bits:
+            def demodulate_frames(frames: np.ndarray) -> np.ndarray:
+                """
+                :param frames: block of whole frames, either (N, frame_size) or (N * frame_size, 1)
+                :return: (N,) array of demodulated bits
+                """
+                return decode_bits(self._demodulator.detect(frames.reshape(-1, self.frame_size)))
+
+            yield demodulate_frames
+
+    @contextlib.contextmanager
+    def get_deframing_context(
+            self, skip_bits: int = 0) -> typing.ContextManager[typing.Callable[[np.ndarray], DeframeResult]]:
         """
-        Modulate bytes into audio out
+        Like get_packet_demodulation_context, keeping the frames apart. Requires a framer.
         """
-        loop = asyncio.get_event_loop()
+        assert self.framer is not None, "deframing requires a framer"
+        with self.get_frame_demodulation_context() as demodulate_frames:
+            bits = np.zeros(0, dtype=np.uint8)
+
+            def deframe(frames: np.ndarray) -> DeframeResult:
+                """
+                :param frames: block of whole frames, either (N, frame_size) or (N * frame_size, 1)
+                :return: every good frame completed by the frames
+                """
+                nonlocal bits, skip_bits
+                bits = np.concatenate((bits, demodulate_frames(frames)))
+                if skip_bits:
+                    skipped = min(skip_bits, len(bits))
+                    bits, skip_bits = bits[skipped:], skip_bits - skipped
+                result, consumed = self.framer.deframe_stream(bits)
+                bits = bits[consumed:]
+                return result
+
+            yield deframe
+
+    @contextlib.contextmanager
+    def get_packet_demodulation_context(
+            self, skip_bits: int = 0) -> typing.ContextManager[typing.Callable[[np.ndarray], DecodeResult]]:
+        """
+        :param skip_bits: number of demodulated bits to drop before decoding, such as a frame that only primes
+                          the bit decoder when starting in the middle of a stream
+        """
+        if self.framer:
+            with self.get_deframing_context(skip_bits) as deframe:
+                def demodulate_framed_packets(frames: np.ndarray) -> DecodeResult:
+                    result = deframe(frames)
+                    return DecodeResult(b''.join(result.frames), result.corrected, result.dropped)
+
+                yield demodulate_framed_packets
+            return
+        with self.get_frame_demodulation_context() as demodulate_frames:
+            bits = np.zeros(0, dtype=np.uint8)
+
+            def demodulate_packets(frames: np.ndarray) -> DecodeResult:
+                """
+                :param frames: block of whole frames, either (N, frame_size) or (N * frame_size, 1)
+                :return: the data of every codec block completed by the frames
+                """
+                nonlocal bits, skip_bits
+                bits = np.concatenate((bits, demodulate_frames(frames)))
+                if skip_bits:
+                    skipped = min(skip_bits, len(bits))
+                    bits, skip_bits = bits[skipped:], skip_bits - skipped
+                result, consumed = self.codec.decode_stream(bits)
+                bits = bits[consumed:]
+                return result
+
+            yield demodulate_packets
+
+    async def modulate(self, data_in: asyncio.Queue, audio_out: RingBuffer,
+                       on_queued: typing.Optional[typing.Callable[[int, int], None]] = None):
+        """
+        Modulate bytes into the audio out ring, each packet is modulated in one pass and written as soon as the
+        ring has room for it
 
-        with self.get_modulation_context() as modulate_byte:
+        :param on_queued: called with the size of each packet and the number of samples it was queued as
+        """
+        metrics = self.metrics
+        with self.get_packet_modulation_context() as modulate_packet:
             while True:
                 packet = await data_in.get()
-                for c in packet:
-                    for frame in modulate_byte(c):
-                        loop.call_soon_threadsafe(audio_out.put_nowait, frame)
+                with metrics.timer('modulate_seconds'):
+                    if self.framer and len(packet) > self.framer.max_frame_size:
+                        size = self.framer.max_frame_size
+                        segments = [packet[i:i + size] for i in range(0, len(packet), size)]
+                        waveform = np.concatenate([modulate_packet(segment) for segment in segments])
+                    else:
+                        segments = [packet]
+                        waveform = modulate_packet(packet)
+                    waveform = waveform.reshape(-1)
+                if metrics.enabled:
+                    symbols = (len(waveform) - len(segments) * len(self._preamble_frames)) // self.frame_size
+                    metrics.increment('bytes_modulated', len(packet))
+                    metrics.increment('bits_modulated', symbols * self.bits_per_symbol)
+                    metrics.observe('audio_out_samples', len(audio_out), DEPTH_BOUNDS)
+                written = audio_out.write(waveform)
+                while written < len(waveform):
+                    # wait for the audio callback to free up room for the rest, or half the ring if it is bigger
+                    await asyncio.sleep(min(len(waveform) - written, audio_out.capacity // 2) / self.sample_rate)
+                    written += audio_out.write(waveform[written:])
+                if on_queued:
+                    on_queued(len(packet), len(waveform))
+
+    async def demodulate(self, audio_in: asyncio.Queue, data_out: asyncio.Queue,
+                         executor: typing.Optional[concurrent.futures.Executor] = None):
+        """
+        Demodulate bytes from audio in, everything decoded from a batch of audio is put in data out as one item, with
+        a framer each good frame is its own item
 
-    async def demodulate(self, audio_in: asyncio.Queue, data_out: asyncio.Queue):
+        :param executor: run the demodulation of each batch on this (thread) pool instead of the event loop, batches
+                         are still demodulated one after the other
         """
-        Demodulate bytes from audio in
+        if self.framer:
+            return await self._demodulate_frames(audio_in, data_out, executor)
+        loop = asyncio.get_event_loop()
+        metrics, link_quality = self.metrics, self.link_quality
+        with self.get_packet_demodulation_context() as demodulate_packets:
+            demodulate_packets = self._measuring(demodulate_packets)
+            while True:
+                windows = [await audio_in.get()]
+                while not audio_in.empty():
+                    windows.append(audio_in.get_nowait())
+                samples = np.concatenate(windows)
+                with metrics.timer('demodulate_seconds'):
+                    result = await loop.run_in_executor(executor, demodulate_packets, samples) \
+                        if executor else demodulate_packets(samples)
+                if link_quality is not None:
+                    result, measured, bits = result
+                    link_quality.add(measured, bits, result.corrected)
+                if metrics.enabled:
+                    self._count_demodulated(len(windows), len(samples), len(result.data), result.corrected)
+                    metrics.increment('uncorrectable_blocks', result.uncorrectable)
+                if result.uncorrectable:
+                    log.warning("dropped %i uncorrectable codewords", result.uncorrectable)
+                if result.data:
+                    data_out.put_nowait(result.data)
+
+    def _measuring(self, demodulate: typing.Callable) -> typing.Callable:
+        """
+        With a link quality, wrap a demodulation function to also measure each batch on the same thread, the wrapper
+        returns (result, measurement, bits) for the loop to add to the link quality
         """
+        link_quality = self.link_quality
+        if link_quality is None:
+            return demodulate
+
+        def demodulate_and_measure(samples: np.ndarray):
+            frames = samples.reshape(-1)[:len(samples) - len(samples) % self.frame_size]
+            bits = len(frames) // self.frame_size * self.bits_per_symbol
+            return demodulate(samples), link_quality.measure(frames), bits
 
-        with self.get_demodulation_context() as demodulate_bit:
+        return demodulate_and_measure
+
+    def _count_demodulated(self, windows: int, samples: int, size: int, corrected: int):
+        self.metrics.observe('synchronized_frames', windows, DEPTH_BOUNDS)
+        self.metrics.increment('bits_demodulated', samples // self.frame_size * self.bits_per_symbol)
+        self.metrics.increment('bytes_demodulated', size)
+        self.metrics.increment('corrected_errors', corrected)
+
+    async def _demodulate_frames(self, audio_in: asyncio.Queue, data_out: asyncio.Queue,
+                                 executor: typing.Optional[concurrent.futures.Executor]):
+        loop = asyncio.get_event_loop()
+        metrics, link_quality = self.metrics, self.link_quality
+        with self.get_deframing_context() as deframe:
+            deframe = self._measuring(deframe)
             while True:
-                current_byte = 0
-                for _ in range(8):
-                    current_byte <<= 1
-                    window = await audio_in.get()
-                    current_byte += demodulate_bit(window)
-                first_nibble = HAMMING_8_4_CODE.decode(current_byte)
-                current_byte = 0
-                for _ in range(8):
-                    print("bit b")
-                    current_byte <<= 1
-                    window = await audio_in.get()
-                    current_byte += demodulate_bit(window)
-                second_nibble = HAMMING_8_4_CODE.decode(current_byte)
-                # print(bin((second_nibble << 4) + first_nibble))
-                if first_nibble == -1 or second_nibble == -1:
-                    print("fnord")
-                    1/0
-                decoded = ((second_nibble << 4) + first_nibble)
-                # print("decoded ", bin(decoded))
-                got_byte = decoded.to_bytes(1, byteorder='little')
-                print("got ", got_byte )
-                data_out.put_nowait(got_byte)
-                # print(f'{current_byte:#010b}'[2:], f' - {got_byte}')
+                windows = [await audio_in.get()]
+                while not audio_in.empty():
+                    windows.append(audio_in.get_nowait())
+                samples = np.concatenate(windows)
+                with metrics.timer('demodulate_seconds'):
+                    result = await loop.run_in_executor(executor, deframe, samples) \
+                        if executor else deframe(samples)
+                if link_quality is not None:
+                    result, measured, bits = result
+                    link_quality.add(measured, bits, result.corrected)
+                if metrics.enabled:
+                    self._count_demodulated(len(windows), len(samples), sum(map(len, result.frames)), result.corrected)
+                    metrics.increment('frames_received', len(result.frames))
+                    metrics.increment('frames_dropped', result.dropped)
+                if result.dropped:
+                    log.warning("dropped %i damaged frames", result.dropped)
+                for frame in result.frames:
+                    data_out.put_nowait(frame)
 
 
 class NonReturnToZeroModulator(Modulator):
@@ -158,6 +503,20 @@ class NonReturnToZeroModulator(Modulator):
 
         yield encode
 
+    @contextlib.contextmanager
+    def get_bits_encoder(self):
+        # parity of the number of transitions so far, 0 while the line is at '1'
+        transitions = 0
+
+        def encode_bits(bits: np.ndarray) -> np.ndarray:
+            nonlocal transitions
+            parity = (np.cumsum(bits, dtype=np.int64) + transitions) % 2
+            if len(parity):
+                transitions = int(parity[-1])
+            return (1 - parity).astype(np.uint8)
+
+        yield encode_bits
+
     @contextlib.contextmanager
     def get_decoder(self):
         decode_last = 1
@@ -175,8 +534,181 @@ class NonReturnToZeroModulator(Modulator):
 
         yield decode
 
+    @contextlib.contextmanager
+    def get_bits_decoder(self):
+        decode_last = 1
+
+        def decode_bits(symbols: np.ndarray) -> np.ndarray:
+            nonlocal decode_last
+            previous = np.concatenate(([decode_last], symbols[:-1]))
+            if len(symbols):
+                decode_last = int(symbols[-1])
+            return (symbols != previous).astype(np.uint8)
+
+        yield decode_bits
+
+
+class ContinuousPhaseModulator(Modulator):
+    """
+    Continuous phase FSK. Rather than starting every symbol at phase zero, a phase accumulator runs on from one
+    symbol to the next and from one packet to the next, so the waveform has no steps to spread energy outside the
+    tones. That matters once a symbol is not a whole number of cycles of each tone, such as 2400 baud on the
+    standard tones.
+
+    Symbols start at any phase, so the default demodulator is the phase insensitive goertzel detector, the
+    'discriminator' is the cheaper alternative. With a preamble every packet starts over at phase zero after the
+    silent gap, so the preamble always has the waveform the synchronizer looks for.
+    """
+    default_demodulator = 'goertzel'
+
+    def _synthesize(self, symbols: np.ndarray, phase: float) -> typing.Tuple[np.ndarray, float]:
+        """
+        :param symbols: indexes into the tone table
+        :param phase: phase of the oscillator at the start of the first symbol
+        :return: (frame_size * symbols,) float32 waveform and the phase at the end of it
+        """
+        steps = np.repeat(2 * np.pi * np.array(self._tone_table.cycles) / self.frame_size, self.frame_size)
+        steps = steps.reshape(-1, self.frame_size)[np.asarray(symbols, dtype=np.intp)].reshape(-1)
+        phases = np.cumsum(steps)
+        end = phase + float(phases[-1]) if len(phases) else phase
+        phases += phase - steps
+        return (self._amplitude * np.cos(phases)).astype(self._tone_table.frames.dtype), end % (2 * np.pi)
+
+    @property
+    def preamble_waveform(self) -> np.ndarray:
+        return self._synthesize(self._preamble, 0.0)[0]
+
+    @contextlib.contextmanager
+    def get_modulation_context(self):
+        with self.get_encoder() as encode:
+            phase = 0.0
+
+            def modulate_byte(char):
+                nonlocal phase
+                for symbol in self.iter_symbols(char):
+                    frame, phase = self._synthesize(np.array([self._symbol_index[encode(symbol)]]), phase)
+                    yield frame.reshape(-1, 1)
+            yield modulate_byte
+
+    @contextlib.contextmanager
+    def get_packet_modulation_context(self) -> typing.ContextManager[typing.Callable[[bytes], np.ndarray]]:
+        preamble_phase = self._synthesize(self._preamble, 0.0)[1]
+        with self.get_bits_encoder() as encode_bits:
+            phase = 0.0
+
+            def modulate_packet(data: bytes) -> np.ndarray:
+                nonlocal phase
+                symbols = encode_bits(self.framer.frame(data) if self.framer else self.codec.encode(data))
+                if not len(self._preamble):
+                    waveform, phase = self._synthesize(symbols, phase)
+                    return waveform.reshape(-1, 1)
+                waveform, phase = self._synthesize(symbols, preamble_phase)
+                return np.concatenate((self._preamble_frames, waveform)).reshape(-1, 1)
+            yield modulate_packet
+
+
+class MultiFrequencyModulator(Modulator):
+    """
+    M-ary FSK, each symbol is one of tone_count tones spaced one baud apart and carries log2(tone_count) bits
+
+    When the bits per symbol do not divide the codec block size each block is padded with zeros to a whole number
+    of symbols, and the padding is stripped again on the way in. Codecs without a fixed block size need framing,
+    where the padding after a frame's closing flag is ignored by the deframer.
+    """
+    tone_count = 4
+    default_demodulator = 'fft'
+
+    def __init__(self, baud: BaudRate, amplitude=1.0, demodulator: typing.Optional[str] = None,
+                 preamble: typing.Sequence[int] = (), codec: str = 'hamming', interleave_depth: int = 1,
+                 framing: typing.Optional[str] = None, tones: typing.Optional[typing.Dict[str, int]] = None):
+        super().__init__(
+            baud, amplitude, demodulator, preamble, codec, interleave_depth, framing,
+            self.make_tones(baud, self.tone_count) if tones is None else tones
+        )
+        self._block_bits = 0 if self.framer else self.codec.fixed_block_bits
+        if not self.framer and not self._block_bits:
+            raise ValueError(f"{codec} has blocks of varying size, mfsk needs framing to use it")
+        self._padded_block_bits = -(-self._block_bits // self.bits_per_symbol) * self.bits_per_symbol
+        self._shifts = np.arange(self.bits_per_symbol - 1, -1, -1, dtype=np.uint8)
+
+    @classmethod
+    def make_tones(cls, baud: BaudRate, tone_count: int) -> typing.Dict[str, int]:
+        """
+        tone_count tones one baud apart from the first multiple of the baud at or above the standard '0' tone,
+        named by hex digit so the tone table keeps them in order
+        """
+        first = -(-TONES['0'] // baud.baud) * baud.baud
+        tones = {format(i, 'x'): first + i * baud.baud for i in range(tone_count)}
+        if max(tones.values()) >= baud.sample_rate // 2:
+            raise ValueError(f"{tone_count} tones at {baud.baud} baud do not fit below the nyquist frequency")
+        return tones
+
+    @property
+    def bits_per_symbol(self) -> int:
+        return self.tone_count.bit_length() - 1
+
+    def _pad(self, bits: np.ndarray) -> np.ndarray:
+        if self._block_bits:
+            blocks = bits.reshape(-1, self._block_bits)
+            return np.pad(blocks, ((0, 0), (0, self._padded_block_bits - self._block_bits))).reshape(-1)
+        return np.concatenate((bits, np.zeros(-len(bits) % self.bits_per_symbol, dtype=bits.dtype)))
+
+    @contextlib.contextmanager
+    def get_bits_encoder(self):
+        def encode_bits(bits: np.ndarray) -> np.ndarray:
+            return (self._pad(bits).reshape(-1, self.bits_per_symbol) << self._shifts).sum(
+                axis=1, dtype=np.uint8
+            )
+
+        yield encode_bits
+
+    @contextlib.contextmanager
+    def get_bits_decoder(self):
+        # position in the padded codec block the next bit falls on
+        offset = 0
+
+        def decode_bits(symbols: np.ndarray) -> np.ndarray:
+            nonlocal offset
+            bits = ((symbols.reshape(-1, 1) >> self._shifts) & 1).astype(np.uint8).reshape(-1)
+            if not self._block_bits:
+                return bits
+            keep = (offset + np.arange(len(bits))) % self._padded_block_bits < self._block_bits
+            offset = (offset + len(bits)) % self._padded_block_bits
+            return bits[keep]
+
+        yield decode_bits
+
+    def iter_symbols(self, char):
+        with self.get_bits_encoder() as encode_bits:
+            for symbol in encode_bits(self.codec.encode(bytes((char,)))).tolist():
+                yield self._tone_table.symbols[symbol]
+
+
+class MFSK4Modulator(MultiFrequencyModulator):
+    tone_count = 4
+
+
+class MFSK8Modulator(MultiFrequencyModulator):
+    tone_count = 8
+
+
+class MFSK16Modulator(MultiFrequencyModulator):
+    tone_count = 16
+
+
+DEMODULATORS: typing.Dict[str, typing.Type[TemplateDemodulator]] = {
+    'template': TemplateDemodulator,
+    'vectorized': VectorizedDemodulator,
+    'goertzel': GoertzelDemodulator,
+    'fft': FFTDemodulator,
+    'discriminator': DiscriminatorDemodulator
+}
 
 MODULATORS: typing.Dict[str, typing.Type[Modulator]] = {
     'standard': Modulator,
-    'nrzi': NonReturnToZeroModulator
+    'nrzi': NonReturnToZeroModulator,
+    'cpfsk': ContinuousPhaseModulator,
+    'mfsk4': MFSK4Modulator,
+    'mfsk8': MFSK8Modulator,
+    'mfsk16': MFSK16Modulator
 }
@@ -1,35 +1,210 @@
-import collections
+import typing
 import asyncio
 import numpy as np
-from aiofsk.util import DoubleEvent
+from aiofsk.util import DoubleEvent, RingBuffer, SampleQueue
+from aiofsk.metrics import Metrics, NULL_METRICS
+
+DEFAULT_INPUT_BUFFER = 2 ** 20  # samples, about 20 seconds
+
+if typing.TYPE_CHECKING:
+    from aiofsk.modulation import Modulator
 
 
 class FrameSynchronizer:
-    def __init__(self, frame_size, receiving: DoubleEvent):
+    uses_preamble = False
+    metrics: Metrics = NULL_METRICS
+    sending: typing.Optional[DoubleEvent] = None  # set while this end is on the air, its audio is not synchronized
+
+    def __init__(self, frame_size, receiving: DoubleEvent, silence_threshold: float = 0.0,
+                 audio_in: typing.Optional[SampleQueue] = None):
         self._frame_size = frame_size
+        self._silence_threshold = silence_threshold
+        self._samples = RingBuffer(frame_size * 4)
         self.receiving = receiving
-        self.unsynchronized_audio_in = asyncio.Queue()
+        self.unsynchronized_audio_in = SampleQueue(DEFAULT_INPUT_BUFFER) if audio_in is None else audio_in
         self.synchronized_audio_in = asyncio.Queue()
 
+    @classmethod
+    def from_modulator(cls, modulator: 'Modulator', receiving: DoubleEvent,
+                       audio_in: typing.Optional[SampleQueue] = None):
+        return cls(modulator.frame_size, receiving, audio_in=audio_in)
+
+    def _trim_silence(self):
+        """
+        Drop leading silence, keeping the last silent sample before the signal starts
+        """
+        loud = np.abs(self._samples.peek(len(self._samples))) > self._silence_threshold
+        first = int(loud.argmax()) if loud.any() else len(loud)
+        if first > 1:
+            self.metrics.increment('synchronizer_samples_dropped', self._samples.discard(first - 1))
+
+    def _process(self) -> bool:
+        """
+        Move the frames that can be synchronized from the buffered samples to synchronized_audio_in
+
+        :return: True while a transmission is being received
+        """
+        self._trim_silence()
+        synchronized = False
+        while len(self._samples) >= self._frame_size:
+            self.receiving.set()
+            self.synchronized_audio_in.put_nowait(self._samples.read(self._frame_size).reshape(-1, 1))
+            synchronized = True
+        return synchronized
+
+    def feed(self, block: np.ndarray) -> bool:
+        """
+        Synchronize a block of audio straight away, the frames go to synchronized_audio_in
+
+        :return: True if any of the block was part of a transmission
+        """
+        synchronized = False
+        while len(block):
+            block = block[self._samples.write(block):]
+            synchronized = self._process() or synchronized
+        return synchronized
+
     async def synchronize(self):
         """
         Drop silence and compensate for misaligned audio frames
         """
-        samples = collections.deque(maxlen=self._frame_size * 2)
-
         while True:
-            if len(samples) < self._frame_size:
-                sample = await self.unsynchronized_audio_in.get()
-                samples.extend(sample.tolist())
-                while len(samples) >= 2 and samples[0] == samples[1] == [0.0]:
-                    samples.popleft()
-
-            if len(samples) >= self._frame_size:
-                self.receiving.set()
-                window = np.ndarray((self._frame_size, 1))
-                for i in range(self._frame_size):
-                    sample = samples.popleft()
-                    window[i] = sample
-                self.synchronized_audio_in.put_nowait(window)
-            else:
+            block = await self.unsynchronized_audio_in.get()
+            if self.sending is not None and self.sending.is_set():
+                # a half duplex end only hears itself while it is on the air
+                self.metrics.increment('synchronizer_samples_dropped', len(block))
+                continue
+            with self.metrics.timer('synchronize_seconds'):
+                synchronized = self.feed(block)
+            if not synchronized:
                 self.receiving.clear()
+
+
+class PreambleSynchronizer(FrameSynchronizer):
+    """
+    Locks the frame phase by cross-correlating the audio with the preamble sent ahead of each transmission, then
+    follows clock drift between the sound cards with an early/late gate on the symbol templates. Frames are
+    interpolated at the fractional sample offset the gate settles on. The lock is dropped when the frame power
+    falls below the squelch, such as in the silent gap before the next preamble.
+    """
+    uses_preamble = True
+
+    def __init__(self, frame_size, receiving: DoubleEvent, preamble: np.ndarray, templates: np.ndarray,
+                 threshold: float = 0.6, timing_gain: float = 0.25, squelch: float = 0.25,
+                 audio_in: typing.Optional[SampleQueue] = None):
+        super().__init__(frame_size, receiving, audio_in=audio_in)
+        self._preamble = np.asarray(preamble, dtype=np.float64).reshape(-1)
+        self._preamble_energy = float(np.dot(self._preamble, self._preamble))
+        self._templates = np.asarray(templates, dtype=np.float64)
+        self._threshold = threshold
+        self._timing_gain = timing_gain
+        self._squelch = squelch
+        self._gate = max(1, frame_size // 8)
+        self._samples = RingBuffer(4 * (len(self._preamble) + frame_size))
+        self._locked = False
+        self._timing = 0.0  # fractional offset of the next symbol from the early gate
+        self._signal_power = 0.0
+
+    @classmethod
+    def from_modulator(cls, modulator: 'Modulator', receiving: DoubleEvent,
+                       audio_in: typing.Optional[SampleQueue] = None):
+        return cls(
+            modulator.frame_size, receiving, modulator.preamble_waveform, modulator.tone_table.frames,
+            audio_in=audio_in
+        )
+
+    @property
+    def locked(self) -> bool:
+        return self._locked
+
+    @property
+    def _window_span(self) -> int:
+        return self._frame_size + 2 * self._gate + 2
+
+    def _search(self) -> bool:
+        """
+        Look for the preamble in the buffered samples, on a match drop everything up to the first frame after it
+        """
+        preamble_size = len(self._preamble)
+        available = len(self._samples)
+        if available < preamble_size + self._window_span:
+            return False
+        samples = self._samples.peek(available).astype(np.float64)
+        fft_size = 1 << (available + preamble_size).bit_length()
+        lags = available - preamble_size + 1
+        correlation = np.fft.irfft(
+            np.fft.rfft(samples, fft_size) * np.conj(np.fft.rfft(self._preamble, fft_size)), fft_size
+        )[:lags]
+        energy = np.concatenate(([0.0], np.cumsum(samples * samples)))
+        local_energy = energy[preamble_size:] - energy[:-preamble_size]
+        normalized = correlation / np.sqrt(local_energy * self._preamble_energy + 1e-12)
+        candidates = np.flatnonzero(normalized > self._threshold)
+        if not len(candidates):
+            # keep the tail in case the preamble straddles the next block
+            self.metrics.increment('synchronizer_samples_dropped', self._samples.discard(lags))
+            return False
+        first = int(candidates[0])
+        if first + preamble_size > lags and self._samples.free:
+            # wait until the peak can be picked out of the lags following the first match
+            return False
+        peak = first + int(normalized[first:first + preamble_size].argmax())
+        offset = 0.0
+        if 0 < peak < lags - 1:
+            before, at, after = normalized[peak - 1:peak + 2]
+            curvature = before - 2 * at + after
+            if curvature < 0:
+                offset = 0.5 * (before - after) / curvature
+        first_symbol = peak + preamble_size + offset
+        self.metrics.increment(
+            'synchronizer_samples_dropped', self._samples.discard(int(np.floor(first_symbol)) - self._gate)
+        )
+        self.metrics.increment('synchronizer_locks')
+        self._timing = first_symbol - np.floor(first_symbol)
+        self._signal_power = local_energy[peak] / preamble_size
+        self._locked = True
+        return True
+
+    def _interpolate(self, samples: np.ndarray, offset: float) -> np.ndarray:
+        index = int(np.floor(offset))
+        fraction = offset - index
+        return (1 - fraction) * samples[index:index + self._frame_size] + \
+            fraction * samples[index + 1:index + self._frame_size + 1]
+
+    def _match(self, window: np.ndarray) -> float:
+        return max(float((self._templates @ window).max()), 0.0)
+
+    def _track(self) -> typing.Optional[np.ndarray]:
+        """
+        Interpolate the next frame and nudge the symbol timing toward the better matching of the early and late
+        gates, returns None once the signal drops below the squelch
+        """
+        samples = self._samples.peek(self._window_span).astype(np.float64)
+        on_time = self._gate + self._timing
+        window = self._interpolate(samples, on_time)
+        if np.dot(window, window) / self._frame_size < self._squelch * self._signal_power:
+            self._locked = False
+            return None
+        early = self._match(self._interpolate(samples, on_time - self._gate))
+        late = self._match(self._interpolate(samples, on_time + self._gate))
+        error = (late - early) / (late + early) if late + early else 0.0
+        next_symbol = on_time + self._frame_size + np.clip(self._timing_gain * self._gate * error, -1.0, 1.0)
+        self._samples.discard(int(np.floor(next_symbol)) - self._gate)
+        self._timing = next_symbol - np.floor(next_symbol)
+        return window.astype(np.float32).reshape(-1, 1)
+
+    def _process(self) -> bool:
+        while self._locked or self._search():
+            if len(self._samples) < self._window_span:
+                break
+            window = self._track()
+            if window is None:
+                continue
+            self.receiving.set()
+            self.synchronized_audio_in.put_nowait(window)
+        return self._locked
+
+
+SYNCHRONIZERS: typing.Dict[str, typing.Type[FrameSynchronizer]] = {
+    'silence': FrameSynchronizer,
+    'preamble': PreambleSynchronizer
+}
@@ -1,136 +1,383 @@
-import time
-import queue
+import random
+import typing
 import asyncio
 import threading
-import contextlib
-import numpy as np
-import sounddevice as sd
+import collections
 
-from aiofsk.baud import DEFAULT_BAUD_OPTIONS
+from aiofsk.baud import DEFAULT_BAUD_OPTIONS, PREAMBLE
 from aiofsk.modulation import MODULATORS
-from aiofsk.util import DoubleEvent
-from aiofsk.synchronizer import FrameSynchronizer
+from aiofsk.util import DoubleEvent, RingBuffer, SampleQueue
+from aiofsk.hub import AudioHub, AudioPort, DEFAULT_BLOCKSIZE
+from aiofsk.synchronizer import SYNCHRONIZERS
+from aiofsk.arq import SelectiveRepeatARQ, HEADER as ARQ_HEADER
+from aiofsk.metrics import Metrics, NULL_METRICS
+from aiofsk.adaptive import Rate, RateController, LinkQuality
+from aiofsk.compression import COMPRESSORS
 
-
-def audio_pipe(q_in, q_out, samplerate, blocksize, loopback=True):
-    loop = asyncio.get_event_loop()
-
-    def callback(indata, outdata, frame_count, time_info, status):
-
-        try:
-            # copy microphone input frame into incoming queue
-            loop.call_soon_threadsafe(q_in.put_nowait, indata.copy())
-        except RuntimeError:
-            # raised if the loop stopped
-            pass
-        try:
-            # put speaker output frame if one is ready
-            outdata[:] = q_out.get_nowait()
-        except queue.Empty:
-            # otherwise fill silence
-            outdata.fill(0)
-        # if status:
-        #     print(status)
-
-    @contextlib.asynccontextmanager
-    async def pipe_audio():
-        with sd.Stream(device='default', channels=1, callback=callback,
-                       samplerate=samplerate, blocksize=blocksize):
-            yield
-
-    @contextlib.asynccontextmanager
-    async def loopback_audio():  # a mock sounddevice.Stream
-        # attempt to replicate the real timing of the callback calls
-        delay = 1 / (samplerate / blocksize)
-
-        async def connect():
-            silence = np.zeros((blocksize, 1))
-
-            while True:
-                await asyncio.sleep(delay)
-                try:
-                    outdata = q_out.get_nowait()
-                except queue.Empty:
-                    outdata = silence
-                try:
-                    loop.call_soon_threadsafe(q_in.put_nowait, outdata.copy())
-                except RuntimeError:
-                    pass
-
-        connect_task = asyncio.create_task(connect())
-        try:
-            yield
-        finally:
-            if connect_task and not connect_task.done():
-                connect_task.cancel()
-
-    if loopback:
-        return loopback_audio()
-    return pipe_audio()
+DEFAULT_WRITE_HIGH_WATER = 4096  # bytes
+DEFAULT_READ_LIMIT = 2 ** 16  # bytes, the same as asyncio streams
+DEFAULT_OUTPUT_BUFFER = 2.0  # seconds of audio that can be queued for output
+DEFAULT_INPUT_BUFFER = 2.0  # seconds of audio that can be waiting for the synchronizer
+DEFAULT_INPUT_BLOCKS = 8  # device blocks of audio the input gathers between transmissions before waking the loop
 
 
 class AFSKTransport(asyncio.Transport):
     baud_rate_options = DEFAULT_BAUD_OPTIONS
 
     def __init__(self, baud: int = DEFAULT_BAUD_OPTIONS.default, loopback: bool = False, modulator: str = 'standard',
-                 amplitude: float = 0.2):
+                 amplitude: float = 0.2, demodulator: typing.Optional[str] = None, synchronizer: str = 'silence',
+                 fec: str = 'hamming', interleave_depth: int = 1, framing: typing.Optional[str] = None,
+                 reliable: bool = False, station: typing.Optional[int] = None, window: int = 32,
+                 blocksize: int = DEFAULT_BLOCKSIZE, latency: typing.Optional[typing.Union[float, str]] = None,
+                 output_buffer: float = DEFAULT_OUTPUT_BUFFER, input_buffer: float = DEFAULT_INPUT_BUFFER,
+                 input_interval: typing.Optional[float] = None, hub: typing.Optional[AudioHub] = None,
+                 channel: int = 0, tones: typing.Optional[typing.Dict[str, int]] = None,
+                 metrics: typing.Optional[Metrics] = None, adaptive: bool = False,
+                 rates: typing.Optional[typing.Sequence[Rate]] = None, compression: typing.Optional[str] = None,
+                 compression_dictionary: typing.Optional[bytes] = None):
+        """
+        :param hub: share the sound device with other modems, by default the transport gets a hub of its own built
+                    from blocksize, latency and loopback. A shared hub decides those itself.
+        :param input_interval: seconds of audio the input gathers between transmissions before waking the loop,
+                               the latency added to the start of one, by default DEFAULT_INPUT_BLOCKS device
+                               blocks. While receiving the loop wakes for every block.
+        :param channel: channel of the hub to use
+        :param tones: tone pair to use instead of the modulator's, to share a channel with modems on other tones
+        :param metrics: where to keep the metrics of the modem, by default they are not kept
+        :param adaptive: negotiate the fastest rate the link supports with the other end, implies reliable. Starts
+                         and falls back at the first of rates.
+        :param rates: (baud, fec) pairs from slowest to fastest for adaptive, by default baud and every faster baud
+                      rate the modulator can run at, with fec
+        :param compression: compress each frame with this compressor, implies framing
+        :param compression_dictionary: preset dictionary for the compressor instead of its default, such as one
+                                       made by aiofsk.compression.train_dictionary. Both ends need the same one.
+        """
         super().__init__()
-        self.loopback = loopback
+        if adaptive:
+            reliable = True
+            rates = [Rate(*rate) for rate in rates] if rates else self._default_rates(baud, modulator, fec, tones)
+            baud, fec = rates[0]
         self.baud_rate = self.baud_rate_options.make_baud_nt(baud)
-        self.modulator = MODULATORS[modulator](self.baud_rate, amplitude)
+        self.hub = hub or AudioHub(1, self.baud_rate.sample_rate, blocksize, latency, loopback)
+        if self.hub.sample_rate != self.baud_rate.sample_rate:
+            raise ValueError(f"the hub runs at {self.hub.sample_rate}, expected {self.baud_rate.sample_rate}")
+        self.loopback = self.hub.loopback
+        self.channel = channel
+        self._port: typing.Optional[AudioPort] = None
+        if reliable or compression:
+            # arq and compression need the frame boundaries
+            framing = framing or 'hdlc'
+        self.compressor = None
+        if compression:
+            compressor_class = COMPRESSORS[compression]
+            self.compressor = compressor_class() if compression_dictionary is None else \
+                compressor_class(compression_dictionary)
+        self._modulator_class = MODULATORS[modulator]
+        self._synchronizer_class = SYNCHRONIZERS[synchronizer]
+        self._modem_options = (amplitude, demodulator, interleave_depth, framing, tones)
+        self.fec = fec
+        self._adaptive = adaptive
+        self.link_quality: typing.Optional[LinkQuality] = None  # of the current rate, kept when adaptive
         self._data_in: asyncio.Queue[bytes] = asyncio.Queue()
         self._data_out: asyncio.Queue[bytes] = asyncio.Queue()
-        self._audio_out: queue.Queue[np.ndarray] = queue.Queue()
+        self.blocksize = self.hub.blocksize
+        self._audio_out = RingBuffer(max(int(output_buffer * self.baud_rate.sample_rate), self.blocksize))
 
         self._stop = asyncio.Event()
         self._stop.set()
         self._stop_listen = threading.Event()
         self._stop_output = threading.Event()
 
-        # initialize to 0
-        self._audio_out.put(np.zeros((self.baud_rate.frame_size, 1), dtype='float32'))
         self.loop = asyncio.get_event_loop()
         self._receiving = DoubleEvent()
         self._sending = DoubleEvent()
-        self.synchronizer = FrameSynchronizer(self.baud_rate.frame_size, self._receiving)
+        notify_samples = DEFAULT_INPUT_BLOCKS * self.blocksize if input_interval is None else \
+            int(input_interval * self.baud_rate.sample_rate)
+        self._audio_in = SampleQueue(
+            max(int(input_buffer * self.baud_rate.sample_rate), self.blocksize, 2 * notify_samples), notify_samples,
+            active=self._receiving
+        )
+        self.metrics = NULL_METRICS if metrics is None else metrics
+        self._make_modem(self.baud_rate, fec)
+        self._modem_tasks: typing.List[asyncio.Task] = []
+        self._modem_lock = asyncio.Lock()  # held by a burst of arq frames or a change of rate
         self.connected = asyncio.Event()
+        self.rate_controller = RateController(self, rates) if adaptive else None
+        self.arq: typing.Optional[SelectiveRepeatARQ] = None
+        if reliable:
+            # in loopback we are our own peer, so our own frames are not echoes to ignore
+            self.arq = SelectiveRepeatARQ(
+                self._transmit, random.randrange(256) if station is None else station, window,
+                self.modulator.framer.max_frame_size - ARQ_HEADER.size, ignore_own=not self.loopback,
+                on_control=self.rate_controller.control_received if self.rate_controller else None
+            )
+
+        # without a protocol of its own the transport feeds a stream reader, which read() reads from
+        self.reader = asyncio.StreamReader(DEFAULT_READ_LIMIT)
+        self._protocol: asyncio.BaseProtocol = asyncio.StreamReaderProtocol(self.reader)
+        self._delivery_task: typing.Optional[asyncio.Task] = None
+        self._reading = asyncio.Event()
+        self._reading.set()
+        # write buffer accounting, in bytes not yet modulated and samples not yet played
+        self._unmodulated = 0
+        self._queued_samples = 0
+        self._unplayed: typing.Deque[typing.Tuple[int, int]] = collections.deque()
+        # arq frames modulated so far, a burst is paced by the samples its frames were queued as
+        self._queued_frames = 0
+        self._frame_queued = asyncio.Event()
+        self._high_water, self._low_water = 0, 0
+        self.set_write_buffer_limits()
+        self._writing_paused = False
+        self._resume_writing_task: typing.Optional[asyncio.Task] = None
+        self._add_metrics()
+
+    @classmethod
+    def _default_rates(cls, baud: int, modulator: str, fec: str,
+                       tones: typing.Optional[typing.Dict[str, int]]) -> typing.List[Rate]:
+        rates = []
+        for option in sorted(cls.baud_rate_options.bauds):
+            if option < baud or cls.baud_rate_options.sample_rate % option:
+                continue
+            try:
+                MODULATORS[modulator](cls.baud_rate_options.make_baud_nt(option), codec=fec, tones=tones)
+            except ValueError:
+                # such as too many mfsk tones for the baud rate
+                continue
+            rates.append(Rate(option, fec))
+        return rates
+
+    def _make_modem(self, baud_rate, fec: str):
+        amplitude, demodulator, interleave_depth, framing, tones = self._modem_options
+        self.modulator = self._modulator_class(
+            baud_rate, amplitude, demodulator, PREAMBLE if self._synchronizer_class.uses_preamble else (), fec,
+            interleave_depth, framing, tones
+        )
+        self.synchronizer = self._synchronizer_class.from_modulator(self.modulator, self._receiving, self._audio_in)
+        self.modulator.metrics = self.synchronizer.metrics = self.metrics
+        if not self.loopback:
+            # our own transmission would otherwise set _receiving and hold up the next turnaround
+            self.synchronizer.sending = self._sending
+        if self.compressor:
+            self.modulator.framer.compressor = self.compressor
+        if self._adaptive:
+            self.modulator.link_quality = self.link_quality = LinkQuality(self.modulator.tone_table, baud_rate.baud)
+        self.baud_rate, self.fec = baud_rate, fec
+
+    @property
+    def rate(self) -> Rate:
+        return Rate(self.baud_rate.baud, self.fec)
+
+    def _start_modem(self):
+        self._modem_tasks = [
+            self.loop.create_task(self.synchronizer.synchronize()),
+            self.loop.create_task(self.modulator.modulate(
+                self._data_in, self._audio_out, self._on_frame_queued if self.arq else self._on_queued
+            )),
+            self.loop.create_task(
+                self.modulator.demodulate(self.synchronizer.synchronized_audio_in, self._data_out, self.hub.executor)
+            )
+        ]
+
+    def _stop_modem(self):
+        for task in self._modem_tasks:
+            if not task.done():
+                task.cancel()
+        self._modem_tasks = []
+
+    async def set_rate(self, baud: int, fec: typing.Optional[str] = None):
+        """
+        Switch the modulator and synchronizer to another baud rate and codec without closing the connection. Waits
+        for what was written so far to be played and for the line to go quiet first, the other end has to switch
+        at the same point in the conversation.
+        """
+        baud_rate = self.baud_rate_options.make_baud_nt(baud)
+        fec = fec or self.fec
+        interval = self.blocksize / self.baud_rate.sample_rate
+        async with self._modem_lock:
+            while not self._data_in.empty() or len(self._audio_out):
+                await asyncio.sleep(interval)
+            # let the tail of the output reach a loopback input and the demodulator
+            await asyncio.sleep(2 * interval)
+            await self._receiving.wait_clear()
+            while not self.synchronizer.synchronized_audio_in.empty():
+                await asyncio.sleep(interval)
+            running = bool(self._modem_tasks)
+            self._stop_modem()
+            self._make_modem(baud_rate, fec)
+            if running:
+                self._start_modem()
+
+    def _add_metrics(self):
+        gauges = {
+            'audio_out_samples': lambda: len(self._audio_out),
+            'audio_in_samples': lambda: len(self._audio_in),
+            'audio_in_overruns': lambda: self._audio_in.overruns,
+            'audio_in_wakeups': lambda: self._audio_in.wakeups,
+            'synchronized_frames': lambda: self.synchronizer.synchronized_audio_in.qsize(),
+            'output_underflows': lambda: self.hub.output_underflows,
+            'input_overflows': lambda: self.hub.input_overflows,
+            'output_underruns': lambda: self.hub.output_underruns,
+            'write_buffer_size': self.get_write_buffer_size
+        }
+        if self.arq:
+            arq = self.arq
+            gauges.update({
+                'arq_transmissions': lambda: arq.transmissions,
+                'arq_retransmissions': lambda: arq.retransmissions,
+                'arq_rto': lambda: arq.rtt.rto
+            })
+        for name, read in gauges.items():
+            self.metrics.add_gauge(name, read)
 
     def stop(self):
         self._stop.set()
 
+    def close(self):
+        self.stop()
+
+    def is_closing(self) -> bool:
+        return self._stop.is_set()
+
+    def set_protocol(self, protocol: asyncio.BaseProtocol):
+        self._protocol = protocol
+        if self.connected.is_set():
+            self._start_delivery()
+
+    def get_protocol(self) -> asyncio.BaseProtocol:
+        return self._protocol
+
+    def pause_reading(self):
+        self._reading.clear()
+
+    def resume_reading(self):
+        self._reading.set()
+
+    def is_reading(self) -> bool:
+        return self._reading.is_set()
+
+    def _start_delivery(self):
+        if self._delivery_task is None or self._delivery_task.done():
+            self._delivery_task = self.loop.create_task(self._deliver())
+
+    async def _deliver(self):
+        """
+        Hand everything received so far to the protocol in one data_received call, unless reading is paused
+        """
+        while True:
+            await self._reading.wait()
+            data = bytearray(await self._received.get())
+            while not self._received.empty():
+                data += self._received.get_nowait()
+            await self._reading.wait()
+            self._protocol.data_received(bytes(data))
+
+    def set_write_buffer_limits(self, high: typing.Optional[int] = None, low: typing.Optional[int] = None):
+        if high is None:
+            high = DEFAULT_WRITE_HIGH_WATER if low is None else 4 * low
+        if low is None:
+            low = high // 4
+        if not high >= low >= 0:
+            raise ValueError(f"high ({high}) must be >= low ({low}) must be >= 0")
+        self._high_water, self._low_water = high, low
+
+    def get_write_buffer_limits(self) -> typing.Tuple[int, int]:
+        return self._low_water, self._high_water
+
+    def get_write_buffer_size(self) -> int:
+        """
+        Bytes written that are not on the air yet, or not acknowledged yet in reliable mode
+        """
+        if self.arq:
+            return self.arq.buffered_size
+        played = self._queued_samples - len(self._audio_out)
+        while self._unplayed and self._unplayed[0][0] <= played:
+            self._unplayed.popleft()
+        return self._unmodulated + sum(size for _, size in self._unplayed)
+
+    def _on_queued(self, size: int, samples: int):
+        self._unmodulated -= size
+        self._queued_samples += samples
+        self._unplayed.append((self._queued_samples, size))
+
+    def _on_frame_queued(self, size: int, samples: int):
+        self._queued_frames += 1
+        self._frame_queued.set()
+
+    def _maybe_pause_writing(self):
+        if self._writing_paused or self.get_write_buffer_size() <= self._high_water:
+            return
+        self._writing_paused = True
+        self._protocol.pause_writing()
+        self._resume_writing_task = self.loop.create_task(self._resume_writing())
+
+    async def _resume_writing(self):
+        # the audio callback takes a block at a time, so there is nothing to gain from checking more often
+        interval = self.blocksize / self.baud_rate.sample_rate
+        while self.get_write_buffer_size() > self._low_water:
+            await asyncio.sleep(interval)
+        self._writing_paused = False
+        self._protocol.resume_writing()
+
     def write(self, data: bytes):
-        self._data_in.put_nowait(data)
+        if self.arq:
+            self.arq.write(data)
+        else:
+            self._unmodulated += len(data)
+            self._data_in.put_nowait(data)
+        self._maybe_pause_writing()
 
-    async def read(self, n: int, timeout=None) -> bytes:
-        msg = b''
-        start = time.perf_counter()
+    async def _transmit(self, frames: typing.List[bytes]):
+        """
+        Send a burst of arq frames once the other side has stopped talking. _sending is held while on the air, the
+        synchronizer does not listen to the input meanwhile.
+        """
+        async with self._modem_lock:
+            await self._receiving.wait_clear()
+            self._sending.set()
+            try:
+                queued = self._queued_frames + len(frames)
+                for frame in frames:
+                    self._data_in.put_nowait(frame)
+                while self._queued_frames < queued:
+                    self._frame_queued.clear()
+                    await self._frame_queued.wait()
+                # the burst is on the air once the output has played out the samples modulate queued
+                await asyncio.sleep(len(self._audio_out) / self.baud_rate.sample_rate)
+            finally:
+                self._sending.clear()
 
-        for _ in range(n):
-            if timeout:
-                byte = await asyncio.wait_for(self._data_out.get(), timeout - (time.perf_counter() - start))
-            else:
-                byte = await self._data_out.get()
-            msg += byte
-        return msg
+    @property
+    def _received(self) -> asyncio.Queue:
+        return self.arq.received if self.arq else self._data_out
+
+    async def read(self, n: int, timeout=None) -> bytes:
+        """
+        Read exactly n bytes, only while the default protocol is in place. See self.reader for the rest of the
+        asyncio.StreamReader api.
+        """
+        return await asyncio.wait_for(self.reader.readexactly(n), timeout)
 
     async def _connect_audio(self):
-        async with audio_pipe(
-                self.synchronizer.unsynchronized_audio_in, self._audio_out, self.baud_rate.sample_rate,
-                self.baud_rate.frame_size, loopback=self.loopback):
-            await self._stop.wait()
+        self._port = self.hub.attach(self.channel, self._audio_in, self._audio_out)
+        try:
+            async with self.hub.open():
+                await self._stop.wait()
+        finally:
+            self.hub.detach(self._port)
+            self._port = None
 
     async def _connect(self):
         if self._stop.is_set():
             self._stop.clear()
 
         io_task = self.loop.create_task(self._connect_audio())
-        sync_task = self.loop.create_task(self.synchronizer.synchronize())
-        modulate_task = self.loop.create_task(self.modulator.modulate(self._data_in, self._audio_out))
-        demodulate_task = self.loop.create_task(
-            self.modulator.demodulate(self.synchronizer.synchronized_audio_in, self._data_out)
-        )
+        self._start_modem()
+        arq_task = self.loop.create_task(self.arq.run(self._data_out)) if self.arq else None
+        rate_task = self.loop.create_task(self.rate_controller.run()) if self.rate_controller else None
 
         self.connected.set()
+        self._protocol.connection_made(self)
+        self._start_delivery()
         try:
             await self._stop.wait()
         finally:
@@ -140,12 +387,14 @@ class AFSKTransport(asyncio.Transport):
             await asyncio.sleep(0)
             if not io_task.done():
                 io_task.cancel()
-            if not sync_task.done():
-                sync_task.cancel()
-            if not modulate_task.done():
-                modulate_task.cancel()
-            if not demodulate_task.done():
-                demodulate_task.cancel()
+            self._stop_modem()
+            for task in (arq_task, rate_task):
+                if task and not task.done():
+                    task.cancel()
+            for task in (self._delivery_task, self._resume_writing_task):
+                if task and not task.done():
+                    task.cancel()
+            self._protocol.connection_lost(None)
 
     async def connect(self):
         self.loop.create_task(self._connect())
@@ -157,3 +406,32 @@ class AFSKTransport(asyncio.Transport):
             return await self._stop.wait()
         finally:
             self.stop()
+
+
+async def create_afsk_connection(protocol_factory: typing.Callable[[], asyncio.Protocol], *args,
+                                 **kwargs) -> typing.Tuple[AFSKTransport, asyncio.Protocol]:
+    """
+    Like loop.create_connection, connects a protocol made by protocol_factory to a new AFSKTransport
+
+    :param args: passed to AFSKTransport
+    :param kwargs: passed to AFSKTransport
+    """
+    transport = AFSKTransport(*args, **kwargs)
+    protocol = protocol_factory()
+    transport.set_protocol(protocol)
+    await transport.connect()
+    return transport, protocol
+
+
+async def open_afsk_connection(*args, limit: int = DEFAULT_READ_LIMIT,
+                               **kwargs) -> typing.Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+    """
+    Like asyncio.open_connection, returns a (reader, writer) pair for a new AFSKTransport
+
+    :param args: passed to AFSKTransport
+    :param kwargs: passed to AFSKTransport
+    """
+    reader = asyncio.StreamReader(limit)
+    protocol = asyncio.StreamReaderProtocol(reader)
+    transport, _ = await create_afsk_connection(lambda: protocol, *args, **kwargs)
+    return reader, asyncio.StreamWriter(transport, protocol, reader, asyncio.get_event_loop())
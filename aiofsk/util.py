@@ -1,4 +1,6 @@
+import typing
 import asyncio
+import numpy as np
 
 
 class DoubleEvent:
@@ -23,3 +25,139 @@ class DoubleEvent:
 
     def wait_clear(self):
         return self._inverse.wait()
+
+
+class RingBuffer:
+    """
+    Preallocated single producer / single consumer ring buffer of samples
+
+    The producer only advances the write count and the consumer only advances the read count, so one thread may
+    write while another reads without a lock.
+    """
+
+    def __init__(self, capacity: int, dtype='float32'):
+        self._buffer = np.zeros(capacity, dtype=dtype)
+        self._capacity = capacity
+        self._written = 0
+        self._read = 0
+
+    def __len__(self):
+        return self._written - self._read
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    @property
+    def free(self):
+        return self._capacity - len(self)
+
+    def _spans(self, start: int, count: int):
+        start %= self._capacity
+        first = min(count, self._capacity - start)
+        return slice(start, start + first), slice(0, count - first)
+
+    def write(self, samples: np.ndarray) -> int:
+        """
+        Copy as many samples as fit into the buffer, returns the number written
+        """
+        samples = samples.reshape(-1)
+        count = min(len(samples), self.free)
+        first, second = self._spans(self._written, count)
+        head = first.stop - first.start
+        self._buffer[first] = samples[:head]
+        self._buffer[second] = samples[head:count]
+        self._written += count
+        return count
+
+    def peek(self, count: int, out: typing.Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Copy up to count samples from the front of the buffer without consuming them
+        """
+        count = min(count, len(self))
+        if out is None:
+            out = np.empty(count, dtype=self._buffer.dtype)
+        first, second = self._spans(self._read, count)
+        head = first.stop - first.start
+        out[:head] = self._buffer[first]
+        out[head:count] = self._buffer[second]
+        return out[:count]
+
+    def read(self, count: int, out: typing.Optional[np.ndarray] = None) -> np.ndarray:
+        samples = self.peek(count, out)
+        self._read += len(samples)
+        return samples
+
+    def discard(self, count: int) -> int:
+        count = min(count, len(self))
+        self._read += count
+        return count
+
+
+class SampleQueue:
+    """
+    Ring of input samples written by the audio thread and read as whole spans by a coroutine
+
+    The audio thread only wakes the event loop once at least notify_samples have arrived since the last wakeup and
+    the reader has not been woken already, so the loop wakes at most once per notify_samples instead of once per
+    device block. notify_samples bounds the added latency. While active is set, such as while a transmission is
+    being received, every write wakes the reader so the end of the transmission is not held back.
+    """
+
+    def __init__(self, capacity: int, notify_samples: int = 0, dtype='float32',
+                 active: typing.Optional[DoubleEvent] = None):
+        self._ring = RingBuffer(capacity, dtype)
+        self.notify_samples = notify_samples
+        self._active = active
+        self._loop = asyncio.get_event_loop()
+        self._ready = asyncio.Event()
+        self._pending = 0  # samples written since the last wakeup, only touched by the audio thread
+        self._notified = False
+        self.wakeups = 0
+        self.overruns = 0  # samples dropped because the reader fell a whole ring behind
+
+    def __len__(self):
+        return len(self._ring)
+
+    def empty(self) -> bool:
+        return not len(self._ring)
+
+    def _write(self, samples: np.ndarray) -> int:
+        samples = samples.reshape(-1)
+        written = self._ring.write(samples)
+        self.overruns += len(samples) - written
+        return written
+
+    def put_threadsafe(self, samples: np.ndarray):
+        """
+        Copy samples in from the audio thread
+        """
+        self._pending += self._write(samples)
+        if self._notified or self._pending < self.notify_samples and not (self._active and self._active.is_set()):
+            return
+        self._pending = 0
+        self._notified = True
+        self.wakeups += 1
+        try:
+            self._loop.call_soon_threadsafe(self._ready.set)
+        except RuntimeError:
+            # raised if the loop stopped
+            pass
+
+    def put_nowait(self, samples: np.ndarray):
+        """
+        Copy samples in from the event loop, waking the reader right away
+        """
+        self._write(samples)
+        self._ready.set()
+
+    async def get(self) -> np.ndarray:
+        """
+        :return: every sample available, waiting for the next wakeup if there are none
+        """
+        while True:
+            await self._ready.wait()
+            self._ready.clear()
+            self._notified = False
+            if len(self._ring):
+                return self._ring.read(len(self._ring))
@@ -21,6 +21,7 @@ setup(
     entry_points={'console_scripts': console_scripts},
     install_requires=[
         'sounddevice',
-        'numpy'
+        'numpy',
+        'scipy'
     ]
 )
@@ -58,6 +58,9 @@ class AsyncioTestCase(unittest.TestCase):
 
     maxDiff = None
 
+    def new_event_loop(self) -> asyncio.AbstractEventLoop:
+        return asyncio.new_event_loop()
+
     async def asyncSetUp(self):  # pylint: disable=C0103
         pass
 
@@ -92,7 +95,7 @@ class AsyncioTestCase(unittest.TestCase):
         expecting_failure = expecting_failure_class or expecting_failure_method
         outcome = _Outcome(result)
 
-        self.loop = asyncio.new_event_loop()  # pylint: disable=W0201
+        self.loop = self.new_event_loop()  # pylint: disable=W0201
         asyncio.set_event_loop(self.loop)
         self.loop.set_debug(True)
         self.loop.slow_callback_duration = self.LOOP_SLOW_CALLBACK_DURATION
@@ -161,6 +164,49 @@ class AsyncioTestCase(unittest.TestCase):
                     self.loop.run_until_complete(maybe_coroutine)
 
 
+class VirtualClockEventLoop(asyncio.SelectorEventLoop):  # type: ignore
+    """
+    Event loop on a virtual clock that starts at zero and only moves when the loop would otherwise sit idle, then
+    it jumps straight to the next timer. Sleeps and timeouts keep their meaning relative to each other, which with
+    the loopback audio of the hub is the time in samples played, but cost no wall time.
+
+    The clock holds still while anything runs in an executor, so work in threads takes no virtual time either.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._virtual_time = 0.0
+        self._executor_jobs = 0
+
+    def time(self) -> float:
+        return self._virtual_time
+
+    def _executor_job_done(self, _):
+        self._executor_jobs -= 1
+
+    def run_in_executor(self, executor, func, *args):
+        future = super().run_in_executor(executor, func, *args)
+        self._executor_jobs += 1
+        future.add_done_callback(self._executor_job_done)
+        return future
+
+    def _run_once(self):
+        if not self._ready and not self._executor_jobs:
+            pending = [handle.when() for handle in self._scheduled if not handle.cancelled()]
+            if pending:
+                self._virtual_time = max(self._virtual_time, min(pending))
+        super()._run_once()
+
+
+class VirtualClockTestCase(AsyncioTestCase):
+    """
+    Runs on a VirtualClockEventLoop, loopback transports run as fast as they can with the timing of real time
+    """
+
+    def new_event_loop(self) -> asyncio.AbstractEventLoop:
+        return VirtualClockEventLoop()
+
+
 class AdvanceTimeTestCase(AsyncioTestCase):
 
     async def asyncSetUp(self):
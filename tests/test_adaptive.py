@@ -0,0 +1,123 @@
+import types
+import asyncio
+import unittest
+import numpy as np
+from aiofsk.adaptive import estimate_snr, LinkQuality, Rate, RateController
+from aiofsk.baud import DEFAULT_BAUD_OPTIONS
+from aiofsk.channel import Channel, ChannelConfig
+from aiofsk.modulation import get_tone_table, TONES
+from aiofsk.hub import AudioHub
+from aiofsk.transport import AFSKTransport
+from tests import VirtualClockTestCase
+
+RATES = [Rate(300, 'hamming'), Rate(600, 'hamming'), Rate(1200, 'hamming'), Rate(2400, 'hamming')]
+
+
+class CrossedHub(AudioHub):
+    """
+    Loopback hub with its two channels cross wired, what one station plays the other hears
+    """
+
+    def _record(self, indata):
+        super()._record(indata[:, ::-1])
+
+
+class TestLinkQuality(unittest.TestCase):
+    def _frames(self, baud, snr, count=200):
+        baud_rate = DEFAULT_BAUD_OPTIONS.make_baud_nt(baud)
+        tone_table = get_tone_table(baud_rate, TONES, 0.5)
+        symbols = np.random.default_rng(0).integers(0, 2, count)
+        waveform = tone_table.frames[symbols].reshape(-1)
+        return Channel(ChannelConfig(snr=snr, signal_power=0.125)).process(waveform), tone_table
+
+    def test_estimate_snr(self):
+        for baud in (300, 2400):
+            for snr in (0.0, 10.0):
+                frames, tone_table = self._frames(baud, snr)
+                signal, noise = estimate_snr(frames, tone_table)
+                # the snr per symbol gains the frame size over the snr per sample
+                expected = snr + 10 * np.log10(DEFAULT_BAUD_OPTIONS.sample_rate // baud)
+                self.assertAlmostEqual(expected, 10 * np.log10(signal / noise), delta=0.5)
+
+    def test_link_quality(self):
+        frames, tone_table = self._frames(1200, 10.0)
+        quality = LinkQuality(tone_table, 1200)
+        self.assertIsNone(quality.snr)
+        quality.observe(frames, 200, 2)
+        self.assertAlmostEqual(10 + 10 * np.log10(40), quality.snr, delta=0.5)
+        self.assertAlmostEqual(0.01, quality.correction_rate)
+        quality.observe(frames, 200, 0)
+        self.assertAlmostEqual(0.0075, quality.correction_rate)
+
+    def test_choose(self):
+        transport = types.SimpleNamespace(rate=RATES[1])
+        controller = RateController(transport, RATES)
+        # measured at 600 baud, 1200 baud would have 3 dB less and 2400 baud 6 dB less
+        self.assertEqual(RATES[3], controller.choose(25.0, 0.0))
+        self.assertEqual(RATES[2], controller.choose(22.0, 0.0))
+        # stepping up needs the margin, staying does not
+        self.assertEqual(RATES[1], controller.choose(17.0, 0.0))
+        self.assertEqual(RATES[0], controller.choose(13.0, 0.0))
+        # too many corrections steps down even with snr to spare
+        self.assertEqual(RATES[0], controller.choose(25.0, 0.05))
+
+
+class TestAdaptiveTransport(VirtualClockTestCase):
+    async def test_set_rate(self):
+        transport = AFSKTransport(300, loopback=True, reliable=True)
+        await transport.connect()
+        self.addCleanup(transport.stop)
+        transport.write(b'hello jake')
+        self.assertEqual(b'hello jake', await transport.read(10, timeout=10))
+        await transport.set_rate(1200, 'reed-solomon')
+        self.assertEqual(Rate(1200, 'reed-solomon'), transport.rate)
+        self.assertEqual(40, transport.modulator.frame_size)
+        transport.write(b'hello again')
+        self.assertEqual(b'hello again', await transport.read(11, timeout=10))
+
+    async def test_default_rates(self):
+        transport = AFSKTransport(600, loopback=True, adaptive=True, modulator='mfsk16')
+        # 1800 baud is not a whole number of samples, and 16 tones do not fit in the band at 2400 baud
+        self.assertListEqual([600, 1200], [rate.baud for rate in transport.rate_controller.rates])
+        self.assertIsNotNone(transport.arq)
+        self.assertIs(transport.link_quality, transport.modulator.link_quality)
+        # only adaptive transports pay for measuring the link
+        self.assertIsNone(AFSKTransport(600, loopback=True, reliable=True).modulator.link_quality)
+
+    async def _wait_switched(self, transport, rate, timeout=60):
+        async def switched():
+            while transport.rate != rate or transport.rate_controller.switches < 1:
+                await asyncio.sleep(1)
+        await asyncio.wait_for(switched(), timeout)
+
+    async def test_steps_up(self):
+        transport = AFSKTransport(300, loopback=True, adaptive=True)
+        await transport.connect()
+        self.addCleanup(transport.stop)
+        self.assertEqual(RATES[0], transport.rate)
+        await self._wait_switched(transport, RATES[3])
+        msg = bytes(range(256)) * 4
+        transport.write(msg)
+        self.assertEqual(msg, await transport.read(len(msg), timeout=30))
+        self.assertGreater(transport.link_quality.snr, transport.rate_controller.required_snr)
+        self.assertEqual(RATES[3], transport.rate)
+
+    async def test_two_stations(self):
+        hub = CrossedHub(channels=2, loopback=True)
+        stations = [
+            AFSKTransport(300, adaptive=True, hub=hub, channel=channel, station=station)
+            for channel, station in ((0, 1), (1, 2))
+        ]
+        for transport in stations:
+            await transport.connect()
+            self.addCleanup(transport.stop)
+        # the lower station proposes, the other acknowledges, both end up at the fastest rate
+        for transport in stations:
+            await self._wait_switched(transport, RATES[3])
+        self.assertTrue(stations[0].rate_controller.deciding)
+        self.assertFalse(stations[1].rate_controller.deciding)
+        for sender, receiver in (stations, stations[::-1]):
+            msg = bytes(range(256)) * 2
+            sender.write(msg)
+            self.assertEqual(msg, await receiver.read(len(msg), timeout=30))
+        self.assertEqual([1, 1], [transport.rate_controller.switches for transport in stations])
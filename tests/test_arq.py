@@ -0,0 +1,95 @@
+import random
+import asyncio
+from aiofsk.arq import SelectiveRepeatARQ, RTTEstimator
+from tests import AsyncioTestCase
+
+
+class LossyLink:
+    """
+    Half duplex in memory link, a burst takes airtime per frame to send and frames are lost at random
+    """
+
+    def __init__(self, loss: float, airtime: float = 0.002, seed: int = 0):
+        self._loss = loss
+        self._airtime = airtime
+        self._random = random.Random(seed)
+        self._busy = asyncio.Lock()
+        self.queues = (asyncio.Queue(), asyncio.Queue())
+
+    def transmitter(self, side: int):
+        async def transmit(frames):
+            async with self._busy:
+                await asyncio.sleep(self._airtime * len(frames))
+                for frame in frames:
+                    if self._random.random() >= self._loss:
+                        self.queues[1 - side].put_nowait(frame)
+        return transmit
+
+
+class TestSelectiveRepeatARQ(AsyncioTestCase):
+    async def _test_transfer(self, loss, segments=200, window=32):
+        link = LossyLink(loss)
+        first = SelectiveRepeatARQ(link.transmitter(0), station=1, window=window, segment_size=16)
+        second = SelectiveRepeatARQ(link.transmitter(1), station=2, window=window, segment_size=16)
+        tasks = [asyncio.create_task(first.run(link.queues[0])), asyncio.create_task(second.run(link.queues[1]))]
+        self.addCleanup(lambda: [task.cancel() for task in tasks])
+        msg = bytes(random.Random(1).getrandbits(8) for _ in range(16 * segments))
+        first.write(msg)
+        await asyncio.wait_for(first.wait_acknowledged(), 10)
+        received = b''
+        while not second.received.empty():
+            received += second.received.get_nowait()
+        self.assertEqual(msg, received)
+        return first
+
+    async def test_lossless(self):
+        sender = await self._test_transfer(0.0)
+        self.assertEqual(200, sender.transmissions)
+        self.assertEqual(0, sender.retransmissions)
+
+    async def test_lossy(self):
+        sender = await self._test_transfer(0.2)
+        # selective repeat only resends what was lost, go back n would resend most of the window
+        self.assertLess(sender.retransmissions, 0.5 * 200)
+
+    async def test_sequence_wrap_small_window(self):
+        await self._test_transfer(0.1, segments=300, window=8)
+
+    async def test_ignore_own_frames(self):
+        sent = []
+
+        async def transmit(frames):
+            sent.extend(frames)
+
+        arq = SelectiveRepeatARQ(transmit, station=7)
+        arq.receive(b'\x00\x07\x00echo')
+        self.assertTrue(arq.received.empty())
+        arq.receive(b'\x00\x08\x00hello')
+        self.assertEqual(b'hello', arq.received.get_nowait())
+
+    async def test_control_frames(self):
+        link = LossyLink(0.0)
+        controls = []
+        first = SelectiveRepeatARQ(link.transmitter(0), station=1, segment_size=16)
+        second = SelectiveRepeatARQ(link.transmitter(1), station=2, segment_size=16,
+                                    on_control=lambda station, payload: controls.append((station, payload)))
+        tasks = [asyncio.create_task(first.run(link.queues[0])), asyncio.create_task(second.run(link.queues[1]))]
+        self.addCleanup(lambda: [task.cancel() for task in tasks])
+        first.write(b'data' * 8)
+        await asyncio.wait_for(first.send_control(b'rate'), 1)
+        await asyncio.wait_for(first.wait_acknowledged(), 1)
+        self.assertListEqual([(1, b'rate')], controls)
+        # control frames are neither data nor counted as transmissions
+        self.assertEqual(2, first.transmissions)
+        self.assertEqual(b'data' * 4, second.received.get_nowait())
+
+    def test_rtt_estimator(self):
+        rtt = RTTEstimator(initial_rto=3.0, min_rto=0.01)
+        rtt.update(0.1)
+        self.assertAlmostEqual(0.3, rtt.rto)
+        for _ in range(50):
+            rtt.update(0.1)
+        self.assertAlmostEqual(0.1, rtt.srtt)
+        self.assertLess(rtt.rto, 0.15)
+        rtt.backoff()
+        self.assertLess(rtt.rto, 0.3)
@@ -0,0 +1,81 @@
+import os
+import json
+import tempfile
+import unittest
+import numpy as np
+from aiofsk.channel import Channel, ChannelConfig
+from aiofsk.bench import run_benchmarks
+from aiofsk.__main__ import main
+from tests import AsyncioTestCase
+
+
+class TestChannel(unittest.TestCase):
+    def _tone(self, frequency, seconds=1.0):
+        return np.cos(2 * np.pi * frequency * np.arange(int(48000 * seconds)) / 48000)
+
+    def test_blocks_match_one_pass(self):
+        config = ChannelConfig(snr=10.0, clock_offset=500.0, jitter=1e-5, drop_rate=0.1, band=(300.0, 3400.0), seed=7)
+        samples = self._tone(1200)
+        whole = Channel(config).process(samples)
+        channel = Channel(config)
+        blocks = np.concatenate([channel.process(samples[i:i + 300]) for i in range(0, len(samples), 300)])
+        self.assertEqual(len(whole), len(blocks))
+        self.assertTrue(np.allclose(whole, blocks, atol=1e-4))
+        self.assertGreater(channel.dropped_blocks, 0)
+        self.assertNotEqual(whole.tolist(), Channel(config._replace(seed=8)).process(samples).tolist())
+
+    def test_noise(self):
+        received = Channel(ChannelConfig(snr=10.0, signal_power=0.5)).process(np.zeros(48000))
+        self.assertAlmostEqual(0.05, float(np.mean(received.astype(np.float64) ** 2)), delta=0.002)
+
+    def test_clock_offset(self):
+        received = Channel(ChannelConfig(clock_offset=1000.0)).process(self._tone(1000))
+        # 1000 ppm fast sampling, the tone sounds 0.1% lower
+        self.assertAlmostEqual(48048, len(received), delta=2)
+        spectrum = np.abs(np.fft.rfft(received))
+        self.assertAlmostEqual(1000 / 1.001, np.fft.rfftfreq(len(received), 1 / 48000)[spectrum.argmax()], delta=1)
+
+    def test_drops(self):
+        channel = Channel(ChannelConfig(drop_rate=0.5, blocksize=100))
+        received = channel.process(np.arange(10000))
+        self.assertEqual(10000 - 100 * channel.dropped_blocks, len(received))
+        self.assertTrue(20 < channel.dropped_blocks < 80)
+        # whole blocks go missing
+        self.assertTrue(np.all(received.reshape(-1, 100)[:, 0] % 100 == 0))
+
+    def test_band_limit(self):
+        channel = ChannelConfig(band=(300.0, 3400.0))
+        inside = Channel(channel).process(self._tone(1200))[4800:]
+        outside = Channel(channel).process(self._tone(9600))[4800:]
+        self.assertGreater(np.abs(inside).max(), 0.9)
+        self.assertLess(np.abs(outside).max(), 0.01)
+
+
+class TestBenchmark(AsyncioTestCase):
+    def test_report(self):
+        report = run_benchmarks((1200, 1800), ('standard', 'mfsk16'), snrs=(-20.0, 10.0), speed_size=16,
+                                ber_size=16, packets=2, packet_size=16)
+        results = {(result['modulator'], result['baud']): result for result in report['results']}
+        self.assertEqual(4, len(results))
+        self.assertIn('error', results['standard', 1800])
+        standard = results['standard', 1200]
+        self.assertGreater(standard['encode_samples_per_second'], 48000)
+        self.assertGreater(standard['decode_samples_per_second'], 48000)
+        self.assertListEqual([-20.0, 10.0], [point['snr'] for point in standard['ber']])
+        self.assertGreater(standard['ber'][0]['channel_ber'], 0.1)
+        self.assertEqual(0.0, standard['ber'][1]['decoded_ber'])
+        self.assertEqual(2, standard['frames_delivered'])
+        self.assertGreater(standard['goodput'], 0)
+        # out of the band of the goodput channel
+        self.assertEqual(0, results['mfsk16', 1200]['frames_delivered'])
+        self.assertEqual(0.0, results['mfsk16', 1200]['ber'][1]['decoded_ber'])
+
+    def test_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'bench.json')
+            main(['bench', '-o', path, '--baud', '2400', '--modulator', 'cpfsk', '--snr', '20'])
+            with open(path) as report:
+                report = json.load(report)
+        self.assertListEqual([300.0, 3400.0], report['channel']['band'])
+        self.assertEqual([[2400, 'cpfsk']], [[result['baud'], result['modulator']] for result in report['results']])
+        self.assertEqual(0.0, report['results'][0]['ber'][0]['channel_ber'])
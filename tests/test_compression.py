@@ -0,0 +1,79 @@
+import json
+import random
+import unittest
+from aiofsk.compression import ZlibCompressor, LZMACompressor, train_dictionary, STORED, COMPRESSED
+from aiofsk.ecc import HammingCodec
+from aiofsk.framing import HDLCFramer
+from aiofsk.transport import AFSKTransport
+from tests import VirtualClockTestCase
+
+TEXT = b'hello jake, the band is open and the signal is good. how is the weather over there?'
+
+
+def _telemetry(count, seed=0):
+    rng = random.Random(seed)
+    return [json.dumps({
+        'station': 'KD2ABC', 'sequence': i, 'temperature': round(rng.uniform(10, 30), 1),
+        'battery': round(rng.uniform(3.5, 4.2), 2), 'status': rng.choice(('ok', 'low', 'charging'))
+    }).encode() for i in range(count)]
+
+
+class TestCompression(unittest.TestCase):
+    def test_round_trip(self):
+        for compressor in (ZlibCompressor(), ZlibCompressor(b''), LZMACompressor()):
+            for data in (b'', TEXT, TEXT * 10, bytes(range(256))):
+                compressed = compressor.compress(data)
+                self.assertLessEqual(len(compressed), len(data) + 1)
+                self.assertEqual(data, compressor.decompress(compressed, 4096))
+
+    def test_incompressible_stored(self):
+        data = random.Random(0).getrandbits(8 * 64).to_bytes(64, 'little')
+        self.assertEqual(bytes((STORED,)) + data, ZlibCompressor().compress(data))
+        self.assertEqual(COMPRESSED, ZlibCompressor().compress(TEXT)[0])
+
+    def test_preset_dictionary(self):
+        # the default dictionary helps short text, which deflate on its own barely shrinks
+        self.assertLess(len(ZlibCompressor().compress(TEXT)), len(ZlibCompressor(b'').compress(TEXT)) - 10)
+        with self.assertRaises(ValueError):
+            LZMACompressor(b'dictionary')
+
+    def test_bad_data(self):
+        compressor = ZlibCompressor()
+        compressed = compressor.compress(TEXT * 10)
+        self.assertIsNone(compressor.decompress(compressed, 100))  # would decompress past the maximum
+        self.assertIsNone(compressor.decompress(compressed[:-4], 4096))
+        self.assertIsNone(compressor.decompress(b'\x07' + TEXT, 4096))
+        # a different dictionary on the other end
+        self.assertNotEqual(TEXT, ZlibCompressor(b'other words entirely').decompress(compressed, 4096))
+
+    def test_train_dictionary(self):
+        records = _telemetry(200)
+        dictionary = train_dictionary(records[:100], 512)
+        self.assertLessEqual(len(dictionary), 512)
+        raw = sum(map(len, records[100:]))
+        default = sum(len(ZlibCompressor().compress(record)) for record in records[100:])
+        trained = sum(len(ZlibCompressor(dictionary).compress(record)) for record in records[100:])
+        self.assertLess(trained, raw / 2)
+        self.assertLess(trained, default)
+
+    def test_framer(self):
+        framer = HDLCFramer(HammingCodec())
+        plain = framer.frame(TEXT)
+        framer.compressor = ZlibCompressor()
+        compressed = framer.frame(TEXT)
+        self.assertLess(len(compressed), len(plain))
+        result, _ = framer.deframe_stream(compressed)
+        self.assertListEqual([TEXT], result.frames)
+
+
+class TestCompressedTransport(VirtualClockTestCase):
+    async def test_compressed_transfer(self):
+        records = _telemetry(20)
+        transport = AFSKTransport(1200, loopback=True, reliable=True, compression='zlib',
+                                  compression_dictionary=train_dictionary(_telemetry(100, seed=1)))
+        await transport.connect()
+        self.addCleanup(transport.stop)
+        msg = b'\n'.join(records)
+        transport.write(msg)
+        self.assertEqual(msg, await transport.read(len(msg), timeout=30))
+        self.assertIs(transport.compressor, transport.modulator.framer.compressor)
@@ -1,5 +1,7 @@
 import unittest
-from aiofsk.ecc import HAMMING_8_4_CODE
+import numpy as np
+from aiofsk.ecc import HAMMING_8_4_CODE, hamming_correct, Codec, HammingCodec, ReedSolomonCodec, ConvolutionalCodec
+from aiofsk.ecc import BlockInterleaver, InterleavedCodec
 
 
 class TestHammingECC(unittest.TestCase):
@@ -25,3 +27,114 @@ class TestHammingECC(unittest.TestCase):
         self._test_error_correction(0b01100000, -1)
         self._test_error_correction(0b00000110, -1)
         self._test_error_correction(0b01111110, -1)
+
+    def test_decode_table(self):
+        expected = [hamming_correct(HAMMING_8_4_CODE.table, encoded) for encoded in range(256)]
+        self.assertListEqual(expected, [HAMMING_8_4_CODE.decode(encoded) for encoded in range(256)])
+        self.assertListEqual(expected, HAMMING_8_4_CODE.decode_many(bytes(range(256))).tolist())
+        self.assertListEqual(expected, HAMMING_8_4_CODE.decode_many(np.arange(256, dtype=np.uint8)).tolist())
+
+    def test_encode_many(self):
+        codes = HAMMING_8_4_CODE.encode_many(bytes(range(16)))
+        self.assertListEqual(list(HAMMING_8_4_CODE.table), codes.tolist())
+        self.assertListEqual(list(range(16)), HAMMING_8_4_CODE.decode_many(codes).tolist())
+
+
+class TestCodecs(unittest.TestCase):
+    def _test_codec(self, codec: Codec, errors_per_block: int, burst: int = 1, size: int = 600):
+        rng = np.random.default_rng(size)
+        data = rng.integers(0, 256, size, dtype=np.uint8).tobytes()
+        encoded = codec.encode(data)
+        self.assertEqual((data, 0, 0), codec.decode_stream(encoded)[0])
+
+        # corrupt each block body, walking the stream the same way the decoder does
+        corrupted, offset, expected_corrections = encoded.copy(), 0, 0
+        while offset < len(encoded):
+            size = codec.block_bits(encoded[offset:offset + codec.header_bits])
+            body = np.arange(offset + codec.header_bits, offset + size)
+            if not len(body):
+                body = np.arange(offset, offset + size)
+            for start in rng.choice(len(body) // burst, errors_per_block, replace=False) * burst:
+                corrupted[body[start:start + burst]] ^= 1
+                expected_corrections += 1
+            offset += size
+        result, consumed = codec.decode_stream(np.concatenate((corrupted, encoded[:5])))
+        self.assertEqual(len(encoded), consumed)
+        self.assertEqual(data, result.data)
+        self.assertEqual(0, result.uncorrectable)
+        return result, expected_corrections
+
+    def test_hamming(self):
+        result, expected_corrections = self._test_codec(HammingCodec(), 1, size=64)
+        self.assertEqual(expected_corrections, result.corrected)
+
+    def test_reed_solomon_byte_bursts(self):
+        # an 8 bit burst aligned to a byte is one symbol error
+        result, expected_corrections = self._test_codec(ReedSolomonCodec(16), 8, burst=8)
+        self.assertEqual(expected_corrections, result.corrected)
+
+    def test_reed_solomon_too_many_errors(self):
+        codec = ReedSolomonCodec(4)
+        encoded = codec.encode(b'derp derp derp')
+        encoded[16:16 + 3 * 8:8] ^= 1
+        result, consumed = codec.decode_stream(encoded)
+        self.assertEqual(len(encoded), consumed)
+        self.assertEqual((b'', 0, 1), result)
+
+    def test_convolutional(self):
+        result, expected_corrections = self._test_codec(ConvolutionalCodec(), 12, size=300)
+        self.assertEqual(expected_corrections, result.corrected)
+
+    def test_code_rates(self):
+        data = bytes(200)
+        self.assertEqual(len(data) * 16, len(HammingCodec().encode(data)))
+        self.assertEqual(16 + (200 + 16) * 8, len(ReedSolomonCodec(16).encode(data)))
+        self.assertEqual(16 + (200 * 8 + 6) * 2, len(ConvolutionalCodec().encode(data)))
+
+    def _test_burst(self, codec: Codec, burst: int, bursts: int):
+        data = np.random.default_rng(burst).integers(0, 256, 120, dtype=np.uint8).tobytes()
+        encoded = codec.encode(data)
+        for start in np.linspace(codec.header_bits, len(encoded) - burst, bursts).astype(int):
+            encoded[start:start + burst] ^= 1
+        result, consumed = codec.decode_stream(encoded)
+        self.assertEqual(len(encoded), consumed)
+        return result.data == data
+
+    def test_interleaver_round_trip(self):
+        interleaver = BlockInterleaver(3)
+        bits = np.arange(20)
+        self.assertListEqual([0, 7, 14, 1, 8, 15, 2, 9, 16], interleaver.interleave(bits)[:9].tolist())
+        self.assertListEqual(bits.tolist(), interleaver.deinterleave(interleaver.interleave(bits)).tolist())
+        blocks = np.arange(32).reshape(2, 16)
+        self.assertListEqual(blocks.tolist(), interleaver.deinterleave(interleaver.interleave(blocks)).tolist())
+
+    def test_interleaved_hamming_bursts(self):
+        # a two bit burst inside a codeword is not correctable unless the codewords are interleaved
+        self.assertFalse(self._test_burst(HammingCodec(), 2, 40))
+        self.assertTrue(self._test_burst(InterleavedCodec(HammingCodec(), BlockInterleaver(2)), 2, 40))
+
+    def test_interleaved_hamming_depths(self):
+        for depth in (2, 3, 4, 8, 16):
+            codec = InterleavedCodec(HammingCodec(), BlockInterleaver(depth))
+            # a burst at a time in any one group of depth blocks
+            bursts = 120 * 16 // codec.fixed_block_bits // 2
+            self.assertTrue(self._test_burst(codec, depth, bursts), depth)
+            if depth > 2:
+                self.assertFalse(self._test_burst(InterleavedCodec(HammingCodec(), BlockInterleaver(2)), depth, bursts))
+
+    def test_interleaved_hamming_padding(self):
+        codec = InterleavedCodec(HammingCodec(), BlockInterleaver(4))
+        for data in (b'a', b'hello', bytes(range(8))):
+            encoded = codec.encode(data)
+            self.assertEqual(0, len(encoded) % codec.fixed_block_bits)
+            result, consumed = codec.decode_stream(encoded)
+            self.assertEqual((data, 0, 0), result)
+            self.assertEqual(len(encoded), consumed)
+        # a group is only decoded once all of it has arrived
+        encoded = codec.encode(b'hello jake')
+        result, consumed = codec.decode_stream(encoded[:100])
+        self.assertEqual((b'hell', 64), (result.data, consumed))
+
+    def test_interleaved_convolutional_bursts(self):
+        self.assertFalse(self._test_burst(ConvolutionalCodec(), 12, 8))
+        self.assertTrue(self._test_burst(InterleavedCodec(ConvolutionalCodec(), BlockInterleaver(32)), 12, 8))
@@ -0,0 +1,53 @@
+import unittest
+import numpy as np
+from aiofsk.ecc import HammingCodec, ReedSolomonCodec, ConvolutionalCodec
+from aiofsk.framing import crc16, stuff_bits, destuff_bits, find_flags, HDLCFramer, FLAG
+
+
+class TestFraming(unittest.TestCase):
+    def test_crc16(self):
+        self.assertEqual(0x906e, crc16(b'123456789'))
+
+    def test_bit_stuffing(self):
+        rng = np.random.default_rng(0)
+        for bits in (np.ones(64, dtype=np.uint8), rng.integers(0, 2, 4096).astype(np.uint8)):
+            stuffed = stuff_bits(bits)
+            self.assertEqual(0, len(find_flags(stuffed)))
+            self.assertListEqual(bits.tolist(), destuff_bits(stuffed).tolist())
+        self.assertEqual(12, len(stuff_bits(np.ones(10, dtype=np.uint8))))
+        self.assertIsNone(destuff_bits(np.ones(6, dtype=np.uint8)))
+
+    def test_find_flags(self):
+        bits = np.concatenate((FLAG, [1, 0, 1], FLAG, FLAG)).astype(np.uint8)
+        self.assertListEqual([0, 11, 19], find_flags(bits).tolist())
+
+    def _test_resynchronize(self, codec):
+        framer = HDLCFramer(codec)
+        frames = [bytes(range(i, i + 40)) for i in range(5)]
+        encoded = [framer.frame(frame) for frame in frames]
+        # wipe out more than the codec corrects in the second frame and slip a bit in the fourth
+        encoded[1][40:80] = 0
+        encoded[3] = np.delete(encoded[3], 50)
+        bits = np.concatenate([np.zeros(13, dtype=np.uint8)] + encoded)
+        got, dropped, remaining = [], 0, np.zeros(0, dtype=np.uint8)
+        for chunk in np.array_split(bits, 9):
+            remaining = np.concatenate((remaining, chunk))
+            result, consumed = framer.deframe_stream(remaining)
+            remaining = remaining[consumed:]
+            got.extend(result.frames)
+            dropped += result.dropped
+        self.assertListEqual([frames[0], frames[2], frames[4]], got)
+        self.assertEqual(2, dropped)
+
+    def test_resynchronize_hamming(self):
+        self._test_resynchronize(HammingCodec())
+
+    def test_resynchronize_reed_solomon(self):
+        self._test_resynchronize(ReedSolomonCodec(parity_size=4))
+
+    def test_resynchronize_convolutional(self):
+        self._test_resynchronize(ConvolutionalCodec())
+
+    def test_frame_too_large(self):
+        with self.assertRaises(ValueError):
+            HDLCFramer(HammingCodec(), max_frame_size=16).frame(bytes(17))
@@ -0,0 +1,33 @@
+import asyncio
+from aiofsk.hub import AudioHub
+from aiofsk.transport import AFSKTransport
+from tests import AsyncioTestCase
+
+
+class TestAudioHub(AsyncioTestCase):
+    async def test_channels_and_sub_bands(self):
+        hub = AudioHub(channels=2, loopback=True)
+        options = dict(modulator='nrzi', demodulator='goertzel', framing='hdlc', hub=hub)
+        # two tone pairs sharing channel 0 and a third modem alone on channel 1
+        modems = [
+            AFSKTransport(1200, channel=0, **options),
+            AFSKTransport(1200, channel=0, tones={'0': 3600, '1': 4800}, **options),
+            AFSKTransport(1200, channel=1, **options)
+        ]
+        for modem in modems:
+            await modem.connect()
+            self.addCleanup(modem.stop)
+        self.assertEqual(3, len(hub.ports))
+        messages = [b'\xffhello', b'\xffjake', b'\xffderp']
+        for modem, msg in zip(modems, messages):
+            modem.write(msg)
+        for modem, msg in zip(modems, messages):
+            self.assertEqual(msg, await modem.read(len(msg), timeout=1.0))
+        for modem in modems:
+            modem.stop()
+        await asyncio.sleep(0.05)
+        self.assertEqual(0, len(hub.ports))
+
+    def test_bad_channel(self):
+        with self.assertRaises(ValueError):
+            AudioHub(channels=2).attach(2, None, None)
@@ -0,0 +1,112 @@
+import json
+import unittest
+import numpy as np
+from aiofsk.hub import AudioHub
+from aiofsk.metrics import Metrics, NullMetrics, Histogram
+from aiofsk.transport import AFSKTransport
+from aiofsk.util import RingBuffer, SampleQueue
+from tests import VirtualClockTestCase
+
+
+class TestMetrics(unittest.TestCase):
+    def test_histogram(self):
+        histogram = Histogram((1, 10))
+        for value in (0.5, 1, 5, 50, 500):
+            histogram.observe(value)
+        self.assertListEqual([2, 1, 2], histogram.buckets)
+        self.assertEqual(5, histogram.count)
+        self.assertEqual(0.5, histogram.min)
+        self.assertEqual(500, histogram.max)
+
+    def test_snapshot(self):
+        metrics = Metrics()
+        metrics.increment('bits')
+        metrics.increment('bits', 7)
+        with metrics.timer('seconds'):
+            pass
+        queue = [1, 2, 3]
+        metrics.add_gauge('depth', lambda: len(queue))
+        queue.append(4)
+        snapshot = json.loads(json.dumps(metrics.snapshot()))
+        self.assertDictEqual({'bits': 8}, snapshot['counters'])
+        self.assertDictEqual({'depth': 4}, snapshot['gauges'])
+        self.assertEqual(1, snapshot['histograms']['seconds']['count'])
+
+    def test_null_metrics(self):
+        metrics = NullMetrics()
+        metrics.increment('bits')
+        metrics.observe('depth', 1)
+        metrics.add_gauge('depth', lambda: 1)
+        with metrics.timer('seconds'):
+            pass
+        self.assertDictEqual({'counters': {}, 'gauges': {}, 'histograms': {}}, metrics.snapshot())
+
+    def test_device_status(self):
+        class Status:
+            output_underflow = True
+            input_overflow = False
+
+        hub = AudioHub()
+        block = np.zeros((hub.blocksize, 1), dtype=np.float32)
+        hub._callback(block, block.copy(), hub.blocksize, None, Status())
+        self.assertEqual(1, hub.output_underflows)
+        self.assertEqual(0, hub.input_overflows)
+
+
+class TestTransportMetrics(VirtualClockTestCase):
+    async def _transfer(self, msg, **kwargs):
+        transport = AFSKTransport(1200, loopback=True, modulator='nrzi', metrics=Metrics(), **kwargs)
+        await transport.connect()
+        self.addCleanup(transport.stop)
+        transport.write(msg)
+        self.assertEqual(msg, await transport.read(len(msg), timeout=10))
+        return transport
+
+    async def test_transport_metrics(self):
+        snapshot = (await self._transfer(b'hello jake')).metrics.snapshot()
+        counters = snapshot['counters']
+        self.assertEqual(10, counters['bytes_modulated'])
+        self.assertEqual(10 * 16, counters['bits_modulated'])
+        self.assertEqual(10, counters['bytes_demodulated'])
+        self.assertGreaterEqual(counters['bits_demodulated'], 10 * 16)
+        self.assertEqual(0, counters['uncorrectable_blocks'])
+        self.assertGreater(counters['synchronizer_samples_dropped'], 0)
+        self.assertEqual(1, snapshot['histograms']['modulate_seconds']['count'])
+        self.assertGreater(snapshot['histograms']['demodulate_seconds']['count'], 0)
+        self.assertGreater(snapshot['histograms']['synchronized_frames']['count'], 0)
+        self.assertGreater(snapshot['histograms']['synchronize_seconds']['count'], 0)
+        self.assertEqual(0, snapshot['gauges']['output_underruns'])
+        self.assertEqual(0, snapshot['gauges']['audio_out_samples'])
+        self.assertEqual(0, snapshot['gauges']['write_buffer_size'])
+        json.dumps(snapshot)
+
+    async def test_transport_metrics_framed(self):
+        transport = await self._transfer(b'hello jake', reliable=True)
+        await transport.arq.wait_acknowledged()
+        snapshot = transport.metrics.snapshot()
+        self.assertGreaterEqual(snapshot['counters']['frames_received'], 2)  # data and ack
+        self.assertEqual(0, snapshot['counters']['frames_dropped'])
+        self.assertEqual(0, snapshot['gauges']['arq_retransmissions'])
+
+    async def test_metrics_off_by_default(self):
+        transport = AFSKTransport(1200, loopback=True)
+        self.assertFalse(transport.metrics.enabled)
+        self.assertFalse(transport.modulator.metrics.enabled)
+
+    async def test_output_underruns(self):
+        hub = AudioHub()
+        audio_out = RingBuffer(4 * hub.blocksize)
+        hub.attach(0, SampleQueue(hub.blocksize), audio_out)
+        outdata = np.zeros((hub.blocksize, 1), dtype=np.float32)
+        # the end of a transmission is padded with silence
+        audio_out.write(np.ones(hub.blocksize + hub.blocksize // 2, dtype=np.float32))
+        for _ in range(3):
+            hub._play(outdata)
+        self.assertEqual(0, hub.output_underruns)
+        # more audio arriving right after the ring ran dry is a hole in the transmission
+        audio_out.write(np.ones(hub.blocksize // 2, dtype=np.float32))
+        hub._play(outdata)
+        audio_out.write(np.ones(hub.blocksize, dtype=np.float32))
+        hub._play(outdata)
+        self.assertEqual(1, hub.output_underruns)
+        self.assertTrue(np.all(outdata == 1))
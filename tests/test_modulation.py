@@ -1,8 +1,12 @@
+import asyncio
 import numpy as np
+import scipy.io.wavfile
 import matplotlib.pyplot as plt
-from aiofsk.modulation import Modulator
+from aiofsk.modulation import Modulator, NonReturnToZeroModulator, MODULATORS, get_tone_table
+from aiofsk.modulation import TemplateDemodulator, VectorizedDemodulator, GoertzelDemodulator, FFTDemodulator
 from aiofsk.transport import AFSKTransport
-from aiofsk.file import write_wav, read_wav
+from aiofsk.file import write_wav, read_wav, iter_encode_wav, iter_decode_wav, iter_decode_wav_files
+from aiofsk.util import RingBuffer
 from tests import AsyncioTestCase
 
 
@@ -52,12 +56,16 @@ class ModulationTests(AsyncioTestCase):
     #             demodulated_bits.append(str(demodulate(demodulated_frame)))
     #     self.assertListEqual(bits, demodulated_bits)
 
-    async def _test_encode_decode(self, baud, modulator, msg=b'derp'):
-        transport = AFSKTransport(baud, loopback=True, modulator=modulator)
+    async def _test_encode_decode(self, baud, modulator, msg=b'derp', demodulator='vectorized', synchronizer='silence',
+                                  timeout=0.25, framing=None):
+        transport = AFSKTransport(
+            baud, loopback=True, modulator=modulator, demodulator=demodulator, synchronizer=synchronizer,
+            framing=framing
+        )
         await transport.connect()
         self.addCleanup(transport.stop)
         transport.write(msg)
-        demodulated = await transport.read(len(msg), timeout=0.25)
+        demodulated = await transport.read(len(msg), timeout=timeout)
         self.assertEqual(msg, demodulated)
 
     async def test_encode_decode_300_baud_standard(self):
@@ -66,15 +74,223 @@ class ModulationTests(AsyncioTestCase):
     async def test_encode_decode_1200_baud_standard(self):
         await self._test_encode_decode(1200, 'standard', b'\xffderp')
 
+    async def test_encode_decode_1200_baud_standard_goertzel(self):
+        await self._test_encode_decode(1200, 'standard', b'\xffderp', 'goertzel')
+
+    async def test_encode_decode_1200_baud_nrzi_preamble(self):
+        # the preamble synchronizer needs a preamble and a frame of look ahead on top of the message
+        await self._test_encode_decode(1200, 'nrzi', b'\xffderp', 'goertzel', 'preamble', timeout=1.0)
+
     async def test_encode_decode_300_baud_nrzi(self):
         await self._test_encode_decode(300, 'nrzi')
 
     async def test_encode_decode_1200_baud_nrzi(self):
         await self._test_encode_decode(1200, 'nrzi', b'\xffderp')
 
+    async def test_encode_decode_1200_baud_nrzi_hdlc(self):
+        await self._test_encode_decode(1200, 'nrzi', b'\xffderp', framing='hdlc', timeout=0.5)
+
+    async def test_encode_decode_1200_baud_reliable(self):
+        transport = AFSKTransport(1200, loopback=True, modulator='nrzi', reliable=True)
+        await transport.connect()
+        self.addCleanup(transport.stop)
+        msg = bytes(range(48))
+        transport.write(msg)
+        self.assertEqual(msg, await transport.read(len(msg), timeout=5))
+        await asyncio.wait_for(transport.arq.wait_acknowledged(), 10)
+
+    async def test_modulate_into_small_ring(self):
+        modulator = MODULATORS['nrzi'](AFSKTransport.baud_rate_options.make_baud_nt(2400))
+        with modulator.get_packet_modulation_context() as modulate_packet:
+            expected = np.concatenate([modulate_packet(b'\xffderp'), modulate_packet(b'jake')]).reshape(-1)
+        ring, data_in, queued = RingBuffer(256), asyncio.Queue(), []
+        data_in.put_nowait(b'\xffderp')
+        data_in.put_nowait(b'jake')
+        task = asyncio.create_task(modulator.modulate(data_in, ring, lambda *args: queued.append(args)))
+        self.addCleanup(task.cancel)
+        played = []
+        while sum(map(len, played)) < len(expected):
+            # a device callback taking a block at a time
+            await asyncio.sleep(0.001)
+            played.append(ring.read(100))
+        self.assertTrue(np.array_equal(expected, np.concatenate(played)))
+        self.assertListEqual([5, 4], [size for size, _ in queued])
+        self.assertEqual(len(expected), sum(samples for _, samples in queued))
+
+    def _test_modulate_packet(self, baud, modulator, msg=b'derp'):
+        modulator = MODULATORS[modulator](AFSKTransport.baud_rate_options.make_baud_nt(baud))
+        with modulator.get_modulation_context() as modulate_byte:
+            expected = np.concatenate([frame for c in msg for frame in modulate_byte(c)])
+        with modulator.get_packet_modulation_context() as modulate_packet:
+            waveform = modulate_packet(msg)
+        self.assertEqual(np.float32, waveform.dtype)
+        self.assertEqual(expected.shape, waveform.shape)
+        self.assertTrue(np.allclose(expected, waveform, atol=1e-6))
+
+    def test_modulate_packet_standard(self):
+        self._test_modulate_packet(300, 'standard', b'\xffderp')
+
+    def test_modulate_packet_nrzi(self):
+        self._test_modulate_packet(1200, 'nrzi', b'\xffderp\x00')
+
+    def test_modulate_packet_cpfsk(self):
+        self._test_modulate_packet(2400, 'cpfsk', b'\xffderp\x00')
+
+    def test_cpfsk_phase_continuous(self):
+        baud = AFSKTransport.baud_rate_options.make_baud_nt(2400)
+        waveforms = {}
+        for name in ('standard', 'cpfsk'):
+            with MODULATORS[name](baud).get_packet_modulation_context() as modulate_packet:
+                waveforms[name] = np.concatenate([modulate_packet(b'\xffderp'), modulate_packet(b'jake')]).reshape(-1)
+        # no sample to sample step bigger than the highest tone can make, across the packets too
+        max_step = 2 * np.pi * 2400 / 48000
+        self.assertLessEqual(np.abs(np.diff(waveforms['cpfsk'])).max(), max_step + 1e-5)
+        self.assertGreater(np.abs(np.diff(waveforms['standard'])).max(), 1.5)
+        # and less of the energy lands outside of the tones
+        out_of_band = {}
+        for name, waveform in waveforms.items():
+            power = np.abs(np.fft.rfft(waveform)) ** 2
+            frequencies = np.fft.rfftfreq(len(waveform), 1 / 48000)
+            out_of_band[name] = power[(frequencies < 600) | (frequencies > 3600)].sum() / power.sum()
+        self.assertLess(out_of_band['cpfsk'], out_of_band['standard'] / 2)
+
+    def test_tone_table_shared(self):
+        baud = AFSKTransport.baud_rate_options.make_baud_nt(1200)
+        first, second = Modulator(baud, 0.5), NonReturnToZeroModulator(baud, 0.5)
+        self.assertIs(first._tone_table, second._tone_table)
+        self.assertIs(first._tone_table, get_tone_table(baud, Modulator.tones, 0.5))
+        self.assertIsNot(first._tone_table, Modulator(baud, 1.0)._tone_table)
+        self.assertFalse(first._tone_table.frames.flags.writeable)
+        self.assertEqual(np.float32, first.modulate_bit('1').dtype)
+
+    def _test_demodulator_parity(self, baud, modulator):
+        modulator = MODULATORS[modulator](AFSKTransport.baud_rate_options.make_baud_nt(baud))
+        rng = np.random.default_rng(baud)
+        symbols = rng.integers(0, 2, 512)
+        frames = modulator._tone_table.frames[symbols] + rng.normal(0, 0.8, (512, modulator.frame_size))
+        frames = np.concatenate((frames, rng.uniform(-1, 1, (64, modulator.frame_size))))
+
+        # the per sample scorer the vectorized demodulator replaces
+        zero_mask = tuple(i[0] for i in modulator.modulate_bit('0'))
+        one_mask = tuple(i[0] for i in modulator.modulate_bit('1'))
+        expected = []
+        with modulator.get_decoder() as decode:
+            for frame in frames.reshape(-1, modulator.frame_size, 1):
+                zero_diff = sum(abs(a - b[0]) for (a, b) in zip(zero_mask, frame))
+                one_diff = sum(abs(a - b[0]) for (a, b) in zip(one_mask, frame))
+                expected.append(decode(one_diff < zero_diff))
+
+        self.assertListEqual(
+            TemplateDemodulator(modulator._tone_table).detect(frames).tolist(),
+            VectorizedDemodulator(modulator._tone_table).detect(frames).tolist()
+        )
+        with modulator.get_frame_demodulation_context() as demodulate_frames:
+            demodulated = np.concatenate([demodulate_frames(block) for block in np.array_split(frames, 7)])
+        self.assertListEqual(expected, demodulated.tolist())
+
+    def test_demodulator_parity_standard(self):
+        self._test_demodulator_parity(300, 'standard')
+
+    def test_demodulator_parity_nrzi(self):
+        self._test_demodulator_parity(2400, 'nrzi')
+
+    def _test_goertzel_phase_insensitive(self, baud):
+        modulator = Modulator(AFSKTransport.baud_rate_options.make_baud_nt(baud), demodulator='goertzel')
+        samples = np.arange(modulator.frame_size) / modulator.sample_rate
+        symbols, frames = [], []
+        for symbol in (0, 1):
+            tone = modulator.tones[str(symbol)]
+            for phase in np.linspace(0, 2 * np.pi, 12, endpoint=False):
+                symbols.append(symbol)
+                frames.append(0.3 * np.cos(2 * np.pi * tone * samples + phase))
+        self.assertListEqual(symbols, GoertzelDemodulator(modulator._tone_table).detect(np.array(frames)).tolist())
+
+    def test_goertzel_phase_insensitive(self):
+        for baud in (30, 300, 600, 1200, 2400):
+            self._test_goertzel_phase_insensitive(baud)
+
+    def test_fft_demodulator_matches_goertzel(self):
+        modulator = MODULATORS['mfsk16'](AFSKTransport.baud_rate_options.make_baud_nt(1200))
+        rng = np.random.default_rng(16)
+        symbols = rng.integers(0, 16, 512)
+        phases = rng.uniform(0, 2 * np.pi, (512, 1))
+        samples = np.arange(modulator.frame_size) / modulator.sample_rate
+        tones = np.array([modulator.tones[format(symbol, 'x')] for symbol in symbols]).reshape(-1, 1)
+        frames = 0.3 * np.cos(2 * np.pi * tones * samples + phases) + rng.normal(0, 0.1, (512, modulator.frame_size))
+        detected = FFTDemodulator(modulator.tone_table).detect(frames)
+        self.assertListEqual(GoertzelDemodulator(modulator.tone_table).detect(frames).tolist(), detected.tolist())
+        self.assertListEqual(symbols.tolist(), detected.tolist())
+        with self.assertRaises(ValueError):
+            FFTDemodulator(Modulator(AFSKTransport.baud_rate_options.make_baud_nt(2400)).tone_table)
+
+    async def test_read_write_wave_mfsk(self):
+        msg = bytes(range(256))
+        for modulator, baud in (('mfsk4', 300), ('mfsk8', 1200), ('mfsk16', 1200)):
+            await write_wav('derp.wav', msg, baud=baud, modulator=modulator)
+            self.assertEqual(msg, await read_wav('derp.wav', baud=baud, modulator=modulator))
+            bits_per_symbol = MODULATORS[modulator].tone_count.bit_length() - 1
+            # hamming blocks of 16 bits, padded to whole symbols
+            symbols = -(-16 // bits_per_symbol) * len(msg)
+            self.assertEqual(symbols * 48000 // baud, len(scipy.io.wavfile.read('derp.wav')[1]))
+
+    def test_mfsk_limits(self):
+        with self.assertRaises(ValueError):
+            MODULATORS['mfsk16'](AFSKTransport.baud_rate_options.make_baud_nt(2400))
+        with self.assertRaises(ValueError):
+            MODULATORS['mfsk8'](AFSKTransport.baud_rate_options.make_baud_nt(1200), codec='reed-solomon')
+
+    async def test_encode_decode_1200_baud_mfsk8_hdlc(self):
+        await self._test_encode_decode(1200, 'mfsk8', b'\xffderp', framing='hdlc', timeout=0.5)
+
+    async def test_read_write_wave_cpfsk(self):
+        msg = bytes(range(256))
+        for demodulator in ('goertzel', 'discriminator'):
+            await write_wav('derp.wav', msg, baud=2400, modulator='cpfsk')
+            self.assertEqual(msg, await read_wav('derp.wav', baud=2400, modulator='cpfsk', demodulator=demodulator))
+
+    async def test_encode_decode_2400_baud_cpfsk_preamble(self):
+        await self._test_encode_decode(2400, 'cpfsk', b'\xffderp', 'goertzel', 'preamble', timeout=1.0)
+
     async def _test_read_write_wave(self, msg=b'derp', baud=300):
         await write_wav('derp.wav', msg, baud=baud)
         self.assertEqual(msg, await read_wav('derp.wav', baud=baud))
 
     async def test_read_write_wave(self):
         return await self._test_read_write_wave(b'hello jake')
+
+    async def test_read_write_wave_goertzel_demodulator(self):
+        await write_wav('derp.wav', b'hello jake', baud=2400, modulator='nrzi')
+        self.assertEqual(
+            b'hello jake', await read_wav('derp.wav', baud=2400, modulator='nrzi', demodulator='goertzel')
+        )
+
+    async def test_read_write_wave_codecs(self):
+        for codec in ('reed-solomon', 'convolutional'):
+            await write_wav('derp.wav', b'hello jake' * 30, baud=1200, codec=codec)
+            self.assertEqual(b'hello jake' * 30, await read_wav('derp.wav', baud=1200, codec=codec))
+
+    async def test_iter_decode_wave(self):
+        msg = bytes(range(256)) * 4
+        await write_wav('derp.wav', msg, baud=2400, modulator='nrzi')
+        chunks = list(iter_decode_wav('derp.wav', baud=2400, modulator='nrzi', chunk_frames=100))
+        self.assertEqual(msg, b''.join(chunks))
+        self.assertGreater(len(chunks), 80)
+
+    async def test_decode_wav_files_segmented(self):
+        msg = bytes(range(256)) * 4
+        await write_wav('derp.wav', msg, baud=2400, modulator='nrzi')
+        segments = list(iter_decode_wav_files(
+            ['derp.wav', 'derp.wav'], max_workers=2, segment_frames=1000, baud=2400, modulator='nrzi'
+        ))
+        self.assertGreater(len(segments), 2)
+        self.assertEqual(msg * 2, b''.join(data for _, data in segments))
+        self.assertEqual(msg, await read_wav('derp.wav', baud=2400, modulator='nrzi'))
+
+    async def test_read_float_wave(self):
+        waveform = np.concatenate(list(iter_encode_wav((b'hello ', b'jake'), baud=1200)))
+        scipy.io.wavfile.write('derp.wav', 48000, waveform)
+        self.assertEqual(b'hello jake', await read_wav('derp.wav', baud=1200))
+
+    async def test_read_write_wave_template_demodulator(self):
+        await write_wav('derp.wav', b'hello jake', baud=1200)
+        self.assertEqual(b'hello jake', await read_wav('derp.wav', baud=1200, demodulator='template'))
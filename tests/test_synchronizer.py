@@ -1,5 +1,9 @@
+import asyncio
 import numpy as np
-from aiofsk.synchronizer import FrameSynchronizer
+from aiofsk.baud import DEFAULT_BAUD_OPTIONS, PREAMBLE
+from aiofsk.modulation import MODULATORS
+from aiofsk.synchronizer import FrameSynchronizer, PreambleSynchronizer
+from aiofsk.transport import AFSKTransport
 from aiofsk.util import DoubleEvent
 from tests import AsyncioTestCase
 
@@ -49,3 +53,83 @@ class TestFrameSynchronizer(AsyncioTestCase):
 
     async def test_sync_frames_165_offset(self):
         return await self._test_sync_frames(165)
+
+    async def test_sync_one_large_block(self):
+        frame_size = 48000 // 2400
+        receiving = DoubleEvent()
+        synchronizer = FrameSynchronizer(frame_size, receiving)
+        sync_task = self.loop.create_task(synchronizer.synchronize())
+        self.addCleanup(sync_task.cancel)
+        frames = np.random.default_rng(0).uniform(0.1, 1.0, (10, frame_size))
+        synchronizer.unsynchronized_audio_in.put_nowait(
+            np.concatenate((np.zeros(33), frames.reshape(-1))).reshape(-1, 1)
+        )
+        expected = np.concatenate(([0.0], frames.reshape(-1)))
+        for i in range(10):
+            window = await synchronizer.synchronized_audio_in.get()
+            self.assertEqual((frame_size, 1), window.shape)
+            self.assertTrue(np.allclose(expected[i * frame_size:(i + 1) * frame_size], window[:, 0]))
+        self.assertTrue(receiving.is_set())
+
+    async def test_deaf_while_sending(self):
+        frame_size = 48000 // 2400
+        receiving, sending = DoubleEvent(), DoubleEvent()
+        synchronizer = FrameSynchronizer(frame_size, receiving)
+        synchronizer.sending = sending
+        sync_task = self.loop.create_task(synchronizer.synchronize())
+        self.addCleanup(sync_task.cancel)
+        frames = np.random.default_rng(0).uniform(0.1, 1.0, (10, frame_size)).reshape(-1)
+        sending.set()
+        synchronizer.unsynchronized_audio_in.put_nowait(frames)
+        await asyncio.sleep(0.01)
+        self.assertTrue(synchronizer.synchronized_audio_in.empty())
+        self.assertFalse(receiving.is_set())
+        sending.clear()
+        synchronizer.unsynchronized_audio_in.put_nowait(frames)
+        self.assertTrue(np.allclose(frames[:frame_size], (await synchronizer.synchronized_audio_in.get())[:, 0]))
+        self.assertTrue(receiving.is_set())
+        # a transport on a sound device hears its own transmissions, in loopback that is the other end
+        transport = AFSKTransport(1200)
+        self.assertIs(transport._sending, transport.synchronizer.sending)
+        self.assertIsNone(AFSKTransport(1200, loopback=True).synchronizer.sending)
+
+
+class TestPreambleSynchronizer(AsyncioTestCase):
+    async def _test_preamble_sync(self, baud, modulator='standard', offset=0, ppm=0.0, noise=0.0):
+        rng = np.random.default_rng(baud)
+        modulator = MODULATORS[modulator](DEFAULT_BAUD_OPTIONS.make_baud_nt(baud), 0.2, 'goertzel', PREAMBLE)
+        receiving = DoubleEvent()
+        synchronizer = PreambleSynchronizer.from_modulator(modulator, receiving)
+        sync_task = self.loop.create_task(synchronizer.synchronize())
+        self.addCleanup(sync_task.cancel)
+
+        packets = [rng.integers(0, 256, 40, dtype=np.uint8).tobytes() for _ in range(2)]
+        with modulator.get_packet_modulation_context() as modulate_packet:
+            audio = np.concatenate([np.zeros(offset)] + [modulate_packet(packet)[:, 0] for packet in packets] +
+                                   [np.zeros(modulator.frame_size * 4)])
+        # resample to simulate the receiving sound card running at a different clock rate
+        audio = np.interp(np.arange(0, len(audio) - 1, 1 + ppm * 1e-6), np.arange(len(audio)), audio)
+        audio += rng.normal(0, noise, len(audio))
+        for block in np.array_split(audio, len(audio) // modulator.frame_size):
+            synchronizer.unsynchronized_audio_in.put_nowait(block.reshape(-1, 1))
+
+        frames = []
+        for _ in range(len(b''.join(packets)) * 16):
+            frames.append(await synchronizer.synchronized_audio_in.get())
+        with modulator.get_packet_demodulation_context() as demodulate_packets:
+            self.assertEqual(b''.join(packets), demodulate_packets(np.concatenate(frames)).data)
+        await asyncio.sleep(0)
+        self.assertTrue(synchronizer.synchronized_audio_in.empty())
+        self.assertFalse(synchronizer.locked)
+
+    async def test_preamble_sync_offset(self):
+        await self._test_preamble_sync(300, offset=77)
+
+    async def test_preamble_sync_noise(self):
+        await self._test_preamble_sync(1200, 'nrzi', offset=1234, noise=0.02)
+
+    async def test_preamble_sync_clock_drift(self):
+        await self._test_preamble_sync(1200, offset=5, ppm=-800.0, noise=0.01)
+
+    async def test_preamble_sync_clock_drift_2400_baud(self):
+        await self._test_preamble_sync(2400, offset=13, ppm=500.0, noise=0.01)
@@ -0,0 +1,158 @@
+import time
+import asyncio
+from aiofsk.transport import AFSKTransport, create_afsk_connection, open_afsk_connection, DEFAULT_INPUT_BLOCKS
+from tests import AsyncioTestCase, VirtualClockTestCase
+
+
+class RecordingProtocol(asyncio.Protocol):
+    def __init__(self):
+        self.transport = None
+        self.received = []
+        self.data = bytearray()
+        self.got_data = asyncio.Event()
+        self.paused = asyncio.Event()
+        self.resumed = asyncio.Event()
+        self.lost = False
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        self.received.append(data)
+        self.data += data
+        self.got_data.set()
+
+    def pause_writing(self):
+        self.paused.set()
+
+    def resume_writing(self):
+        self.resumed.set()
+
+    def connection_lost(self, exc):
+        self.lost = True
+
+
+class TestProtocol(AsyncioTestCase):
+    async def test_data_received_in_batches(self):
+        transport, protocol = await create_afsk_connection(RecordingProtocol, 1200, loopback=True, modulator='nrzi')
+        self.addCleanup(transport.stop)
+        self.assertIs(transport, protocol.transport)
+        self.assertIs(protocol, transport.get_protocol())
+        msg = b'\xffhello jake'
+        transport.write(msg)
+        while len(protocol.data) < len(msg):
+            protocol.got_data.clear()
+            await asyncio.wait_for(protocol.got_data.wait(), 1.0)
+        self.assertEqual(msg, bytes(protocol.data))
+        transport.close()
+        await asyncio.sleep(0.05)
+        self.assertTrue(protocol.lost)
+
+    async def test_pause_reading_batches(self):
+        transport, protocol = await create_afsk_connection(RecordingProtocol, 1200, loopback=True, modulator='nrzi')
+        self.addCleanup(transport.stop)
+        transport.pause_reading()
+        self.assertFalse(transport.is_reading())
+        transport.write(b'\xffderp')
+        await asyncio.sleep(0.3)
+        self.assertListEqual([], protocol.received)
+        transport.resume_reading()
+        await asyncio.wait_for(protocol.got_data.wait(), 1.0)
+        # everything that arrived while paused is delivered at once
+        self.assertListEqual([b'\xffderp'], protocol.received)
+
+    async def test_write_watermarks(self):
+        transport, protocol = await create_afsk_connection(RecordingProtocol, 1200, loopback=True, modulator='nrzi')
+        self.addCleanup(transport.stop)
+        transport.set_write_buffer_limits(high=8)
+        self.assertEqual((2, 8), transport.get_write_buffer_limits())
+        transport.write(b'\xffderp')
+        self.assertFalse(protocol.paused.is_set())
+        transport.write(b'\xffderp')
+        self.assertTrue(protocol.paused.is_set())
+        self.assertEqual(10, transport.get_write_buffer_size())
+        await asyncio.wait_for(protocol.resumed.wait(), 1.0)
+        self.assertLessEqual(transport.get_write_buffer_size(), 2)
+
+
+class TestStreams(AsyncioTestCase):
+    async def test_open_afsk_connection(self):
+        reader, writer = await open_afsk_connection(1200, loopback=True, modulator='nrzi')
+        self.addCleanup(writer.close)
+        writer.write(b'\xffhello\njake\n')
+        await asyncio.wait_for(writer.drain(), 1.0)
+        self.assertEqual(b'\xffhello\n', await asyncio.wait_for(reader.readline(), 1.0))
+        self.assertEqual(b'jake', await asyncio.wait_for(reader.readexactly(4), 1.0))
+        self.assertEqual(b'\n', await asyncio.wait_for(reader.readuntil(b'\n'), 1.0))
+        writer.close()
+        self.assertEqual(b'', await asyncio.wait_for(reader.read(-1), 1.0))
+
+    async def test_drain_waits_for_the_write_buffer(self):
+        reader, writer = await open_afsk_connection(1200, loopback=True, modulator='nrzi')
+        self.addCleanup(writer.close)
+        writer.transport.set_write_buffer_limits(high=8)
+        writer.write(bytes(range(32)))
+        await asyncio.wait_for(writer.drain(), 2.0)
+        self.assertLessEqual(writer.transport.get_write_buffer_size(), 2)
+        self.assertEqual(bytes(range(32)), await asyncio.wait_for(reader.readexactly(32), 1.0))
+
+
+class TestVirtualClock(VirtualClockTestCase):
+    async def test_soak_300_baud(self):
+        transport = AFSKTransport(300, loopback=True)
+        await transport.connect()
+        self.addCleanup(transport.stop)
+        msg = bytes(range(256))
+        started = time.perf_counter()
+        transport.write(msg)
+        # 16 hamming bits a byte, about 14 seconds on the air
+        self.assertEqual(msg, await transport.read(len(msg), timeout=30))
+        self.assertAlmostEqual(len(msg) * 16 / 300, self.loop.time(), delta=0.5)
+        self.assertLess(time.perf_counter() - started, self.loop.time())
+
+    async def test_timeouts_in_samples(self):
+        transport = AFSKTransport(300, loopback=True)
+        await transport.connect()
+        self.addCleanup(transport.stop)
+        transport.write(b'derp')
+        # 64 bits take 0.21 seconds of audio
+        with self.assertRaises(asyncio.TimeoutError):
+            await transport.read(4, timeout=0.15)
+        self.assertAlmostEqual(0.15, self.loop.time(), delta=0.01)
+        self.assertEqual(b'derp', await transport.read(4, timeout=0.15))
+
+    async def test_batched_input(self):
+        transport = AFSKTransport(1200, loopback=True)
+        callbacks = 0
+        record = transport.hub._record
+
+        def count_callbacks(indata):
+            nonlocal callbacks
+            callbacks += 1
+            record(indata)
+
+        transport.hub._record = count_callbacks
+        await transport.connect()
+        self.addCleanup(transport.stop)
+        transport.write(b'hello jake')
+        self.assertEqual(b'hello jake', await transport.read(10, timeout=10))
+        self.assertLess(transport._audio_in.wakeups, callbacks)
+        # between transmissions the loop is woken once every few device blocks, not once a block
+        wakeups, callbacks = transport._audio_in.wakeups, 0
+        await asyncio.sleep(2)
+        self.assertLessEqual(transport._audio_in.wakeups - wakeups, callbacks // DEFAULT_INPUT_BLOCKS + 1)
+        self.assertGreater(callbacks, 4 * DEFAULT_INPUT_BLOCKS)
+
+    async def test_reliable_soak(self):
+        transport = AFSKTransport(1200, loopback=True, modulator='nrzi', reliable=True)
+        framer, framed = transport.modulator.framer, []
+        frame = framer.frame
+        framer.frame = lambda data: framed.append(data) or frame(data)
+        await transport.connect()
+        self.addCleanup(transport.stop)
+        msg = bytes(range(256)) * 4
+        transport.write(msg)
+        self.assertEqual(msg, await transport.read(len(msg), timeout=60))
+        await asyncio.wait_for(transport.arq.wait_acknowledged(), 60)
+        # pacing the bursts does not frame anything a second time
+        self.assertEqual(transport._queued_frames, len(framed))
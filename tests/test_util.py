@@ -0,0 +1,56 @@
+import asyncio
+import unittest
+import threading
+import numpy as np
+from aiofsk.util import DoubleEvent, RingBuffer, SampleQueue
+from tests import AsyncioTestCase
+
+
+class TestRingBuffer(unittest.TestCase):
+    def test_wrap_around(self):
+        ring = RingBuffer(8)
+        self.assertEqual(6, ring.write(np.arange(6)))
+        self.assertListEqual([0.0, 1.0, 2.0, 3.0], ring.read(4).tolist())
+        self.assertEqual(6, ring.write(np.arange(6, 20)))
+        self.assertEqual(8, len(ring))
+        self.assertEqual(0, ring.free)
+        self.assertListEqual([4.0, 5.0, 6.0], ring.peek(3).tolist())
+        self.assertEqual(2, ring.discard(2))
+        self.assertListEqual([6.0, 7.0, 8.0, 9.0, 10.0, 11.0], ring.read(100).tolist())
+        self.assertEqual(0, len(ring))
+
+
+class TestSampleQueue(AsyncioTestCase):
+    async def test_batched_wakeups(self):
+        samples = SampleQueue(4096, notify_samples=200)
+        blocks = np.arange(2000, dtype=np.float32).reshape(-1, 20)
+        # an audio thread writing small device blocks, followed by a notification's worth of silence like a
+        # stream that keeps running
+        thread = threading.Thread(
+            target=lambda: [samples.put_threadsafe(block) for block in blocks] + [samples.put_threadsafe(np.zeros(200))]
+        )
+        thread.start()
+        received = []
+        while sum(map(len, received)) < 2000:
+            received.append(await asyncio.wait_for(samples.get(), 1.0))
+        thread.join()
+        self.assertListEqual(blocks.reshape(-1).tolist(), np.concatenate(received)[:2000].tolist())
+        self.assertLessEqual(samples.wakeups, len(blocks) // 10 + 1)
+        self.assertEqual(0, samples.overruns)
+
+    async def test_active_wakes_every_write(self):
+        active = DoubleEvent()
+        samples = SampleQueue(4096, notify_samples=200, active=active)
+        samples.put_threadsafe(np.zeros(20))
+        self.assertEqual(0, samples.wakeups)
+        active.set()
+        samples.put_threadsafe(np.zeros(20))
+        self.assertEqual(1, samples.wakeups)
+        self.assertEqual(40, len(await samples.get()))
+
+    async def test_overrun(self):
+        samples = SampleQueue(100)
+        samples.put_nowait(np.arange(150))
+        self.assertEqual(50, samples.overruns)
+        self.assertListEqual(list(range(100)), (await samples.get()).tolist())
+        self.assertTrue(samples.empty())